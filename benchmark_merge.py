@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+发票合并性能基准脚本
+用合成的手机截图/发票图片测量合并各环节的耗时与画质差异
+
+用法:
+    python benchmark_merge.py resample      # 缩放质量档位：速度 vs 画质差异
+    python benchmark_merge.py rotate        # 先旋转后缩放 vs 先缩放后转置：耗时与峰值内存
+    python benchmark_merge.py service       # 每次上传启动一次脚本 vs 常驻 HTTP 服务：延迟与吞吐
+    python benchmark_merge.py startup       # 各入口的导入、首个窗口与首次合并耗时，并保存 -X importtime 报告
+    python benchmark_merge.py engine        # 各入口经同一合并引擎的渲染/合成/编码分阶段耗时
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+from merge_engine import RESAMPLE_STRATEGIES, fit_into, resize_image
+
+
+def make_screenshot(size: Tuple[int, int] = (1290, 2796)) -> Image.Image:
+    """生成类似手机截图的测试图：文字行、色块和细线"""
+    w, h = size
+    img = Image.new("RGB", size, (246, 246, 246))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, w, h // 12), fill=(255, 80, 0))
+    for row, y in enumerate(range(h // 10, h, 48)):
+        shade = 30 + (row * 37) % 120
+        draw.rectangle((60, y, 60 + (row * 97) % (w - 160) + 80, y + 22), fill=(shade, shade, shade))
+        draw.line((40, y + 36, w - 40, y + 36), fill=(220, 220, 220), width=2)
+    for i in range(6):
+        x = 80 + i * (w - 160) // 6
+        draw.ellipse((x, h // 2, x + 120, h // 2 + 120), outline=(20, 120, 220), width=6)
+    return img
+
+
+def timeit(fn: Callable[[], object], repeat: int = 5) -> float:
+    """返回多次运行的最短耗时（毫秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def image_difference(a: Image.Image, b: Image.Image) -> Tuple[float, int]:
+    """返回 (平均绝对误差, 最大误差)，按 0-255 通道值计"""
+    diff = ImageChops.difference(a, b)
+    mean = sum(ImageStat.Stat(diff).mean) / 3
+    peak = max(hi for _, hi in diff.getextrema())
+    return mean, peak
+
+
+def bench_resample() -> List[str]:
+    """各缩放档位在 4x / 6x / 8x 缩小时的速度与画质差异（以 best 为基准）"""
+    source = make_screenshot()
+    lines = [f"源图 {source.size[0]}x{source.size[1]}",
+             f"{'缩小倍数':<8}{'档位':<10}{'耗时(ms)':>10}{'加速':>8}{'平均误差':>10}{'最大误差':>10}"]
+    for factor in (4, 6, 8):
+        target = (source.size[0] // factor, source.size[1] // factor)
+        reference = resize_image(source, target, "best")
+        best_ms = timeit(lambda: resize_image(source, target, "best"))
+        for strategy in RESAMPLE_STRATEGIES:
+            ms = best_ms if strategy == "best" else timeit(lambda: resize_image(source, target, strategy))
+            mean, peak = image_difference(resize_image(source, target, strategy), reference)
+            lines.append(f"{factor}x{'':<6}{strategy:<10}{ms:>10.1f}{best_ms / ms:>7.1f}x{mean:>10.2f}{peak:>10}")
+    return lines
+
+
+# 在独立子进程中执行一种旋转方式，输出峰值内存增量（KB）。
+# Linux 上 ru_maxrss 会跨 exec 继承父进程的峰值，因此优先读取 /proc/self/status 的 VmHWM。
+_ROTATE_PEAK_SCRIPT = """
+import sys
+sys.path.insert(0, {root!r})
+from benchmark_merge import make_screenshot, peak_rss_kb
+from merge_engine import fit_into
+src = make_screenshot((4032, 3024))
+before = peak_rss_kb()
+if {fused!r}:
+    fit_into(src, 1200, 1600, rotate=True)
+else:
+    fit_into(src.rotate(90, expand=True), 1200, 1600)
+print(peak_rss_kb() - before)
+"""
+
+
+def peak_rss_kb() -> int:
+    """当前进程的峰值常驻内存（KB）"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _rotate_peak_kb(fused: bool) -> str:
+    try:
+        import resource  # noqa: F401  仅 Unix 可用
+    except ImportError:
+        return "n/a"
+    root = os.path.dirname(os.path.abspath(__file__))
+    code = _ROTATE_PEAK_SCRIPT.format(root=root, fused=fused)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    return result.stdout.strip() or "n/a"
+
+
+def bench_rotate() -> List[str]:
+    """需要旋转的 12MP 照片：旧流程 rotate(90) 后缩放 vs 新流程缩放后 ROTATE_90 转置"""
+    source = make_screenshot((4032, 3024))
+    area = (1200, 1600)
+
+    def old_path() -> Image.Image:
+        return fit_into(source.rotate(90, expand=True), *area)
+
+    def new_path() -> Image.Image:
+        return fit_into(source, *area, rotate=True)
+
+    old_ms = timeit(old_path)
+    new_ms = timeit(new_path)
+    mean, peak = image_difference(old_path(), new_path())
+    return [
+        f"源图 {source.size[0]}x{source.size[1]}，目标区域 {area[0]}x{area[1]}",
+        f"{'流程':<14}{'耗时(ms)':>10}{'峰值内存增量(KB)':>18}",
+        f"{'先旋转后缩放':<12}{old_ms:>10.1f}{_rotate_peak_kb(False):>18}",
+        f"{'先缩放后转置':<12}{new_ms:>10.1f}{_rotate_peak_kb(True):>18}",
+        f"加速 {old_ms / new_ms:.1f}x，像素差异：平均 {mean:.3f}，最大 {peak}",
+    ]
+
+
+def bench_service(requests: int = 8, workers: int = 2) -> List[str]:
+    """单套文件：每次启动一次 merge_invoices.py 与向常驻服务上传的延迟和吞吐"""
+    import threading
+    import urllib.request
+
+    import merge_invoices_service as service_mod
+    from test_merge_core import make_sample_triplet
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "merge_invoices.py")
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder, "基准")
+        fields = {}
+        for field, key in (("invoice", "pdf"), ("buy", "buy"), ("pay", "pay")):
+            with open(files[key], "rb") as f:
+                fields[field] = (os.path.basename(files[key]), f.read())
+
+        # 旧方式：每次上传启动一次解释器，处理只含这一套文件的目录
+        out_dir = os.path.join(folder, "已合并")
+        process_times = []
+        for _ in range(requests):
+            shutil.rmtree(out_dir, ignore_errors=True)
+            start = time.perf_counter()
+            subprocess.run([sys.executable, script, folder, "--in-process"], check=True, capture_output=True)
+            process_times.append(time.perf_counter() - start)
+
+    service = service_mod.MergeService(workers=workers, max_queue=requests)
+    service.warm_up()
+    server = service_mod.make_server(service, port=0, quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://%s:%d/merge?format=pdf" % server.server_address[:2]
+    content_type, body = service_mod.encode_multipart(fields)
+
+    def upload() -> float:
+        start = time.perf_counter()
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+        with urllib.request.urlopen(request, timeout=120) as response:
+            response.read()
+        return time.perf_counter() - start
+
+    try:
+        upload()
+        service_times = [upload() for _ in range(requests)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda _: upload(), range(requests)))
+        concurrent_seconds = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+    process_mean = sum(process_times) / len(process_times)
+    service_mean = sum(service_times) / len(service_times)
+    return [
+        f"{'方式':<22}{'平均延迟(ms)':>14}{'吞吐(套/秒)':>14}",
+        f"{'每次启动脚本':<18}{process_mean * 1000:>14.0f}{1 / process_mean:>14.2f}",
+        f"{'常驻服务（串行）':<16}{service_mean * 1000:>14.0f}{1 / service_mean:>14.2f}",
+        f"{f'常驻服务（{workers} 并发）':<15}{concurrent_seconds / requests * 1000:>14.0f}"
+        f"{requests / concurrent_seconds:>14.2f}",
+        f"单次延迟降低 {process_mean / service_mean:.1f}x",
+    ]
+
+
+# 从启动解释器开始计时（父进程传入 time.time()），依次记录导入完成、窗口显示、首次合并完成的时间
+_STARTUP_SCRIPT = """
+import json, sys, time
+t0 = {t0!r}
+sys.path.insert(0, {root!r})
+import {module} as entry
+result = {{"import": time.time() - t0, "window": None}}
+if {factory!r}:
+    try:
+        app = getattr(entry, {factory!r})()
+        app.root.update()
+        result["window"] = time.time() - t0
+        app.root.destroy()
+    except Exception as e:
+        # 没有图形显示环境（或缺少 tkinterdnd2）时只记录导入时间
+        result["window_error"] = str(e).splitlines()[0]
+start = time.time()
+if {factory!r}:
+    from merge_invoices_simple import merge_simple
+    merge_simple({pdf!r}, {buy!r}, {pay!r}, {output!r})
+else:
+    import contextlib, io
+    with contextlib.redirect_stdout(io.StringIO()):
+        entry.main([{folder!r}, "--in-process"])
+result["merge"] = time.time() - start
+print(json.dumps(result))
+"""
+
+# (入口模块, 窗口类)；命令行入口没有窗口
+STARTUP_ENTRIES = [
+    ("invoice_merger_v5_stable", "SimpleInvoiceMergerV5"),
+    ("invoice_merger_v5", "DragDropInvoiceMergerV5"),
+    ("merge_invoices_gui", "InvoiceMergerGUI"),
+    ("merge_invoices", ""),
+]
+STARTUP_REPORT_DIR = "启动基准"
+
+
+def startup_release() -> str:
+    """报告所属的版本：环境变量 INVOICE_RELEASE，其次 git describe，都没有时为 dev"""
+    release = os.environ.get("INVOICE_RELEASE")
+    if release:
+        return release
+    try:
+        result = subprocess.run(["git", "describe", "--tags", "--always", "--dirty"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return result.stdout.strip() or "dev"
+    except (OSError, subprocess.SubprocessError):
+        return "dev"
+
+
+def measure_startup(module: str, factory: str, files: dict, folder: str, repeat: int = 3) -> dict:
+    """在新的解释器中启动入口，返回各阶段耗时的中位数（秒）"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for i in range(repeat):
+        shutil.rmtree(os.path.join(folder, "已合并"), ignore_errors=True)
+        code = _STARTUP_SCRIPT.format(t0=time.time(), root=root, module=module, factory=factory, folder=folder,
+                                      output=os.path.join(folder, f"启动基准_{i}.pdf"), **files)
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=folder)
+        if result.returncode != 0:
+            return {"error": (result.stderr.strip().splitlines() or ["启动失败"])[-1]}
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    summary = {}
+    for key in ("import", "window", "merge"):
+        values = sorted(run[key] for run in runs if run.get(key) is not None)
+        summary[key] = values[len(values) // 2] if values else None
+    if "window_error" in runs[-1]:
+        summary["window_error"] = runs[-1]["window_error"]
+    return summary
+
+
+def save_importtime(module: str, report_dir: str) -> float:
+    """保存 python -X importtime 的原始报告，返回导入总耗时（毫秒）"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=root)
+    with open(os.path.join(report_dir, f"importtime_{module}.txt"), "w", encoding="utf-8") as f:
+        f.write(result.stderr)
+    lines = [line for line in result.stderr.splitlines() if line.rstrip().endswith(f"| {module}")]
+    return int(lines[-1].split("|")[1]) / 1000 if lines else float("nan")
+
+
+def bench_startup() -> List[str]:
+    """各入口的冷启动：导入、显示首个窗口、首次合并的耗时；-X importtime 报告按版本保存"""
+    from test_merge_core import make_sample_triplet
+
+    def ms(seconds):
+        return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+    release = startup_release()
+    report_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), STARTUP_REPORT_DIR, release)
+    os.makedirs(report_dir, exist_ok=True)
+
+    lines = [f"{'入口':<28}{'导入(ms)':>10}{'importtime(ms)':>16}{'首个窗口(ms)':>14}{'首次合并(ms)':>14}"]
+    report = {"release": release, "python": sys.version.split()[0], "platform": sys.platform, "entries": {}}
+    notes = []
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder, "启动基准")
+        files = {"pdf": files["pdf"], "buy": files["buy"], "pay": files["pay"]}
+        for module, factory in STARTUP_ENTRIES:
+            result = measure_startup(module, factory, files, folder)
+            if "error" in result:
+                lines.append(f"{module:<28}启动失败：{result['error']}")
+                continue
+            result["importtime"] = save_importtime(module, report_dir)
+            report["entries"][module] = result
+            lines.append(f"{module:<28}{ms(result['import']):>10}{result['importtime']:>16.0f}"
+                         f"{ms(result['window']):>14}{ms(result['merge']):>14}")
+            if result.get("window_error"):
+                notes.append(f"{module} 未显示窗口：{result['window_error']}")
+
+    with open(os.path.join(report_dir, "startup.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return lines + notes + [f"报告已保存到 {report_dir}"]
+
+
+def engine_frontends(files: dict, folder: str) -> List[Tuple[str, Callable[[], object]]]:
+    """调用合并引擎的各入口（均在当前进程中执行，阶段钩子可以统计到）"""
+    import io
+
+    import invoice_batch
+    import merge_invoices
+    import merge_invoices_service
+    from merge_invoices_simple import merge_simple
+    from merge_pipeline import MergePipeline
+
+    with open(files["pdf"], "rb") as f:
+        pdf_bytes = f.read()
+    uploads = {"invoice": ("发票.pdf", pdf_bytes)}
+    for field in ("buy", "pay"):
+        with open(files[field], "rb") as f:
+            uploads[field] = (os.path.basename(files[field]), f.read())
+    out_path = os.path.join(folder, "引擎基准.pdf")
+    job = {"key": "引擎基准", "out_path": out_path, **files}
+
+    def pipeline() -> None:
+        for _, _, error in MergePipeline().run([dict(job)]):
+            if error:
+                raise error
+
+    return [
+        ("命令行 merge_to_output", lambda: merge_invoices.merge_to_output(files["pdf"], files["buy"], files["pay"],
+                                                                       out_path)),
+        ("命令行 --pipeline", pipeline),
+        ("图形界面 merge_simple", lambda: merge_simple(files["pdf"], files["buy"], files["pay"], io.BytesIO())),
+        ("批量队列 merge_group", lambda: invoice_batch.merge_group(files)),
+        ("HTTP 服务 merge_uploaded", lambda: merge_invoices_service.merge_uploaded(uploads)),
+    ]
+
+
+def bench_engine(repeat: int = 3) -> List[str]:
+    """各入口经同一合并引擎的分阶段耗时（阶段钩子 merge_engine.add_stage_hook，取多次运行的最短值）"""
+    import contextlib
+    import io
+
+    import merge_engine
+    from test_merge_core import make_sample_triplet
+
+    lines = [f"{'入口':<24}" + "".join(f"{stage + '(ms)':>14}" for stage in merge_engine.STAGE_NAMES)
+             + f"{'总计(ms)':>12}"]
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder, "引擎基准")
+        files = {"pdf": files["pdf"], "buy": files["buy"], "pay": files["pay"]}
+        for name, run in engine_frontends(files, folder):
+            best = {stage: float("inf") for stage in merge_engine.STAGE_NAMES}
+            best_total = float("inf")
+            for _ in range(repeat):
+                stages: dict = {}
+
+                def hook(stage: str, seconds: float) -> None:
+                    stages[stage] = stages.get(stage, 0.0) + seconds
+
+                merge_engine.add_stage_hook(hook)
+                start = time.perf_counter()
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        run()
+                finally:
+                    merge_engine.remove_stage_hook(hook)
+                best_total = min(best_total, time.perf_counter() - start)
+                for stage in best:
+                    best[stage] = min(best[stage], stages.get(stage, float("inf")))
+            lines.append(f"{name:<24}" + "".join(f"{best[stage] * 1000:>14.0f}" for stage in best)
+                         + f"{best_total * 1000:>12.0f}")
+    return lines + ["总计包含读写文件与发票数据提取（批量队列、HTTP 服务）等引擎之外的耗时"]
+
+
+BENCHMARKS = {
+    "resample": bench_resample,
+    "rotate": bench_rotate,
+    "service": bench_service,
+    "startup": bench_startup,
+    "engine": bench_engine,
+}
+
+
+def main(argv: List[str]) -> int:
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"未知的基准: {name}，可选: {', '.join(BENCHMARKS)}")
+            return 1
+        print(f"\n=== {name}: {BENCHMARKS[name].__doc__} ===")
+        for line in BENCHMARKS[name]():
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
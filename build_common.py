@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+打包脚本共用的 PyInstaller 选项
+
+--onefile 每次启动都要把整个程序包解压到临时目录，再从中导入模块，杀毒软件还会逐个扫描解压出的文件；
+--onedir 直接从安装目录加载，省去解压，启动明显更快。onedir 模式下同时：
+- 排除程序不使用、但会被依赖链顺带收集的模块（PyPDF2、numpy 等），减小体积与扫描量
+- 不使用 UPX 压缩（启动时还要解压每个 DLL）
+- 以 --optimize 2 预编译字节码（去掉 assert 与文档字符串）
+
+启动时间可用 check_startup.py 对比打包结果与基线。
+"""
+
+import os
+import sys
+from typing import List
+
+# 程序不使用的模块；PyPDF2 已不再使用，其余为开发环境中常见、会被顺带收集的大型库
+EXCLUDED_MODULES = [
+    'PyPDF2',
+    'numpy',
+    'pandas',
+    'matplotlib',
+    'scipy',
+    'IPython',
+    'pytest',
+    'setuptools',
+    'pip',
+    'tkinter.test',
+    'lib2to3',
+    'pydoc_data',
+]
+
+
+def mode_arguments(onedir: bool) -> List[str]:
+    """onefile / onedir 模式对应的 PyInstaller 参数"""
+    if not onedir:
+        return ['--onefile']
+    args = ['--onedir', '--noupx', '--optimize', '2']
+    for module in EXCLUDED_MODULES:
+        args.extend(['--exclude-module', module])
+    return args
+
+
+def data_argument(path: str, dest: str = '.') -> str:
+    """--add-data 的参数，分隔符随平台不同（Windows 为分号，其他为冒号）"""
+    return f'{path}{os.pathsep}{dest}'
+
+
+def executable_path(dist_dir: str, name: str, onedir: bool) -> str:
+    """打包结果中可执行文件的路径"""
+    exe = name + ('.exe' if sys.platform == 'win32' else '')
+    return os.path.join(dist_dir, name, exe) if onedir else os.path.join(dist_dir, exe)
@@ -4,13 +4,20 @@
 """
 发票合并工具 v5.0 稳定版 - 打包脚本
 使用 PyInstaller 将程序打包为 exe 可执行文件
+
+用法:
+    python build_stable_exe.py            # 单个 exe 文件（每次启动需解压）
+    python build_stable_exe.py --onedir   # 文件夹形式，启动更快（见 build_common.py）
 """
 
 import os
 import sys
 import subprocess
 import shutil
-from pathlib import Path
+
+from build_common import data_argument, executable_path, mode_arguments
+
+APP_NAME = '发票合并工具v5稳定版'
 
 
 def check_dependencies():
@@ -19,7 +26,6 @@ def check_dependencies():
     
     required_packages = [
         'PyInstaller',
-        'PyPDF2', 
         'Pillow',
         'pypdfium2',
         'tkinterdnd2'
@@ -51,45 +57,38 @@ def check_dependencies():
     return True
 
 
-def create_build_command():
+def create_build_command(onedir=False):
     """创建 PyInstaller 打包命令"""
     
     # 基本参数
     cmd = [
         'pyinstaller',
-        '--onefile',                    # 打包为单个exe文件
+        *mode_arguments(onedir),        # 单个exe文件 / 文件夹（启动更快）
         '--windowed',                   # 隐藏控制台窗口
-        '--name=发票合并工具v5稳定版',      # 设置exe文件名
+        f'--name={APP_NAME}',           # 设置exe文件名
         '--icon=NONE',                  # 暂不使用图标
         '--distpath=dist',              # 输出目录
         '--workpath=build',             # 临时文件目录
         '--specpath=.',                 # spec文件位置
     ]
     
-    # 添加隐式导入（确保所有依赖都被包含）
+    # 添加隐式导入：合并、预览与隔离进程模块在首次使用时才导入，明确列出以免漏收
     hidden_imports = [
         'PIL._tkinter_finder',
-        'tkinter',
-        'tkinter.messagebox',
-        'tkinter.filedialog',
-        'PyPDF2',
         'pypdfium2',
-        'csv',
-        'json',
-        're',
-        'datetime',
-        'tempfile',
-        'shutil',
-        'threading',
-        'pathlib'
+        'merge_invoices_simple',
+        'merge_engine',
+        'merge_sandbox',
+        'merge_preview',
     ]
     
     for imp in hidden_imports:
         cmd.extend(['--hidden-import', imp])
     
     # 添加数据文件（如果有）
-    if os.path.exists('merge_invoices_simple.py'):
-        cmd.extend(['--add-data', 'merge_invoices_simple.py;.'])
+    for module in ('merge_invoices_simple.py', 'merge_engine.py'):
+        if os.path.exists(module):
+            cmd.extend(['--add-data', data_argument(module)])
     
     # 添加主程序文件
     cmd.append('invoice_merger_v5_stable.py')
@@ -97,13 +96,13 @@ def create_build_command():
     return cmd
 
 
-def build_executable():
+def build_executable(onedir=False):
     """执行打包过程"""
     print("\n🚀 开始打包程序...")
     
     try:
         # 创建打包命令
-        cmd = create_build_command()
+        cmd = create_build_command(onedir)
         print(f"💻 执行命令: {' '.join(cmd)}")
         
         # 执行打包
@@ -113,9 +112,14 @@ def build_executable():
             print("✅ 打包成功！")
             
             # 检查输出文件
-            exe_path = os.path.join('dist', '发票合并工具v5稳定版.exe')
+            exe_path = executable_path('dist', APP_NAME, onedir)
             if os.path.exists(exe_path):
-                file_size = os.path.getsize(exe_path) / 1024 / 1024  # MB
+                if onedir:
+                    bundle_dir = os.path.dirname(exe_path)
+                    file_size = sum(os.path.getsize(os.path.join(root, name))
+                                    for root, _, names in os.walk(bundle_dir) for name in names) / 1024 / 1024
+                else:
+                    file_size = os.path.getsize(exe_path) / 1024 / 1024  # MB
                 print(f"📦 生成的exe文件: {exe_path}")
                 print(f"📏 文件大小: {file_size:.1f} MB")
                 
@@ -123,10 +127,13 @@ def build_executable():
                 release_dir = "发票合并工具v5稳定版_发布包"
                 if os.path.exists(release_dir):
                     shutil.rmtree(release_dir)
-                os.makedirs(release_dir)
                 
-                # 复制exe文件
-                shutil.copy2(exe_path, release_dir)
+                # 复制exe文件（文件夹模式复制整个文件夹，exe 需与 _internal 放在一起）
+                if onedir:
+                    shutil.copytree(os.path.dirname(exe_path), release_dir)
+                else:
+                    os.makedirs(release_dir)
+                    shutil.copy2(exe_path, release_dir)
                 
                 # 创建使用说明
                 create_readme(release_dir)
@@ -218,8 +225,10 @@ def cleanup():
             print(f"🗑️ 删除文件: {file_name}")
 
 
-def main():
+def main(argv=None):
     """主函数"""
+    argv = sys.argv[1:] if argv is None else argv
+    onedir = '--onedir' in argv
     print("=" * 60)
     print("📦 发票合并工具 v5.0 稳定版 - 打包程序")
     print("=" * 60)
@@ -236,7 +245,7 @@ def main():
         return 1
     
     # 执行打包
-    if build_executable():
+    if build_executable(onedir):
         cleanup()
         print("\n🎉 打包完成！")
         print("📁 发布包位置: 发票合并工具v5稳定版_发布包/")
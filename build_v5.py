@@ -12,6 +12,7 @@
 1. 确保已安装所有依赖: pip install pypdfium2 tkinterdnd2
 2. 安装 PyInstaller: pip install pyinstaller
 3. 运行打包脚本: python build_v5.py
+   文件夹形式（启动更快，见 build_common.py）: python build_v5.py --onedir
 
 生成的可执行文件将在 dist/ 目录下
 """
@@ -21,6 +22,10 @@ import subprocess
 import sys
 from pathlib import Path
 
+from build_common import data_argument, executable_path, mode_arguments
+
+APP_NAME = "发票合并工具_v5.0_智能版"
+
 def run_command(cmd, description=""):
     """运行命令并检查结果"""
     print(f"执行: {description}")
@@ -49,7 +54,7 @@ def check_pyinstaller():
     except subprocess.CalledProcessError:
         return False
 
-def build_executable():
+def build_executable(onedir=False):
     """构建可执行文件"""
     script_dir = Path(__file__).parent
     main_script = script_dir / "invoice_merger_v5.py"
@@ -67,14 +72,17 @@ def build_executable():
     # PyInstaller 命令参数
     cmd_parts = [
         sys.executable, "-m", "PyInstaller",
-        "--onefile",                          # 打包成单个文件
+        *mode_arguments(onedir),              # 打包成单个文件 / 文件夹（启动更快）
         "--windowed",                         # Windows下不显示控制台窗口
-        "--name", "发票合并工具_v5.0_智能版",    # 可执行文件名称
-        "--add-data", "merge_invoices_simple.py;.",  # 添加合并逻辑
+        "--name", APP_NAME,                   # 可执行文件名称
+        "--add-data", data_argument("merge_invoices_simple.py"),  # 添加合并逻辑
+        "--add-data", data_argument("merge_engine.py"),           # 合并引擎（渲染、布局、编码）
         "--hidden-import", "PIL._tkinter_finder",    # 确保PIL正常工作
         "--hidden-import", "pypdfium2",              # PDF处理库
         "--hidden-import", "tkinterdnd2",            # 拖放功能库
         "--hidden-import", "tkinter",                # GUI库
+        "--hidden-import", "merge_preview",          # 首次预览时才导入的模块
+        "--hidden-import", "invoice_batch",          # 首次打开批量队列时才导入的模块
         "--clean",                            # 清理临时文件
         str(main_script)
     ]
@@ -83,7 +91,7 @@ def build_executable():
     
     if run_command(cmd, "打包可执行文件"):
         print("\n✓ 打包完成！")
-        print(f"可执行文件位置: {script_dir / 'dist' / '发票合并工具_v5.0_智能版.exe'}")
+        print(f"可执行文件位置: {executable_path(str(script_dir / 'dist'), APP_NAME, onedir)}")
         print("\n✨ v5.0 版本特性:")
         print("• 🔍 智能发票数据提取 - 自动识别关键信息")
         print("• 📝 智能文件重命名 - 基于发票内容生成文件名")
@@ -109,7 +117,7 @@ a = Analysis(
     ['invoice_merger_v5.py'],
     pathex=[],
     binaries=[],
-    datas=[('merge_invoices_simple.py', '.')],
+    datas=[('merge_invoices_simple.py', '.'), ('merge_engine.py', '.')],
     hiddenimports=['PIL._tkinter_finder', 'pypdfium2', 'tkinterdnd2', 'tkinter'],
     hookspath=[],
     hooksconfig={},
@@ -155,7 +163,7 @@ if __name__ == "__main__":
     create_spec_file()
     
     # 执行打包
-    success = build_executable()
+    success = build_executable(onedir="--onedir" in sys.argv[1:])
     
     if success:
         print("\n🎉 v5.0 智能版打包成功！")
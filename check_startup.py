@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+启动时间回归检查 - 测量（打包后）图形界面从启动进程到窗口显示的时间，与基线对比
+
+程序在环境变量 INVOICE_STARTUP_PROBE 指定结果文件时，窗口第一次显示后写出各阶段时间并退出
+（见 startup_probe.py），因此可以无人值守地重复启动。各阶段时间均从本脚本启动进程的时刻算起：
+
+    import   主模块导入完成（onefile 模式包含解压时间）
+    window   窗口第一次显示
+    exit     进程退出
+
+Linux 上没有图形显示时，若已安装 Xvfb 会自动启动一个虚拟显示；否则只能测到 import 阶段。
+
+用法:
+    python build_stable_exe.py --onedir
+    python check_startup.py dist/发票合并工具v5稳定版/发票合并工具v5稳定版 --save-baseline 启动基准/baseline.json
+    python check_startup.py dist/发票合并工具v5稳定版/发票合并工具v5稳定版 --baseline 启动基准/baseline.json
+    python check_startup.py invoice_merger_v5_stable.py            # 直接测量源码（用当前解释器运行）
+
+超过基线 (1 + tolerance) 倍且多出 0.05 秒以上时返回 1，程序无法启动时返回 2。
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from startup_probe import PROBE_ENV, T0_ENV
+
+STAGES = ("import", "window", "exit")
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.25
+ABSOLUTE_SLACK = 0.05
+
+
+def program_command(program: str) -> List[str]:
+    """.py 文件用当前解释器运行，其他视为可执行文件"""
+    if program.endswith(".py"):
+        return [sys.executable, os.path.abspath(program)]
+    return [os.path.abspath(program)]
+
+
+def start_virtual_display() -> Optional[subprocess.Popen]:
+    """Linux 无图形显示时启动 Xvfb 并设置 DISPLAY；不需要或没有 Xvfb 时返回 None"""
+    if sys.platform in ("win32", "darwin") or os.environ.get("DISPLAY") or not shutil.which("Xvfb"):
+        return None
+    for number in range(99, 120):
+        if os.path.exists(f"/tmp/.X11-unix/X{number}"):
+            continue
+        server = subprocess.Popen(["Xvfb", f":{number}", "-nolisten", "tcp", "-screen", "0", "1280x1024x24"],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + 10
+        while time.time() < deadline and server.poll() is None:
+            if os.path.exists(f"/tmp/.X11-unix/X{number}"):
+                os.environ["DISPLAY"] = f":{number}"
+                return server
+            time.sleep(0.05)
+        server.kill()
+    return None
+
+
+def measure_once(command: List[str], timeout: float = 60) -> Dict[str, Any]:
+    """启动一次程序，返回各阶段时间（秒）；失败时带 error"""
+    with tempfile.TemporaryDirectory() as folder:
+        result_path = os.path.join(folder, "startup.json")
+        t0 = time.time()
+        env = dict(os.environ, **{PROBE_ENV: result_path, T0_ENV: repr(t0)})
+        try:
+            process = subprocess.run(command, env=env, cwd=folder, capture_output=True, text=True,
+                                     timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {"error": f"超过 {timeout} 秒仍未退出"}
+        exit_time = time.time() - t0
+        if not os.path.exists(result_path):
+            output = (process.stderr or process.stdout).strip().splitlines()
+            return {"error": output[-1] if output else f"未写出结果（返回码 {process.returncode}）"}
+        with open(result_path, encoding="utf-8") as f:
+            result = json.load(f)
+    result["exit"] = round(exit_time, 4)
+    # 已导入但窗口未能显示（通常是没有图形显示环境），保留已测到的阶段
+    result["window_error"] = result.pop("error", None)
+    return result
+
+
+def measure(program: str, repeat: int = DEFAULT_REPEAT, timeout: float = 60) -> Dict[str, Any]:
+    """重复启动 repeat 次，返回 {"runs": [...], "median": {阶段: 秒}, "first": {阶段: 秒}}。
+
+    第一次通常是冷启动（文件不在系统缓存中），单独列出，不计入中位数（只启动一次时除外）。
+    """
+    command = program_command(program)
+    runs = [measure_once(command, timeout) for _ in range(max(1, repeat))]
+    ok = [run for run in runs if not run.get("error")]
+    warm = ok[1:] or ok
+    median = {}
+    for stage in STAGES:
+        values = sorted(run[stage] for run in warm if run.get(stage) is not None)
+        if values:
+            median[stage] = values[len(values) // 2]
+    return {"program": program, "platform": sys.platform, "runs": runs, "first": ok[0] if ok else None,
+            "median": median}
+
+
+def compare(median: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """返回超过基线的阶段说明"""
+    regressions = []
+    for stage in STAGES:
+        if stage in median and stage in baseline:
+            limit = max(baseline[stage] * (1 + tolerance), baseline[stage] + ABSOLUTE_SLACK)
+            if median[stage] > limit:
+                regressions.append(f"{stage}: {median[stage] * 1000:.0f} ms，基线 {baseline[stage] * 1000:.0f} ms，"
+                                   f"上限 {limit * 1000:.0f} ms")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="测量图形界面的启动时间并与基线对比")
+    parser.add_argument("program", help="打包后的可执行文件，或 .py 源文件")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help=f"启动次数（默认 {DEFAULT_REPEAT}）")
+    parser.add_argument("--timeout", type=float, default=60, help="单次启动的超时秒数")
+    parser.add_argument("--baseline", help="基线 JSON 文件，超过时返回 1")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"允许比基线慢的比例（默认 {DEFAULT_TOLERANCE}）")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线")
+    args = parser.parse_args(argv)
+
+    display = start_virtual_display()
+    try:
+        report = measure(args.program, args.repeat, args.timeout)
+    finally:
+        if display:
+            display.terminate()
+
+    for i, run in enumerate(report["runs"], 1):
+        if run.get("error"):
+            print(f"第 {i} 次：启动失败：{run['error']}")
+        else:
+            stages = "，".join(f"{stage} {run[stage] * 1000:.0f} ms" for stage in STAGES if run.get(stage) is not None)
+            print(f"第 {i} 次：{stages}")
+    if not report["median"]:
+        print("❌ 程序无法启动")
+        return 2
+    print("中位数（不含第一次冷启动）：" + "，".join(f"{stage} {seconds * 1000:.0f} ms"
+                                                for stage, seconds in report["median"].items()))
+    if "window" not in report["median"]:
+        errors = [run["window_error"] for run in report["runs"] if run.get("window_error")]
+        print(f"⚠️ 窗口未能显示，只测到了导入时间（{errors[-1] if errors else '未知原因'}；Linux 可安装 Xvfb）")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["median"]
+        regressions = compare(report["median"], baseline, args.tolerance)
+        if regressions:
+            print("❌ 启动时间回归：")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("✅ 启动时间未超过基线")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+批量队列 - v5 图形界面一次处理整个文件夹或多选的文件
+
+1. 分组：先按 merge_invoices.classify_file 的命名规则（X.pdf + X购买记录 + X支付记录）组成文件组；
+   不符合命名规则的文件再按修改时间就近组合：每个 PDF 配上时间最接近的两张图片
+   （相差不超过 max_gap 秒），两张图片按文件名排序，第一张作为购买记录，与单套合并一致
+2. 处理：BatchMergeRunner 在隔离的工作进程池中提取发票数据并合并，主进程按 SmartFileNamer
+   生成不重名的文件名，写入输出文件夹并追加汇总记录
+
+本模块不依赖界面，可单独测试；界面见 invoice_merger_v5.BatchQueueWindow。
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from io import BytesIO
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from merge_invoices import ALLOWED_IMG_EXTS, OUTPUT_DIR_NAME, classify_file, split_suffix, write_output
+from merge_profiling import DiagnosticsSampler, profile_job
+from merge_progress import CancelToken, ProgressReporter
+from merge_sandbox import SandboxError, SandboxPool
+
+DEFAULT_MAX_GAP = 600
+DEFAULT_BATCH_WORKERS = 2
+MERGE_TIMEOUT = 120
+SUPPORTED_EXTS = {".pdf"} | set(ALLOWED_IMG_EXTS)
+
+# 文件组状态
+WAITING = "等待"
+RUNNING = "处理中"
+DONE = "完成"
+FAILED = "失败"
+CANCELLED = "已取消"
+
+
+def expand_paths(paths: Iterable[str]) -> List[str]:
+    """展开拖入的文件和文件夹（递归，跳过"已合并"文件夹），只保留支持的格式，去重并保持顺序"""
+    result: List[str] = []
+    seen: Set[str] = set()
+
+    def add(path: str) -> None:
+        path = os.path.abspath(path)
+        if path not in seen and split_suffix(path)[1] in SUPPORTED_EXTS:
+            seen.add(path)
+            result.append(path)
+
+    for path in paths:
+        path = path.strip().strip('"')
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = sorted(d for d in dirnames if d != OUTPUT_DIR_NAME)
+                for name in sorted(filenames):
+                    add(os.path.join(dirpath, name))
+        elif os.path.isfile(path):
+            add(path)
+    return result
+
+
+def _group_by_name(paths: List[str]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """按命名规则组成文件组；同一目录下 base_key 相同的三件套才算一组"""
+    index: Dict[Tuple[str, str], Dict[str, str]] = {}
+    for path in paths:
+        base, kind = classify_file(os.path.basename(path))
+        if base and kind:
+            index.setdefault((os.path.dirname(path), base), {})[kind] = path
+
+    groups = []
+    used: Set[str] = set()
+    for (_, base), items in sorted(index.items()):
+        if len(items) == 3:
+            groups.append({"key": base, **items, "method": "命名"})
+            used.update(items.values())
+    return groups, [path for path in paths if path not in used]
+
+
+def _group_by_time(paths: List[str], max_gap: float) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """每个 PDF（按修改时间先后）配上时间最接近且未被使用的两张图片"""
+    mtimes = {path: os.path.getmtime(path) for path in paths}
+    pdfs = sorted((p for p in paths if split_suffix(p)[1] == ".pdf"), key=mtimes.__getitem__)
+    images = [p for p in paths if split_suffix(p)[1] in ALLOWED_IMG_EXTS]
+
+    groups = []
+    used: Set[str] = set()
+    for pdf in pdfs:
+        nearest = sorted((abs(mtimes[img] - mtimes[pdf]), img) for img in images if img not in used)[:2]
+        if len(nearest) < 2 or nearest[1][0] > max_gap:
+            continue
+        buy, pay = sorted((img for _, img in nearest), key=lambda p: os.path.basename(p).lower())
+        groups.append({"key": split_suffix(os.path.basename(pdf))[0], "pdf": pdf, "buy": buy, "pay": pay,
+                       "method": "时间"})
+        used.update((pdf, buy, pay))
+    return groups, [path for path in paths if path not in used]
+
+
+def group_triplets(paths: Iterable[str], max_gap: float = DEFAULT_MAX_GAP
+                   ) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """把文件与文件夹整理为文件组，返回 (文件组列表, 未能分组的文件)"""
+    files = expand_paths(paths)
+    named, rest = _group_by_name(files)
+    timed, leftovers = _group_by_time(rest, max_gap)
+    return named + timed, leftovers
+
+
+def merge_group(group: Dict[str, Any]) -> Dict[str, Any]:
+    """在工作进程中提取发票数据并合并，返回 {"data": 发票数据或 None, "pdf": 合并后的 PDF 数据}。
+    group 带有 diagnostics 时对数据提取与合并一起做性能诊断
+    """
+    from invoice_extract import PDF_AVAILABLE, InvoiceDataExtractor
+    from merge_invoices_simple import merge_simple
+
+    with profile_job(group["key"], group.get("diagnostics")):
+        data = None
+        if PDF_AVAILABLE:
+            try:
+                data = InvoiceDataExtractor.extract_invoice_data(group["pdf"])
+            except Exception:
+                # 数据提取失败不影响合并，使用原文件名
+                data = None
+        stream = BytesIO()
+        merge_simple(group["pdf"], group["buy"], group["pay"], stream)
+        return {"data": data, "pdf": stream.getvalue()}
+
+
+def output_filename(group: Dict[str, Any], data: Optional[Dict[str, Any]]) -> str:
+    """与单套合并相同的命名：有发票数据时用智能文件名，否则为 原文件名_已合并.pdf"""
+    from invoice_extract import SmartFileNamer
+
+    original = os.path.basename(group["pdf"])
+    if data:
+        return SmartFileNamer.generate_smart_filename(data, original)
+    return os.path.splitext(original)[0] + "_已合并.pdf"
+
+
+def unique_path(out_dir: str, filename: str, taken: Set[str]) -> str:
+    """输出文件夹中已存在或本批次已使用的文件名后追加 _2、_3 ……"""
+    stem, ext = os.path.splitext(filename)
+    candidate, n = filename, 1
+    while candidate in taken or os.path.exists(os.path.join(out_dir, candidate)):
+        n += 1
+        candidate = f"{stem}_{n}{ext}"
+    taken.add(candidate)
+    return os.path.join(out_dir, candidate)
+
+
+class BatchMergeRunner:
+    """在隔离的工作进程池中依次处理文件组，每个文件组状态变化时调用 on_update(序号, 状态, 信息)。
+
+    同时在途的文件组不超过 workers 个，因此"处理中"即正在工作进程中执行；
+    输出文件名在主进程中分配，写入与汇总记录（on_record(发票数据, 文件名)）也只在主进程中进行。
+    progress 接收与 merge_invoices.main 相同的结构化进度事件（见 merge_progress），
+    reporter.eta() 为预计剩余时间。
+    diagnostics（DiagnosticsSampler）指定时对抽中的文件组做 cProfile / tracemalloc 诊断。
+    """
+
+    def __init__(self, groups: List[Dict[str, Any]], out_dir: str, workers: int = DEFAULT_BATCH_WORKERS,
+                 timeout: Optional[float] = MERGE_TIMEOUT,
+                 on_update: Optional[Callable[[int, str, Dict[str, Any]], None]] = None,
+                 on_record: Optional[Callable[[Dict[str, Any], str], None]] = None,
+                 executor_factory: Optional[Callable[[int], Any]] = None,
+                 progress: Any = None, cancel: Optional[CancelToken] = None,
+                 diagnostics: Optional[DiagnosticsSampler] = None):
+        self.groups = groups
+        self.out_dir = out_dir
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.on_update = on_update
+        self.on_record = on_record
+        self.executor_factory = executor_factory or (lambda n: SandboxPool(n, timeout=self.timeout))
+        self.results: Dict[int, Dict[str, Any]] = {}
+        self.reporter = ProgressReporter(progress)
+        self.cancel_token = cancel or CancelToken()
+        self.diagnostics = diagnostics
+
+    def cancel(self) -> None:
+        """不再提交新的文件组；正在处理的文件组会处理完"""
+        self.cancel_token.cancel()
+
+    def _update(self, index: int, status: str, **info: Any) -> None:
+        self.results[index] = {"status": status, **info}
+        if self.on_update:
+            self.on_update(index, status, info)
+
+    def _finish(self, index: int, future: Future, taken: Set[str]) -> None:
+        group = self.groups[index]
+        try:
+            result = future.result()
+            out_path = unique_path(self.out_dir, output_filename(group, result["data"]), taken)
+            write_output(out_path, result["pdf"])
+            if result["data"] and self.on_record:
+                self.on_record(result["data"], os.path.basename(out_path))
+        except SandboxError as e:
+            self.reporter.job_failed(group, e)
+            self._update(index, FAILED, error=f"PDF 处理异常，已跳过：{e}")
+        except Exception as e:
+            self.reporter.job_failed(group, e)
+            self._update(index, FAILED, error=str(e))
+        else:
+            self.reporter.job_finished(group, output=out_path)
+            self._update(index, DONE, output=out_path, data=result["data"])
+
+    def run(self) -> Dict[int, Dict[str, Any]]:
+        """阻塞执行全部文件组，返回 {序号: 结果}"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        taken: Set[str] = set()
+        running: Dict[Future, int] = {}
+        pending = list(range(len(self.groups)))
+        cancel = self.cancel_token
+        self.reporter.add_total(len(self.groups))
+        self.reporter.batch_started()
+        executor = self.executor_factory(self.workers)
+        try:
+            while (pending and not cancel.cancelled) or running:
+                while pending and len(running) < self.workers and not cancel.cancelled:
+                    index = pending.pop(0)
+                    group = self.groups[index]
+                    if self.diagnostics:
+                        # 标记在副本上，界面持有的文件组不变
+                        group = self.diagnostics.tag(dict(group))
+                    running[executor.submit(merge_group, group)] = index
+                    self.reporter.job_started(self.groups[index])
+                    self._update(index, RUNNING)
+                done, _ = wait(list(running), timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._finish(running.pop(future), future, taken)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            for index in pending:
+                self._update(index, CANCELLED)
+            self.reporter.batch_finished(cancelled=cancel.cancelled)
+        return self.results
+
+    def start(self) -> threading.Thread:
+        """在后台线程中运行，界面线程不被阻塞"""
+        thread = threading.Thread(target=self.run, name="batch-merge", daemon=True)
+        thread.start()
+        return thread
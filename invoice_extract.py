@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+发票数据提取与智能命名
+从 v5 图形界面中拆出，不依赖 tkinter，供图形界面、HTTP 服务和批量脚本共用
+"""
+
+import importlib.util
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# PDF处理库在首次提取时才导入，图形界面启动时只检查是否已安装
+PDF_AVAILABLE = importlib.util.find_spec("pypdfium2") is not None
+
+
+class InvoiceDataExtractor:
+    """发票数据提取器"""
+    
+    @staticmethod
+    def extract_invoice_data(pdf_path: Any) -> Dict[str, Any]:
+        """从PDF中提取发票关键信息；pdf_path 也可以是 bytes、memoryview 或二进制文件对象"""
+        if not PDF_AVAILABLE:
+            raise ImportError("需要安装pypdfium2库：pip install pypdfium2")
+        import pypdfium2 as pdfium
+        
+        try:
+            # 使用pypdfium2提取文本
+            doc = pdfium.PdfDocument(bytes(pdf_path) if isinstance(pdf_path, (bytearray, memoryview)) else pdf_path)
+            full_text = ""
+            
+            for page_num in range(min(3, len(doc))):  # 只处理前3页
+                page = doc[page_num]
+                textpage = page.get_textpage()
+                text = textpage.get_text_range()
+                full_text += text + "\n"
+                textpage.close()
+                page.close()
+            
+            doc.close()
+            
+            # 提取关键信息
+            is_path = isinstance(pdf_path, (str, os.PathLike))
+            data = {
+                "file_path": os.fspath(pdf_path) if is_path else None,
+                "file_name": os.path.basename(pdf_path) if is_path else getattr(pdf_path, "name", ""),
+                "extracted_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            
+            # 发票号码 - 多种模式匹配
+            invoice_patterns = [
+                r'发票号码[：:\s]*(\d{8,20})',
+                r'号码[：:\s]*(\d{8,20})',
+                r'Invoice\s*No[：:\s]*(\d{8,20})',
+                r'(\d{20})',  # 20位数字
+                r'(\d{12})',  # 12位数字
+            ]
+            
+            data["invoice_number"] = InvoiceDataExtractor._extract_by_patterns(full_text, invoice_patterns)
+                
+            # 开票日期
+            date_patterns = [
+                r'开票日期[：:\s]*(\d{4}[-年]\d{1,2}[-月]\d{1,2}日?)',
+                r'日期[：:\s]*(\d{4}[-年]\d{1,2}[-月]\d{1,2}日?)',
+                r'(\d{4}[-年]\d{1,2}[-月]\d{1,2}日?)',
+                r'(\d{4}/\d{1,2}/\d{1,2})',
+            ]
+            
+            raw_date = InvoiceDataExtractor._extract_by_patterns(full_text, date_patterns)
+            if raw_date:
+                # 标准化日期格式
+                date_str = re.sub(r'年|月', '-', raw_date).replace('日', '').replace('/', '-')
+                data["invoice_date"] = date_str
+            else:
+                data["invoice_date"] = None
+                
+            # 金额 - 寻找价税合计或总金额
+            amount_patterns = [
+                r'价税合计[：:\s]*¥?(\d+\.?\d*)',
+                r'合计金额[：:\s]*¥?(\d+\.?\d*)',
+                r'总计[：:\s]*¥?(\d+\.?\d*)',
+                r'金额[：:\s]*¥?(\d+\.?\d*)',
+                r'¥(\d+\.?\d*)',
+            ]
+            
+            raw_amount = InvoiceDataExtractor._extract_by_patterns(full_text, amount_patterns)
+            if raw_amount:
+                try:
+                    data["amount"] = float(raw_amount)
+                except ValueError:
+                    data["amount"] = None
+            else:
+                data["amount"] = None
+                
+            # 销售方名称
+            seller_patterns = [
+                r'销售方[：:\s]*([^\n\r]+?)(?:\s|纳税人|地址|电话)',
+                r'卖方[：:\s]*([^\n\r]+?)(?:\s|纳税人|地址|电话)', 
+                r'开票单位[：:\s]*([^\n\r]+?)(?:\s|纳税人|地址|电话)',
+            ]
+            
+            seller_name = InvoiceDataExtractor._extract_by_patterns(full_text, seller_patterns)
+            if seller_name and len(seller_name.strip()) > 3:
+                data["seller_name"] = seller_name.strip()
+            else:
+                data["seller_name"] = None
+                
+            # 纳税人识别号
+            tax_id_patterns = [
+                r'纳税人识别号[：:\s]*([A-Z0-9]{15,20})',
+                r'税号[：:\s]*([A-Z0-9]{15,20})',
+                r'识别号[：:\s]*([A-Z0-9]{15,20})',
+                r'统一社会信用代码[：:\s]*([A-Z0-9]{15,20})',
+            ]
+            
+            data["seller_tax_id"] = InvoiceDataExtractor._extract_by_patterns(full_text, tax_id_patterns)
+            
+            return data
+            
+        except Exception as e:
+            raise Exception(f"PDF文本提取失败: {str(e)}")
+    
+    @staticmethod
+    def _extract_by_patterns(text: str, patterns: List[str]) -> Optional[str]:
+        """使用多个正则模式提取文本"""
+        for pattern in patterns:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                return match.group(1).strip()
+        return None
+
+
+class SmartFileNamer:
+    """智能文件命名器"""
+    
+    @staticmethod
+    def generate_smart_filename(invoice_data: Dict[str, Any], original_filename: str) -> str:
+        """根据发票数据生成智能文件名"""
+        # 获取原文件名（不含扩展名）
+        base_name = os.path.splitext(original_filename)[0]
+        
+        # 构建新文件名组件
+        parts = []
+        
+        # 添加日期
+        if invoice_data.get('invoice_date'):
+            try:
+                date_str = invoice_data['invoice_date'].replace('-', '')
+                parts.append(date_str)
+            except:
+                pass
+        
+        # 添加金额
+        if invoice_data.get('amount'):
+            amount_str = f"{invoice_data['amount']:.2f}元".replace('.00元', '元')
+            parts.append(amount_str)
+        
+        # 添加发票号后4位
+        if invoice_data.get('invoice_number') and len(str(invoice_data['invoice_number'])) >= 4:
+            last4 = str(invoice_data['invoice_number'])[-4:]
+            parts.append(f"#{last4}")
+        
+        # 组合文件名
+        if parts:
+            smart_name = '_'.join(parts) + '_已合并'
+        else:
+            # 如果没有提取到数据，使用原名称
+            smart_name = base_name + '_已合并'
+        
+        return smart_name + '.pdf'
+
+
+EXTRACT_DEBOUNCE = 0.3
+
+
+class ExtractionWorker:
+    """图形界面拖入文件后的自动提取：单个后台线程、去抖、只保留最新请求。
+
+    - request() 返回递增的代次；delay 秒内再次请求会取代尚未开始的请求（连续拖入只提取最后一个）
+    - 只有一个工作线程，同一时刻最多打开一个 PDF 文档
+    - 正在进行的提取无法中断，但完成时若已有更新的请求或已调用 cancel()，结果被丢弃
+    - callback(代次, 数据, 异常) 在后台线程中调用，界面程序需用 root.after 转回界面线程，
+      并用 is_current(代次) 再确认一次（转回界面线程期间可能又有新的请求）
+    """
+
+    def __init__(self, extract: Callable[[Any], Dict[str, Any]] = InvoiceDataExtractor.extract_invoice_data,
+                 delay: float = EXTRACT_DEBOUNCE):
+        self.extract = extract
+        self.delay = delay
+        self.generation = 0
+        self._request: Optional[Tuple[int, Any, Callable[..., None], float]] = None
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def request(self, pdf_path: Any, callback: Callable[..., None], delay: Optional[float] = None) -> int:
+        with self._condition:
+            self.generation += 1
+            due = time.monotonic() + (self.delay if delay is None else delay)
+            self._request = (self.generation, pdf_path, callback, due)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="extract", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+            return self.generation
+
+    def cancel(self) -> None:
+        """放弃尚未开始的请求，并丢弃正在进行的提取结果"""
+        with self._condition:
+            self.generation += 1
+            self._request = None
+
+    def is_current(self, generation: int) -> bool:
+        return generation == self.generation
+
+    def _loop(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if self._request is None:
+                        self._condition.wait()
+                        continue
+                    remaining = self._request[3] - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                (generation, pdf_path, callback, _), self._request = self._request, None
+            try:
+                data, error = self.extract(pdf_path), None
+            except Exception as e:
+                data, error = None, e
+            if self.is_current(generation):
+                callback(generation, data, error)
@@ -15,143 +15,30 @@ from tkinterdnd2 import DND_FILES, TkinterDnD
 import os
 import sys
 import threading
-from pathlib import Path
+import multiprocessing
 import shutil
 import tempfile
-import json
 import csv
 import re
 from datetime import datetime
 from typing import List, Optional, Tuple, Dict, Any
 
-# 导入PDF处理库
-try:
-    import pypdfium2 as pdfium
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
-    pdfium = None
+import startup_probe
 
-# 导入原有的合并逻辑
-try:
-    from merge_invoices_simple import merge_simple
-except ImportError:
-    # 如果找不到简化版本，我们稍后会创建它
-    pass
+# 发票数据提取与智能命名（不依赖界面，HTTP 服务和批量脚本共用）
+from invoice_extract import PDF_AVAILABLE, ExtractionWorker, InvoiceDataExtractor, SmartFileNamer
 
+# pdfium 的渲染和文本提取放在隔离的工作进程中执行，异常 PDF 不会卡死界面
+from merge_sandbox import SandboxError, run_isolated
 
-class InvoiceDataExtractor:
-    """发票数据提取器"""
-    
-    @staticmethod
-    def extract_invoice_data(pdf_path: str) -> Dict[str, Any]:
-        """从PDF中提取发票关键信息"""
-        if not PDF_AVAILABLE:
-            raise ImportError("需要安装pypdfium2库：pip install pypdfium2")
-        
-        try:
-            # 使用pypdfium2提取文本
-            doc = pdfium.PdfDocument(pdf_path)
-            full_text = ""
-            
-            for page_num in range(min(3, len(doc))):  # 只处理前3页
-                page = doc[page_num]
-                textpage = page.get_textpage()
-                text = textpage.get_text_range()
-                full_text += text + "\n"
-                textpage.close()
-                page.close()
-            
-            doc.close()
-            
-            # 提取关键信息
-            data = {
-                "file_path": pdf_path,
-                "file_name": os.path.basename(pdf_path),
-                "extracted_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            # 发票号码 - 多种模式匹配
-            invoice_patterns = [
-                r'发票号码[：:\s]*(\d{8,20})',
-                r'号码[：:\s]*(\d{8,20})',
-                r'Invoice\s*No[：:\s]*(\d{8,20})',
-                r'(\d{20})',  # 20位数字
-                r'(\d{12})',  # 12位数字
-            ]
-            
-            data["invoice_number"] = InvoiceDataExtractor._extract_by_patterns(full_text, invoice_patterns)
-                
-            # 开票日期
-            date_patterns = [
-                r'开票日期[：:\s]*(\d{4}[-年]\d{1,2}[-月]\d{1,2}日?)',
-                r'日期[：:\s]*(\d{4}[-年]\d{1,2}[-月]\d{1,2}日?)',
-                r'(\d{4}[-年]\d{1,2}[-月]\d{1,2}日?)',
-                r'(\d{4}/\d{1,2}/\d{1,2})',
-            ]
-            
-            raw_date = InvoiceDataExtractor._extract_by_patterns(full_text, date_patterns)
-            if raw_date:
-                # 标准化日期格式
-                date_str = re.sub(r'年|月', '-', raw_date).replace('日', '').replace('/', '-')
-                data["invoice_date"] = date_str
-            else:
-                data["invoice_date"] = None
-                
-            # 金额 - 寻找价税合计或总金额
-            amount_patterns = [
-                r'价税合计[：:\s]*¥?(\d+\.?\d*)',
-                r'合计金额[：:\s]*¥?(\d+\.?\d*)',
-                r'总计[：:\s]*¥?(\d+\.?\d*)',
-                r'金额[：:\s]*¥?(\d+\.?\d*)',
-                r'¥(\d+\.?\d*)',
-            ]
-            
-            raw_amount = InvoiceDataExtractor._extract_by_patterns(full_text, amount_patterns)
-            if raw_amount:
-                try:
-                    data["amount"] = float(raw_amount)
-                except ValueError:
-                    data["amount"] = None
-            else:
-                data["amount"] = None
-                
-            # 销售方名称
-            seller_patterns = [
-                r'销售方[：:\s]*([^\n\r]+?)(?:\s|纳税人|地址|电话)',
-                r'卖方[：:\s]*([^\n\r]+?)(?:\s|纳税人|地址|电话)', 
-                r'开票单位[：:\s]*([^\n\r]+?)(?:\s|纳税人|地址|电话)',
-            ]
-            
-            seller_name = InvoiceDataExtractor._extract_by_patterns(full_text, seller_patterns)
-            if seller_name and len(seller_name.strip()) > 3:
-                data["seller_name"] = seller_name.strip()
-            else:
-                data["seller_name"] = None
-                
-            # 纳税人识别号
-            tax_id_patterns = [
-                r'纳税人识别号[：:\s]*([A-Z0-9]{15,20})',
-                r'税号[：:\s]*([A-Z0-9]{15,20})',
-                r'识别号[：:\s]*([A-Z0-9]{15,20})',
-                r'统一社会信用代码[：:\s]*([A-Z0-9]{15,20})',
-            ]
-            
-            data["seller_tax_id"] = InvoiceDataExtractor._extract_by_patterns(full_text, tax_id_patterns)
-            
-            return data
-            
-        except Exception as e:
-            raise Exception(f"PDF文本提取失败: {str(e)}")
-    
-    @staticmethod
-    def _extract_by_patterns(text: str, patterns: List[str]) -> Optional[str]:
-        """使用多个正则模式提取文本"""
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                return match.group(1).strip()
-        return None
+# 批量队列（invoice_batch）、合并（merge_invoices_simple）与布局预览（merge_preview）会导入
+# Pillow 和 pypdfium2，在第一次使用时才导入，窗口可以更快显示
+from merge_progress import format_duration
+
+EXTRACT_TIMEOUT = 30
+MERGE_TIMEOUT = 120
+
+startup_probe.mark("import")
 
 
 class CSVManager:
@@ -191,44 +78,215 @@ class CSVManager:
             raise Exception(f"写入CSV文件失败: {str(e)}")
 
 
-class SmartFileNamer:
-    """智能文件命名器"""
-    
-    @staticmethod
-    def generate_smart_filename(invoice_data: Dict[str, Any], original_filename: str) -> str:
-        """根据发票数据生成智能文件名"""
-        # 获取原文件名（不含扩展名）
-        base_name = os.path.splitext(original_filename)[0]
-        
-        # 构建新文件名组件
-        parts = []
-        
-        # 添加日期
-        if invoice_data.get('invoice_date'):
-            try:
-                date_str = invoice_data['invoice_date'].replace('-', '')
-                parts.append(date_str)
-            except:
-                pass
-        
-        # 添加金额
-        if invoice_data.get('amount'):
-            amount_str = f"{invoice_data['amount']:.2f}元".replace('.00元', '元')
-            parts.append(amount_str)
-        
-        # 添加发票号后4位
-        if invoice_data.get('invoice_number') and len(str(invoice_data['invoice_number'])) >= 4:
-            last4 = str(invoice_data['invoice_number'])[-4:]
-            parts.append(f"#{last4}")
-        
-        # 组合文件名
-        if parts:
-            smart_name = '_'.join(parts) + '_已合并'
-        else:
-            # 如果没有提取到数据，使用原名称
-            smart_name = base_name + '_已合并'
-        
-        return smart_name + '.pdf'
+class BatchQueueWindow:
+    """批量队列窗口：拖入文件夹或多选文件，自动分组后在后台批量提取数据并合并"""
+
+    COLUMNS = ("group", "method", "status", "output")
+    HEADINGS = {"group": "文件组", "method": "分组方式", "status": "状态", "output": "输出文件 / 错误"}
+
+    def __init__(self, app: "DragDropInvoiceMergerV5", paths: Optional[List[str]] = None):
+        self.app = app
+        self.colors = app.colors
+        self.groups: List[Dict[str, Any]] = []
+        self.runner = None  # invoice_batch.BatchMergeRunner
+        self.out_dir: Optional[str] = None
+        self.finished = 0
+        self.closed = False
+
+        self.window = tk.Toplevel(app.root)
+        self.window.title("批量队列 - 发票合并工具 v5.0")
+        self.window.geometry("900x600")
+        self.window.configure(bg=self.colors['bg'])
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.setup_ui()
+
+        if paths:
+            self.add_paths(paths)
+
+    def setup_ui(self):
+        frame = tk.Frame(self.window, bg=self.colors['bg'])
+        frame.pack(fill=tk.BOTH, expand=True, padx=15, pady=15)
+
+        self.drop_label = tk.Label(
+            frame,
+            text="🎯 将文件夹或多个文件拖放到这里，按命名规则或修改时间自动分组",
+            font=("微软雅黑", 11),
+            bg=self.colors['drop_zone'],
+            fg='#666666',
+            height=3
+        )
+        self.drop_label.pack(fill=tk.X, pady=(0, 10))
+        self.drop_label.drop_target_register(DND_FILES)
+        self.drop_label.dnd_bind('<<Drop>>', self.on_drop)
+
+        table_frame = tk.Frame(frame, bg=self.colors['bg'])
+        table_frame.pack(fill=tk.BOTH, expand=True)
+        self.table = ttk.Treeview(table_frame, columns=self.COLUMNS, show="headings", height=15)
+        for column, width in zip(self.COLUMNS, (220, 80, 80, 420)):
+            self.table.heading(column, text=self.HEADINGS[column])
+            self.table.column(column, width=width, anchor=tk.W)
+        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.table.yview)
+        self.table.configure(yscrollcommand=scrollbar.set)
+        self.table.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.progress = ttk.Progressbar(frame, mode="determinate")
+        self.progress.pack(fill=tk.X, pady=(10, 5))
+
+        bottom = tk.Frame(frame, bg=self.colors['bg'])
+        bottom.pack(fill=tk.X)
+        self.status_label = tk.Label(bottom, text="请拖入文件夹或选择文件", font=("微软雅黑", 10),
+                                     bg=self.colors['bg'], fg='#666666')
+        self.status_label.pack(side=tk.LEFT)
+
+        buttons = [
+            ("📁 添加文件", '#52c41a', self.select_files),
+            ("📂 添加文件夹", '#52c41a', self.select_folder),
+            ("💾 输出文件夹", self.colors['warning'], self.select_output_dir),
+        ]
+        for text, color, command in buttons:
+            tk.Button(bottom, text=text, font=("微软雅黑", 10), bg=color, fg='white', padx=10, pady=5,
+                      relief=tk.FLAT, command=command).pack(side=tk.LEFT, padx=(10, 0))
+
+        self.start_btn = tk.Button(bottom, text="🚀 全部合并", font=("微软雅黑", 10, "bold"),
+                                   bg=self.colors['button'], fg='white', padx=15, pady=5, relief=tk.FLAT,
+                                   command=self.start, state=tk.DISABLED)
+        self.start_btn.pack(side=tk.RIGHT)
+        self.cancel_btn = tk.Button(bottom, text="⏹ 停止", font=("微软雅黑", 10), bg='#ff7875', fg='white',
+                                    padx=10, pady=5, relief=tk.FLAT, command=self.cancel, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.RIGHT, padx=(0, 10))
+
+    def on_drop(self, event):
+        self.add_paths(self.window.tk.splitlist(event.data))
+
+    def select_files(self):
+        files = filedialog.askopenfilenames(
+            parent=self.window,
+            title="选择文件",
+            filetypes=[("所有支持的文件", "*.pdf;*.jpg;*.jpeg;*.png"), ("所有文件", "*.*")]
+        )
+        if files:
+            self.add_paths(list(files))
+
+    def select_folder(self):
+        folder = filedialog.askdirectory(parent=self.window, title="选择发票文件夹")
+        if folder:
+            self.add_paths([folder])
+
+    def select_output_dir(self):
+        folder = filedialog.askdirectory(parent=self.window, title="选择输出文件夹")
+        if folder:
+            self.out_dir = folder
+            self.update_status()
+
+    def add_paths(self, paths: List[str]):
+        """把新拖入的文件分组后追加到队列（已在队列中的文件忽略）"""
+        if self.runner:
+            return
+        from invoice_batch import WAITING, group_triplets
+
+        queued = {group[kind] for group in self.groups for kind in ("pdf", "buy", "pay")}
+        groups, leftovers = group_triplets(p for p in paths if os.path.abspath(p) not in queued)
+        groups = [g for g in groups if not queued & {g["pdf"], g["buy"], g["pay"]}]
+        for group in groups:
+            self.table.insert("", tk.END, iid=str(len(self.groups)),
+                              values=(group["key"], group["method"], WAITING, ""))
+            self.groups.append(group)
+        if self.groups and not self.out_dir:
+            self.out_dir = os.path.join(os.path.dirname(self.groups[0]["pdf"]), "已合并")
+        self.update_status(f"新增 {len(groups)} 组" + (f"，{len(leftovers)} 个文件未能分组" if leftovers else ""))
+
+    def update_status(self, note: str = ""):
+        parts = [f"共 {len(self.groups)} 组"]
+        if note:
+            parts.append(note)
+        if self.out_dir:
+            parts.append(f"输出到：{self.out_dir}")
+        self.status_label.config(text="，".join(parts))
+        self.start_btn.config(state=tk.NORMAL if self.groups and not self.runner else tk.DISABLED)
+
+    def start(self):
+        if not self.groups or self.runner:
+            return
+        from invoice_batch import BatchMergeRunner
+
+        self.finished = 0
+        self.progress.config(maximum=len(self.groups), value=0)
+        self.start_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.runner = BatchMergeRunner(
+            self.groups, self.out_dir, workers=min(4, os.cpu_count() or 1),
+            on_update=self.post_update,
+            on_record=self.post_record,
+        )
+        thread = self.runner.start()
+        self.window.after(200, self.poll, thread)
+
+    def post_update(self, index: int, status: str, info: Dict[str, Any]):
+        """后台线程调用：交给界面线程更新表格；窗口关闭后忽略（文件组仍会处理完并写出）"""
+        if self.closed:
+            return
+        try:
+            self.window.after(0, self.on_update, index, status, info)
+        except (tk.TclError, RuntimeError):
+            # 窗口在检查之后、调度之前被关闭
+            pass
+
+    def post_record(self, data: Dict[str, Any], filename: str):
+        """后台线程调用：CSV 记录交给主窗口的界面线程追加，与单套合并的写入不会交错；
+        队列窗口关闭后仍在处理的文件组也会被记录
+        """
+        try:
+            self.app.root.after(0, self.app.csv_manager.append_invoice_record, data, filename)
+        except (tk.TclError, RuntimeError):
+            # 主窗口已关闭
+            pass
+
+    def on_update(self, index: int, status: str, info: Dict[str, Any]):
+        if self.closed:
+            return
+        from invoice_batch import CANCELLED, DONE, FAILED, RUNNING
+
+        detail = os.path.basename(info["output"]) if "output" in info else info.get("error", "")
+        self.table.set(str(index), "status", status)
+        self.table.set(str(index), "output", detail)
+        if status == RUNNING:
+            self.table.see(str(index))
+        elif status in (DONE, FAILED, CANCELLED):
+            self.finished += 1
+            self.progress.config(value=self.finished)
+            self.status_label.config(text=f"已处理 {self.finished}/{len(self.groups)} 组，"
+                                          f"预计剩余 {format_duration(self.runner.reporter.eta())}")
+
+    def poll(self, thread: threading.Thread):
+        """后台线程结束后汇总结果"""
+        if self.closed:
+            return
+        if thread.is_alive():
+            self.window.after(200, self.poll, thread)
+            return
+        from invoice_batch import DONE, FAILED
+
+        results = self.runner.results.values()
+        done = sum(1 for r in results if r["status"] == DONE)
+        failed = sum(1 for r in results if r["status"] == FAILED)
+        self.cancel_btn.config(state=tk.DISABLED)
+        self.status_label.config(text=f"✅ 完成 {done} 组，失败 {failed} 组，输出到：{self.out_dir}")
+        messagebox.showinfo("批量合并完成", f"完成 {done} 组，失败 {failed} 组\n\n输出文件夹：\n{self.out_dir}",
+                            parent=self.window)
+
+    def cancel(self):
+        if self.runner:
+            self.runner.cancel()
+            self.cancel_btn.config(state=tk.DISABLED)
+            self.status_label.config(text="正在停止：等待处理中的文件组完成……")
+
+    def close(self):
+        """关闭窗口：不再提交新的文件组，已在处理的文件组在后台处理完并写出、记录"""
+        self.closed = True
+        if self.runner:
+            self.runner.cancel()
+        self.window.destroy()
 
 
 class DragDropInvoiceMergerV5:
@@ -244,8 +302,16 @@ class DragDropInvoiceMergerV5:
         self.pdf_file = None
         self.image_files = []
         
-        # 数据提取结果
+        # 数据提取结果：连续拖入时只提取最后一个 PDF，旧的结果被丢弃
         self.extracted_data = None
+        self.extract_worker = ExtractionWorker(
+            lambda pdf_path: run_isolated(InvoiceDataExtractor.extract_invoice_data, pdf_path,
+                                          timeout=EXTRACT_TIMEOUT))
+
+        # 布局预览（第一次预览时创建）
+        self.preview_worker = None
+        self.preview_key = None
+        self.preview_photo = None
         
         # CSV管理器
         self.csv_manager = None
@@ -341,7 +407,7 @@ class DragDropInvoiceMergerV5:
 
         self.drop_label = tk.Label(
             self.drop_zone,
-            text="🎯 将文件拖放到这里\n支持格式：PDF、JPG、PNG",
+            text="🎯 将文件拖放到这里\n支持格式：PDF、JPG、PNG；拖入文件夹或多套文件进入批量队列",
             font=("微软雅黑", 14),
             bg=self.colors['drop_zone'],
             fg='#666666'
@@ -382,6 +448,7 @@ class DragDropInvoiceMergerV5:
         # 创建Notebook来分页显示
         notebook = ttk.Notebook(data_frame)
         notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.notebook = notebook
         
         # 数据预览页
         preview_frame = tk.Frame(notebook, bg='white')
@@ -413,6 +480,28 @@ class DragDropInvoiceMergerV5:
         )
         self.naming_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
+        # 布局预览页
+        self.preview_tab = tk.Frame(notebook, bg='white')
+        notebook.add(self.preview_tab, text="🖼️ 布局预览")
+
+        self.preview_label = tk.Label(
+            self.preview_tab,
+            text="💡 选择1个PDF和2张图片后显示合并布局预览",
+            font=("微软雅黑", 10),
+            bg='white',
+            fg='#666666'
+        )
+        self.preview_label.pack(expand=True, pady=(5, 0))
+
+        self.preview_info = tk.Label(
+            self.preview_tab,
+            text="",
+            font=("微软雅黑", 9),
+            bg='white',
+            fg='#666666'
+        )
+        self.preview_info.pack(pady=(0, 5))
+
     def setup_buttons(self, parent):
         """设置按钮区域"""
         button_frame = tk.Frame(parent, bg=self.colors['bg'])
@@ -448,6 +537,19 @@ class DragDropInvoiceMergerV5:
         )
         self.select_btn.pack(side=tk.LEFT, padx=(0, 10))
 
+        self.batch_btn = tk.Button(
+            left_buttons,
+            text="📚 批量队列",
+            font=("微软雅黑", 10),
+            bg='#722ed1',
+            fg='white',
+            padx=15,
+            pady=8,
+            relief=tk.FLAT,
+            command=self.open_batch_queue
+        )
+        self.batch_btn.pack(side=tk.LEFT, padx=(0, 10))
+
         # 右侧按钮
         right_buttons = tk.Frame(button_frame, bg=self.colors['bg'])
         right_buttons.pack(side=tk.RIGHT)
@@ -528,7 +630,13 @@ class DragDropInvoiceMergerV5:
         self.add_files(files)
 
     def add_files(self, file_paths: List[str]):
-        """添加文件"""
+        """添加文件；拖入文件夹或多套文件时转到批量队列"""
+        paths = [p.strip().strip('"') for p in file_paths]
+        pdf_count = sum(1 for p in paths if os.path.splitext(p)[1].lower() == '.pdf')
+        if any(os.path.isdir(p) for p in paths) or pdf_count > 1:
+            self.open_batch_queue(paths)
+            return
+
         for file_path in file_paths:
             file_path = file_path.strip().strip('"')
             if not os.path.exists(file_path):
@@ -556,9 +664,13 @@ class DragDropInvoiceMergerV5:
 
         self.update_file_list()
         
-        # 如果有PDF文件，自动提取数据
+        # 如果有PDF文件，自动提取数据（去抖：连续拖入时只提取最后一次的PDF）
         if self.pdf_file and PDF_AVAILABLE:
-            self.extract_data_thread()
+            self.extract_data_thread(debounce=True)
+
+    def open_batch_queue(self, paths: Optional[List[str]] = None):
+        """打开批量队列窗口"""
+        BatchQueueWindow(self, paths)
 
     def select_files(self):
         """通过对话框选择文件"""
@@ -579,6 +691,8 @@ class DragDropInvoiceMergerV5:
         self.pdf_file = None
         self.image_files = []
         self.extracted_data = None
+        self.extract_worker.cancel()
+        self.extract_btn.config(state=tk.NORMAL, text="🔍 提取数据")
         self.update_file_list()
         self.update_displays()
 
@@ -593,6 +707,46 @@ class DragDropInvoiceMergerV5:
             self.file_listbox.insert(tk.END, f"🖼️ 图片{i}: {os.path.basename(img_file)}")
 
         self.update_button_states()
+        self.request_preview()
+
+    def request_preview(self):
+        """文件齐全时在后台生成低分辨率布局预览；全分辨率合并仍在点击合并后进行"""
+        if not (self.pdf_file and len(self.image_files) == 2):
+            self.preview_key = None
+            self.preview_photo = None
+            self.preview_label.config(image="", text="💡 选择1个PDF和2张图片后显示合并布局预览")
+            self.preview_info.config(text="")
+            return
+
+        # 与合并时相同：图片按文件名排序，第一张为购买记录
+        buy, pay = sorted(self.image_files, key=lambda x: os.path.basename(x).lower())
+        key = (self.pdf_file, buy, pay)
+        if key == self.preview_key:
+            return
+        self.preview_key = key
+        self.preview_info.config(text="正在生成预览...")
+        if self.preview_worker is None:
+            from merge_preview import PreviewWorker
+            self.preview_worker = PreviewWorker()
+        self.preview_worker.request(*key, lambda *result: self.root.after(0, self.show_preview, key, *result))
+
+    def show_preview(self, key, image, layout, error, seconds):
+        """显示预览（在界面线程中调用）；文件已变化时丢弃过期结果"""
+        if key != self.preview_key:
+            return
+        if error is not None:
+            self.preview_photo = None
+            self.preview_label.config(image="", text=f"⚠️ 无法生成预览：{error}")
+            self.preview_info.config(text="")
+            return
+        from PIL import ImageTk
+        from merge_preview import describe_layout
+
+        self.preview_photo = ImageTk.PhotoImage(image)
+        self.preview_label.config(image=self.preview_photo, text="")
+        self.preview_info.config(text=f"{describe_layout(layout)}（预览用时 {seconds * 1000:.0f} ms）\n"
+                                      "确认无误后点击【智能合并】生成全分辨率PDF")
+        self.notebook.select(self.preview_tab)
 
     def update_button_states(self):
         """更新按钮状态"""
@@ -613,32 +767,40 @@ class DragDropInvoiceMergerV5:
             elif len(self.image_files) != 2:
                 self.status_label.config(text=f"需要2张图片，当前有{len(self.image_files)}张")
 
-    def extract_data_thread(self):
-        """在线程中提取数据"""
+    def extract_data_thread(self, debounce: bool = False):
+        """在后台提取数据；新的请求会取代尚未完成的旧请求"""
         if not self.pdf_file or not PDF_AVAILABLE:
             return
-            
+
+        # 换了PDF后旧数据不再对应当前文件
+        if self.extracted_data and self.extracted_data.get("file_path") != self.pdf_file:
+            self.extracted_data = None
+            self.update_displays()
+
         self.extract_btn.config(state=tk.DISABLED, text="🔄 提取中...")
         self.status_label.config(text="正在提取发票数据，请稍候...")
-        
-        def extract_worker():
-            try:
-                self.extracted_data = InvoiceDataExtractor.extract_invoice_data(self.pdf_file)
-                self.root.after(0, self.extract_success)
-            except Exception as e:
-                self.root.after(0, self.extract_failed, str(e))
-        
-        thread = threading.Thread(target=extract_worker, daemon=True)
-        thread.start()
 
-    def extract_success(self):
+        def on_result(generation, data, error):
+            if error is None:
+                self.root.after(0, self.extract_success, generation, data)
+            else:
+                self.root.after(0, self.extract_failed, generation, str(error))
+
+        self.extract_worker.request(self.pdf_file, on_result, delay=None if debounce else 0)
+
+    def extract_success(self, generation: int, data: Dict[str, Any]):
         """数据提取成功"""
+        if not self.extract_worker.is_current(generation):
+            return
+        self.extracted_data = data
         self.extract_btn.config(state=tk.NORMAL, text="🔍 提取数据")
         self.status_label.config(text="✅ 数据提取成功！")
         self.update_displays()
 
-    def extract_failed(self, error_msg):
+    def extract_failed(self, generation: int, error_msg: str):
         """数据提取失败"""
+        if not self.extract_worker.is_current(generation):
+            return
         self.extract_btn.config(state=tk.NORMAL, text="🔍 提取数据")
         self.status_label.config(text="❌ 数据提取失败")
         messagebox.showwarning("数据提取失败", f"提取过程中出现问题：\n{error_msg}\n\n将使用原文件名进行合并")
@@ -751,24 +913,28 @@ class DragDropInvoiceMergerV5:
                     target = temp_buy.name if i == 0 else temp_pay.name
                     shutil.copy2(img_file, target)
 
-                # 调用合并函数
+                # 调用合并函数（在隔离的工作进程中执行，崩溃或超时时抛出 SandboxError）
                 from merge_invoices_simple import merge_simple
-                merge_simple(temp_pdf.name, temp_buy.name, temp_pay.name, output_path)
+                try:
+                    run_isolated(merge_simple, temp_pdf.name, temp_buy.name, temp_pay.name, output_path,
+                                 timeout=MERGE_TIMEOUT)
+                finally:
+                    # 清理临时文件
+                    for temp_file in [temp_pdf.name, temp_buy.name, temp_pay.name]:
+                        try:
+                            os.unlink(temp_file)
+                        except:
+                            pass
 
                 # 记录到CSV文件
                 if self.extracted_data:
                     merged_filename = os.path.basename(output_path)
                     self.csv_manager.append_invoice_record(self.extracted_data, merged_filename)
 
-                # 清理临时文件
-                for temp_file in [temp_pdf.name, temp_buy.name, temp_pay.name]:
-                    try:
-                        os.unlink(temp_file)
-                    except:
-                        pass
-
                 self.root.after(0, self.merge_success, output_path, smart_filename)
 
+            except SandboxError as e:
+                self.root.after(0, self.merge_failed, f"PDF 处理异常，已跳过：{e}")
             except Exception as e:
                 self.root.after(0, self.merge_failed, str(e))
 
@@ -828,14 +994,25 @@ class DragDropInvoiceMergerV5:
 
         # 确保所有组件都已初始化后再更新显示
         self.root.after(100, self.update_displays)
+        if startup_probe.enabled():
+            self.root.after(0, self.finish_startup_probe)
 
         self.root.mainloop()
 
+    def finish_startup_probe(self):
+        """启动时间测量：窗口第一次显示后记录时间并退出（见 check_startup.py）"""
+        self.root.update()
+        startup_probe.mark("window")
+        startup_probe.finish()
+        self.root.destroy()
+
 
 def main():
     """主入口"""
+    # 启动时间测量时不弹出提示框
+    probe = startup_probe.enabled()
     try:
-        if not PDF_AVAILABLE:
+        if not PDF_AVAILABLE and not probe:
             messagebox.showwarning(
                 "缺少依赖",
                 "未检测到pypdfium2库，数据提取功能将不可用。\n\n"
@@ -848,6 +1025,9 @@ def main():
         return 0
         
     except ImportError as e:
+        if probe:
+            startup_probe.finish(e)
+            return 1
         if "tkinterdnd2" in str(e):
             messagebox.showerror(
                 "缺少依赖",
@@ -859,9 +1039,14 @@ def main():
             messagebox.showerror("错误", f"程序启动失败：\n{e}")
         return 1
     except Exception as e:
+        if probe:
+            startup_probe.finish(e)
+            return 1
         messagebox.showerror("错误", f"程序启动失败：\n{e}")
         return 1
 
 
 if __name__ == "__main__":
+    # 打包为 exe 后，隔离的工作进程需要 freeze_support 才能正常启动
+    multiprocessing.freeze_support()
     sys.exit(main())
\ No newline at end of file
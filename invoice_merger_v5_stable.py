@@ -9,18 +9,20 @@
 
 import tkinter as tk
 from tkinter import messagebox, filedialog
+import importlib.util
+import contextlib
 import os
 import sys
 import threading
-from pathlib import Path
 import shutil
 import tempfile
-import json
 import csv
 import re
 from datetime import datetime
 from typing import List, Optional, Tuple, Dict, Any
 
+import startup_probe
+
 # 尝试导入拖放功能库
 try:
     from tkinterdnd2 import DND_FILES, TkinterDnD
@@ -30,20 +32,14 @@ except ImportError:
     # 使用普通的Tk作为备选
     TkinterDnD = tk
 
-# 尝试导入PDF处理库
-try:
-    import pypdfium2 as pdfium
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
-    pdfium = None
+# PDF处理、合并与预览用到的 pypdfium2 和 Pillow 较大，启动时只检查是否已安装，
+# 第一次提取、合并或预览时才导入，窗口可以更快显示
+PDF_AVAILABLE = importlib.util.find_spec("pypdfium2") is not None
+PREVIEW_AVAILABLE = importlib.util.find_spec("PIL") is not None
 
-# 导入原有的合并逻辑
-try:
-    from merge_invoices_simple import merge_simple
-except ImportError:
-    def merge_simple(pdf_path, img1_path, img2_path, output_path):
-        raise ImportError("找不到合并功能模块")
+MERGE_TIMEOUT = 120
+
+startup_probe.mark("import")
 
 
 class SimpleInvoiceMergerV5:
@@ -66,6 +62,14 @@ class SimpleInvoiceMergerV5:
         
         # 数据提取结果
         self.extracted_data = None
+
+        # 后台合并进行中
+        self.merging = False
+
+        # 布局预览
+        self.preview_worker = None
+        self.preview_key = None
+        self.preview_photo = None
         
         # CSV文件路径
         self.csv_path = self.get_csv_path()
@@ -223,6 +227,29 @@ class SimpleInvoiceMergerV5:
         )
         data_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
 
+        # 右侧为布局预览
+        if PREVIEW_AVAILABLE:
+            preview_frame = tk.Frame(data_frame, bg='white')
+            preview_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(0, 10), pady=5)
+            self.preview_label = tk.Label(
+                preview_frame,
+                text="🖼️ 布局预览",
+                font=("微软雅黑", 9),
+                bg='white',
+                fg='#999999',
+                width=30
+            )
+            self.preview_label.pack(expand=True)
+            self.preview_info = tk.Label(
+                preview_frame,
+                text="",
+                font=("微软雅黑", 8),
+                bg='white',
+                fg='#666666',
+                wraplength=220
+            )
+            self.preview_info.pack()
+
         self.data_text = tk.Text(
             data_frame,
             height=12,
@@ -404,18 +431,27 @@ class SimpleInvoiceMergerV5:
 
     def extract_invoice_data(self, pdf_path: str) -> Dict[str, Any]:
         """从PDF中提取发票关键信息"""
-        doc = pdfium.PdfDocument(pdf_path)
+        import pypdfium2 as pdfium
+
+        # 布局预览线程也在使用 pdfium（不是线程安全的），两者共用 merge_engine 的全局锁
+        try:
+            from merge_engine import PDFIUM_LOCK
+        except ImportError:
+            PDFIUM_LOCK = contextlib.nullcontext()
+
         full_text = ""
-        
-        for page_num in range(min(3, len(doc))):
-            page = doc[page_num]
-            textpage = page.get_textpage()
-            text = textpage.get_text_range()
-            full_text += text + "\n"
-            textpage.close()
-            page.close()
-        
-        doc.close()
+        with PDFIUM_LOCK:
+            doc = pdfium.PdfDocument(pdf_path)
+            try:
+                for page_num in range(min(3, len(doc))):
+                    page = doc[page_num]
+                    textpage = page.get_textpage()
+                    text = textpage.get_text_range()
+                    full_text += text + "\n"
+                    textpage.close()
+                    page.close()
+            finally:
+                doc.close()
         
         # 提取关键信息
         data = {
@@ -526,7 +562,10 @@ class SimpleInvoiceMergerV5:
         else:
             self.extract_btn.config(state=tk.DISABLED)
 
-        if self.pdf_file and len(self.image_files) == 2:
+        if self.merging:
+            # 合并在后台进行，完成前不允许再次合并
+            self.merge_btn.config(state=tk.DISABLED)
+        elif self.pdf_file and len(self.image_files) == 2:
             self.merge_btn.config(state=tk.NORMAL)
             self.status_label.config(text="✅ 文件已就绪，可以合并")
         else:
@@ -581,8 +620,49 @@ class SimpleInvoiceMergerV5:
         self.data_text.insert(1.0, display_text)
         self.data_text.config(state=tk.DISABLED)
 
+        self.request_preview()
+
+    def request_preview(self):
+        """文件齐全时在后台生成布局预览；全分辨率合并仍在点击合并后进行"""
+        if not PREVIEW_AVAILABLE:
+            return
+        if not (self.pdf_file and len(self.image_files) == 2):
+            self.preview_key = None
+            self.preview_photo = None
+            self.preview_label.config(image="", text="🖼️ 布局预览", width=30)
+            self.preview_info.config(text="")
+            return
+
+        buy, pay = sorted(self.image_files, key=lambda x: os.path.basename(x).lower())
+        key = (self.pdf_file, buy, pay)
+        if key == self.preview_key:
+            return
+        self.preview_key = key
+        self.preview_info.config(text="正在生成预览...")
+        if self.preview_worker is None:
+            from merge_preview import PreviewWorker
+            self.preview_worker = PreviewWorker()
+        self.preview_worker.request(*key, lambda *result: self.root.after(0, self.show_preview, key, *result))
+
+    def show_preview(self, key, image, layout, error, seconds):
+        """显示预览；文件已变化时丢弃过期结果"""
+        if key != self.preview_key:
+            return
+        if error is not None:
+            self.preview_photo = None
+            self.preview_label.config(image="", text="⚠️ 无法生成预览", width=30)
+            self.preview_info.config(text=str(error))
+            return
+        from PIL import ImageTk
+        from merge_preview import describe_layout
+
+        image.thumbnail((220, 320))
+        self.preview_photo = ImageTk.PhotoImage(image)
+        self.preview_label.config(image=self.preview_photo, text="", width=0)
+        self.preview_info.config(text=describe_layout(layout))
+
     def merge_files(self):
-        """合并文件"""
+        """合并文件：保存对话框在界面线程中弹出，复制、渲染与合成在后台线程中进行"""
         if not (self.pdf_file and len(self.image_files) == 2):
             messagebox.showerror("文件不完整", "需要1个PDF文件和2张图片才能合并")
             return
@@ -606,63 +686,102 @@ class SimpleInvoiceMergerV5:
         if not output_path:
             return
 
+        self.merging = True
         self.merge_btn.config(state=tk.DISABLED, text="🔄 处理中...")
         self.status_label.config(text="正在合并文件...")
 
+        # 合并期间用户可能更换文件，后台线程只使用此刻的文件与数据
+        sorted_images = sorted(self.image_files, key=lambda x: os.path.basename(x).lower())
+        thread = threading.Thread(
+            target=self.merge_worker,
+            args=(self.pdf_file, sorted_images[0], sorted_images[1], output_path, self.extracted_data),
+            daemon=True
+        )
+        thread.start()
+
+    def merge_worker(self, pdf_path: str, buy_path: str, pay_path: str, output_path: str,
+                     data: Optional[Dict[str, Any]]):
+        """后台线程：复制到临时文件并合并，结果通过 root.after 交回界面线程"""
+        # 隔离的工作进程：pdfium 崩溃或卡死时不影响界面，也不与预览线程同时使用 pdfium
+        try:
+            from merge_sandbox import SandboxError, run_isolated
+        except ImportError:
+            SandboxError, run_isolated = (), None
+
         try:
+            try:
+                from merge_invoices_simple import merge_simple
+            except ImportError as e:
+                raise ImportError(f"找不到合并功能模块：{e}") from e
+
             # 创建临时文件
             temp_pdf = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
-            temp_buy = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)  
+            temp_buy = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
             temp_pay = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
-            
+
             temp_pdf.close()
             temp_buy.close()
             temp_pay.close()
 
-            # 复制文件
-            shutil.copy2(self.pdf_file, temp_pdf.name)
-            sorted_images = sorted(self.image_files, key=lambda x: os.path.basename(x).lower())
-            shutil.copy2(sorted_images[0], temp_buy.name)
-            shutil.copy2(sorted_images[1], temp_pay.name)
-
-            # 调用合并函数
-            merge_simple(temp_pdf.name, temp_buy.name, temp_pay.name, output_path)
-
-            # 记录到CSV
-            if self.extracted_data:
-                self.save_to_csv(self.extracted_data, os.path.basename(output_path))
-
-            # 清理临时文件
-            for temp_file in [temp_pdf.name, temp_buy.name, temp_pay.name]:
-                try:
-                    os.unlink(temp_file)
-                except:
-                    pass
-
-            self.merge_btn.config(state=tk.NORMAL, text="🚀 智能合并")
-            self.status_label.config(text="✅ 合并成功！")
-
-            # 成功提示
-            message = f"文件已保存到：\n{output_path}\n\n"
-            if self.extracted_data:
-                message += "🔍 已提取发票数据并使用智能文件名\n"
-                message += f"📊 已记录到汇总文件\n\n"
-            
-            message += "是否打开文件所在目录？"
-
-            if messagebox.askyesno("合并成功", message):
-                output_dir = os.path.dirname(output_path)
-                if sys.platform == 'win32':
-                    os.startfile(output_dir)
-
-            # 询问是否继续
-            if messagebox.askyesno("继续", "是否继续处理其他发票？"):
-                self.clear_files()
-
+            try:
+                # 复制文件
+                shutil.copy2(pdf_path, temp_pdf.name)
+                shutil.copy2(buy_path, temp_buy.name)
+                shutil.copy2(pay_path, temp_pay.name)
+
+                # 调用合并函数
+                if run_isolated:
+                    run_isolated(merge_simple, temp_pdf.name, temp_buy.name, temp_pay.name, output_path,
+                                 timeout=MERGE_TIMEOUT)
+                else:
+                    merge_simple(temp_pdf.name, temp_buy.name, temp_pay.name, output_path)
+            finally:
+                # 清理临时文件
+                for temp_file in [temp_pdf.name, temp_buy.name, temp_pay.name]:
+                    try:
+                        os.unlink(temp_file)
+                    except:
+                        pass
+        except SandboxError as e:
+            self.root.after(0, self.merge_failed, f"PDF 处理异常：{e}")
         except Exception as e:
-            self.merge_btn.config(state=tk.NORMAL, text="🚀 智能合并")
-            self.status_label.config(text="❌ 合并失败")
-            messagebox.showerror("合并失败", f"合并过程中出现错误：\n{e}")
+            self.root.after(0, self.merge_failed, str(e))
+        else:
+            self.root.after(0, self.merge_success, output_path, data)
+
+    def merge_success(self, output_path: str, data: Optional[Dict[str, Any]]):
+        """合并成功（界面线程）"""
+        self.merging = False
+        # 记录到CSV
+        if data:
+            self.save_to_csv(data, os.path.basename(output_path))
+
+        self.merge_btn.config(state=tk.NORMAL, text="🚀 智能合并")
+        self.status_label.config(text="✅ 合并成功！")
+
+        # 成功提示
+        message = f"文件已保存到：\n{output_path}\n\n"
+        if data:
+            message += "🔍 已提取发票数据并使用智能文件名\n"
+            message += f"📊 已记录到汇总文件\n\n"
+
+        message += "是否打开文件所在目录？"
+
+        if messagebox.askyesno("合并成功", message):
+            output_dir = os.path.dirname(output_path)
+            if sys.platform == 'win32':
+                os.startfile(output_dir)
+
+        # 询问是否继续
+        if messagebox.askyesno("继续", "是否继续处理其他发票？"):
+            self.clear_files()
+
+    def merge_failed(self, error_msg: str):
+        """合并失败（界面线程）"""
+        self.merging = False
+        self.merge_btn.config(state=tk.NORMAL, text="🚀 智能合并")
+        self.status_label.config(text="❌ 合并失败")
+        messagebox.showerror("合并失败", f"合并过程中出现错误：\n{error_msg}")
 
     def save_to_csv(self, data: Dict[str, Any], merged_filename: str):
         """保存到CSV文件"""
@@ -693,13 +812,24 @@ class SimpleInvoiceMergerV5:
 
         # 初始化显示
         self.root.after(100, self.update_display)
+        if startup_probe.enabled():
+            self.root.after(0, self.finish_startup_probe)
         self.root.mainloop()
 
+    def finish_startup_probe(self):
+        """启动时间测量：窗口第一次显示后记录时间并退出（见 check_startup.py）"""
+        self.root.update()
+        startup_probe.mark("window")
+        startup_probe.finish()
+        self.root.destroy()
+
 
 def main():
     """主入口"""
+    # 启动时间测量时不弹出提示框
+    probe = startup_probe.enabled()
     try:
-        if not PDF_AVAILABLE:
+        if not PDF_AVAILABLE and not probe:
             messagebox.showwarning(
                 "功能提示",
                 "未检测到pypdfium2库，数据提取功能将不可用。\n\n"
@@ -707,7 +837,7 @@ def main():
                 "您仍可使用基础的文件合并功能。"
             )
         
-        if not DRAG_DROP_AVAILABLE:
+        if not DRAG_DROP_AVAILABLE and not probe:
             messagebox.showinfo(
                 "功能提示", 
                 "未检测到tkinterdnd2库，拖放功能不可用。\n\n"
@@ -720,9 +850,15 @@ def main():
         return 0
         
     except Exception as e:
+        if probe:
+            startup_probe.finish(e)
+            return 1
         messagebox.showerror("启动失败", f"程序启动失败：\n{e}")
         return 1
 
 
 if __name__ == "__main__":
+    # 打包为 exe 后，隔离的工作进程需要 freeze_support 才能正常启动
+    import multiprocessing
+    multiprocessing.freeze_support()
     sys.exit(main())
\ No newline at end of file
@@ -16,21 +16,62 @@ Key Features:
 
 from __future__ import annotations
 
+import argparse
+import functools
+import fnmatch
+import json
+import multiprocessing
 import os
 import sys
-from io import BytesIO
-from typing import Dict, Optional, Tuple, Any
+import time
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Any
 
 from PIL import Image
-import pypdfium2 as pdfium
+
+from merge_engine import (
+    DEFAULT_RESAMPLE,
+    ENGINE,
+    MAX_JPEG_QUALITY,
+    MIN_JPEG_QUALITY,
+    PAGE_DPI,
+    RESAMPLE_STRATEGIES,
+    InputSource,
+    debug,
+    describe_source,
+    encode_pdf_within_budget,
+    fit_into,
+    open_image,
+    open_pdf,
+    render_first_page,
+    resize_image,
+)
+from merge_sandbox import DEFAULT_JOB_TIMEOUT, SandboxPool
+from merge_shards import ShardRecorder, filter_batch, merge_shard_outputs, parse_shard, shard_name
+from merge_jobqueue import DEFAULT_DB_NAME, FAILED, PENDING, JobQueue, partial_output_path
+from merge_prefetch import DEFAULT_PREFETCH_THREADS, Prefetcher
+from merge_profiling import DIAGNOSTICS_DIR_NAME, DiagnosticsSampler, profile_job
+from merge_progress import CancelToken, JobCancelled, ProgressReporter
+from merge_report import RunReport, write_metrics, write_report
+from merge_scheduler import (
+    MemoryBoundedScheduler,
+    estimate_makespan,
+    estimate_triplet_cost,
+    estimate_triplet_memory,
+    format_bytes,
+    in_key_order,
+    order_largest_first,
+    probe_triplet,
+)
 
 
 ALLOWED_IMG_EXTS = {".jpg", ".jpeg", ".png"}
 
+KIND_LABELS = {"pdf": "发票PDF", "buy": "购买记录", "pay": "支付记录"}
 
-def debug(msg: str) -> None:
-    print(msg)
+OUTPUT_DIR_NAME = "已合并"
 
+# 通过 CancelToken 取消时 main 的返回码（与 Ctrl+C 中断的惯例一致）
+EXIT_CANCELLED = 130
 
 def split_suffix(filename: str) -> Tuple[str, str]:
     """返回 (无扩展名, 扩展名小写)"""
@@ -69,288 +110,696 @@ def classify_file(filename: str) -> Tuple[Optional[str], Optional[str]]:
 def build_index(root: str) -> Dict[str, Dict[str, str]]:
     """扫描目录并建立 base_key -> {pdf,buy,pay} 的路径索引"""
     index: Dict[str, Dict[str, str]] = {}
-    for name in os.listdir(root):
-        path = os.path.join(root, name)
-        if not os.path.isfile(path):
-            continue
-        base, kind = classify_file(name)
-        if not base or not kind:
-            continue
-        bucket = index.setdefault(base, {})
-        bucket[kind] = path
+    # DirEntry 自带文件类型信息，不必再对每个文件调用 stat
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_file():
+                add_to_index(index, entry.name, entry.path)
     return index
 
 
-def ensure_output_dir(root: str) -> str:
-    out_dir = os.path.join(root, "已合并")
-    os.makedirs(out_dir, exist_ok=True)
-    return out_dir
+def add_to_index(index: Dict[str, Dict[str, str]], name: str, path: str) -> None:
+    """按命名规则把文件加入索引，不符合规则的文件忽略"""
+    base, kind = classify_file(name)
+    if not base or not kind:
+        return
+    bucket = index.setdefault(base, {})
+    bucket[kind] = path
 
 
-def render_invoice_first_page_as_image(pdf_path: str, dpi: int = 300) -> Image.Image:
-    """用 pypdfium2 将源 PDF 的第一页渲染为 PIL Image（RGB）。"""
-    scale = dpi / 72.0
-    pdf = pdfium.PdfDocument(pdf_path)
-    try:
-        if len(pdf) == 0:
-            raise ValueError(f"源 PDF 无页面: {pdf_path}")
-        page = pdf[0]
-        try:
-            bitmap = page.render(scale=scale)
-            img = bitmap.to_pil()
-        finally:
-            page.close()
-    finally:
-        pdf.close()
-    return img.convert("RGB")
+def _matches_any(patterns: List[str], rel_path: str, name: str) -> bool:
+    """glob 同时匹配文件名和相对路径（以 / 分隔）"""
+    return any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in patterns)
 
 
-def make_single_page_pdf(invoice_img: Image.Image, buy_img_path: str, pay_img_path: str) -> bytes:
-    """使用 Pillow 生成最终单页 PDF（A4 纵向、白底），智能自适应布局。
-    根据三张图片的实际尺寸和比例，动态调整布局以最大化利用空间。
+def scan_tree(root: str, recursive: bool = True, include: Optional[List[str]] = None,
+              exclude: Optional[List[str]] = None) -> Iterator[Tuple[str, Dict[str, Dict[str, str]]]]:
+    """逐目录扫描（如 年/月/部门 结构），每扫描完一个目录就产出 (目录, 索引)。
+
+    - 基于 os.scandir，复用 DirEntry 缓存的类型信息，每个文件不再额外 stat
+    - 跳过输出目录"已合并"，不跟随目录符号链接
+    - include 只收录匹配的文件；exclude 排除匹配的文件和目录（整棵子树）
+    - 按名称顺序深度优先遍历，结果稳定
     """
-    a4_w_mm, a4_h_mm = 210.0, 297.0
-    margin_mm = 15.0  # 边距
-    dpi = 300
-
-    def mm_to_px(mm: float) -> int:
-        return int(round(mm / 25.4 * dpi))
-
-    page_w = mm_to_px(a4_w_mm)
-    page_h = mm_to_px(a4_h_mm)
-    margin = mm_to_px(margin_mm)
-
-    # 内容区域尺寸
-    content_w = page_w - margin * 2
-    content_h = page_h - margin * 2
-
-    # 画布
-    canvas_img = Image.new("RGB", (page_w, page_h), color=(255, 255, 255))
-
-    def open_as_rgb(path: str) -> Image.Image:
-        img = Image.open(path)
-        return img.convert("RGB")
-
-    def fit_into(img: Image.Image, max_w: int, max_h: int) -> Image.Image:
-        """等比缩放图片以适应指定区域"""
-        iw, ih = img.size
-        scale = min(max_w / iw, max_h / ih)
-        new_w = max(1, int(round(iw * scale)))
-        new_h = max(1, int(round(ih * scale)))
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        rel_dir = os.path.relpath(current, root).replace(os.sep, "/")
+        index: Dict[str, Dict[str, str]] = {}
+        subdirs: List[str] = []
         try:
-            Resampling = getattr(Image, "Resampling")
-            resample = getattr(Resampling, "LANCZOS")
-        except Exception:
-            bicubic = getattr(Image, "BICUBIC", 3)
-            resample = getattr(Image, "LANCZOS", getattr(Image, "ANTIALIAS", bicubic))
-        return img.resize((new_w, new_h), resample)
-
-    def get_best_orientation(img: Image.Image, max_w: int, max_h: int) -> Tuple[Image.Image, float]:
-        """测试图片原始方向和旋转90度后的效果，返回更适合的方向和缩放系数"""
-        w, h = img.size
-        
-        # 原始方向的缩放系数
-        scale_original = min(max_w / w, max_h / h)
-        
-        # 旋转90度后的缩放系数
-        scale_rotated = min(max_w / h, max_h / w)
-        
-        # 选择缩放系数更大的方向（即图片更大的方向）
-        if scale_rotated > scale_original:
-            rotated_img = img.rotate(90, expand=True)
-            return rotated_img, scale_rotated
-        else:
-            return img, scale_original
-
-    def get_optimal_layout(invoice_size: Tuple[int, int], buy_size: Tuple[int, int], pay_size: Tuple[int, int]) -> Dict[str, Any]:
-        """根据三张图片的尺寸计算最优布局，考虑旋转可能性"""
-        # 测试所有图片的最佳方向组合
-        best_layout = None
-        best_score = 0
-        best_orientations = {}
-        
-        # 遍历所有可能的旋转组合（2^3 = 8种组合）
-        for inv_rot in [False, True]:  # 发票是否旋转
-            for buy_rot in [False, True]:  # 购买记录是否旋转
-                for pay_rot in [False, True]:  # 支付记录是否旋转
-                    
-                    # 计算旋转后的尺寸
-                    inv_w, inv_h = invoice_size if not inv_rot else (invoice_size[1], invoice_size[0])
-                    buy_w, buy_h = buy_size if not buy_rot else (buy_size[1], buy_size[0])
-                    pay_w, pay_h = pay_size if not pay_rot else (pay_size[1], pay_size[0])
-                    
-                    # 计算各图片的宽高比
-                    inv_ratio = inv_w / inv_h
-                    buy_ratio = buy_w / buy_h
-                    pay_ratio = pay_w / pay_h
-                    
-                    # 测试方案1: 发票占上部，两图片并排占下部
-                    max_inv_h_1 = min(content_h * 0.7, content_w / inv_ratio)
-                    inv_scale_1 = min(content_w / inv_w, max_inv_h_1 / inv_h)
-                    actual_inv_h_1 = int(inv_h * inv_scale_1)
-                    
-                    remaining_h_1 = content_h - actual_inv_h_1 - mm_to_px(5)
-                    if remaining_h_1 > 0:
-                        total_width_ratio = buy_ratio + pay_ratio
-                        buy_area_w_1 = int(content_w * (buy_ratio / total_width_ratio))
-                        pay_area_w_1 = content_w - buy_area_w_1
-                        
-                        buy_scale_1 = min(buy_area_w_1 / buy_w, remaining_h_1 / buy_h)
-                        pay_scale_1 = min(pay_area_w_1 / pay_w, remaining_h_1 / pay_h)
-                    else:
-                        buy_scale_1 = pay_scale_1 = 0
-                    
-                    layout_1_score = inv_scale_1 + buy_scale_1 + pay_scale_1
-                    
-                    # 测试方案2: 发票占左侧，两图片纵向排列占右侧
-                    max_inv_w_2 = min(content_w * 0.65, content_h * inv_ratio)
-                    inv_scale_2 = min(max_inv_w_2 / inv_w, content_h / inv_h)
-                    actual_inv_w_2 = int(inv_w * inv_scale_2)
-                    
-                    remaining_w_2 = content_w - actual_inv_w_2 - mm_to_px(5)
-                    if remaining_w_2 > 0:
-                        each_h_2 = content_h // 2
-                        buy_scale_2 = min(remaining_w_2 / buy_w, each_h_2 / buy_h)
-                        pay_scale_2 = min(remaining_w_2 / pay_w, each_h_2 / pay_h)
-                    else:
-                        buy_scale_2 = pay_scale_2 = 0
-                        
-                    layout_2_score = inv_scale_2 + buy_scale_2 + pay_scale_2
-                    
-                    # 选择当前组合下的最佳布局
-                    if layout_1_score >= layout_2_score:
-                        current_score = layout_1_score
-                        current_layout = {
-                            'type': 'horizontal',
-                            'invoice_area': (0, 0, content_w, actual_inv_h_1),
-                            'buy_area': (0, actual_inv_h_1 + mm_to_px(5), buy_area_w_1, remaining_h_1),
-                            'pay_area': (buy_area_w_1, actual_inv_h_1 + mm_to_px(5), pay_area_w_1, remaining_h_1)
-                        }
-                    else:
-                        current_score = layout_2_score
-                        current_layout = {
-                            'type': 'vertical',
-                            'invoice_area': (0, 0, actual_inv_w_2, content_h),
-                            'buy_area': (actual_inv_w_2 + mm_to_px(5), 0, remaining_w_2, each_h_2),
-                            'pay_area': (actual_inv_w_2 + mm_to_px(5), each_h_2, remaining_w_2, each_h_2)
-                        }
-                    
-                    # 更新全局最佳方案
-                    if current_score > best_score:
-                        best_score = current_score
-                        best_layout = current_layout
-                        best_orientations = {
-                            'invoice_rotate': inv_rot,
-                            'buy_rotate': buy_rot,
-                            'pay_rotate': pay_rot
-                        }
-        
-        # 添加旋转信息到布局结果中
-        best_layout['orientations'] = best_orientations
-        return best_layout
-
-    # 准备三张图片
-    invoice_rgb = invoice_img.convert("RGB")
-    buy_rgb = open_as_rgb(buy_img_path)
-    pay_rgb = open_as_rgb(pay_img_path)
-    
-    # 计算最优布局（包含旋转信息）
-    layout = get_optimal_layout(invoice_rgb.size, buy_rgb.size, pay_rgb.size)
-    orientations = layout['orientations']
-    
-    # 根据最优方案旋转图片
-    if orientations['invoice_rotate']:
-        invoice_rgb = invoice_rgb.rotate(90, expand=True)
-        debug("发票图片旋转90度以优化布局")
-    
-    if orientations['buy_rotate']:
-        buy_rgb = buy_rgb.rotate(90, expand=True)
-        debug("购买记录图片旋转90度以优化布局")
-    
-    if orientations['pay_rotate']:
-        pay_rgb = pay_rgb.rotate(90, expand=True)
-        debug("支付记录图片旋转90度以优化布局")
-    
-    def paste_in_area(img: Image.Image, area: Tuple[int, int, int, int]) -> None:
-        """在指定区域内居中粘贴图片"""
-        area_x, area_y, area_w, area_h = area
-        fitted_img = fit_into(img, area_w, area_h)
-        
-        # 计算居中位置
-        img_w, img_h = fitted_img.size
-        x = margin + area_x + (area_w - img_w) // 2
-        y = margin + area_y + (area_h - img_h) // 2
-        
-        canvas_img.paste(fitted_img, (x, y))
-    
-    # 按布局粘贴三张图片（已应用旋转）
-    paste_in_area(invoice_rgb, layout['invoice_area'])
-    paste_in_area(buy_rgb, layout['buy_area'])
-    paste_in_area(pay_rgb, layout['pay_area'])
-    
-    # 保存成 PDF
-    buf = BytesIO()
-    canvas_img.save(buf, format="PDF", resolution=dpi)
-    data = buf.getvalue()
-    buf.close()
-    return data
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    rel_path = entry.name if rel_dir == "." else f"{rel_dir}/{entry.name}"
+                    if exclude and _matches_any(exclude, rel_path, entry.name):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and entry.name != OUTPUT_DIR_NAME:
+                            subdirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    if include and not _matches_any(include, rel_path, entry.name):
+                        continue
+                    add_to_index(index, entry.name, entry.path)
+        except OSError as e:
+            debug(f"无法读取目录：{current} -> {e}")
+            continue
 
+        if index:
+            yield current, index
+        stack.extend(sorted(subdirs, reverse=True))
 
-def merge_to_output(src_pdf_path: str, buy_img_path: str, pay_img_path: str, out_pdf_path: str) -> None:
-    """渲染发票第一页为图片，与两张记录图一起合成单页 PDF 输出。"""
-    inv_img = render_invoice_first_page_as_image(src_pdf_path, dpi=300)
-    page_bytes = make_single_page_pdf(inv_img, buy_img_path, pay_img_path)
-    with open(out_pdf_path, "wb") as f:
-        f.write(page_bytes)
 
+def ensure_output_dir(root: str) -> str:
+    out_dir = os.path.join(root, OUTPUT_DIR_NAME)
+    os.makedirs(out_dir, exist_ok=True)
+    return out_dir
 
-def main(argv: list[str]) -> int:
-    # 支持传入工作目录参数，或使用当前工作目录
-    if argv and os.path.exists(argv[0]):
-        root = os.path.abspath(argv[0])
-    else:
-        # 优先使用当前工作目录，而不是脚本所在目录
-        root = os.getcwd()
-    
-    out_dir = ensure_output_dir(root)
 
-    index = build_index(root)
+# 渲染、布局、合成与编码均由 merge_engine 实现，这里保留原有的函数名
+render_invoice_first_page_as_image = render_first_page
 
-    total_candidates = 0
-    total_generated = 0
+
+def make_single_page_pdf(invoice_img: Image.Image, buy_img_path: InputSource, pay_img_path: InputSource,
+                         resample: str = DEFAULT_RESAMPLE) -> bytes:
+    """使用 Pillow 生成最终单页 PDF（A4 纵向、白底），智能自适应布局。"""
+    return ENGINE.encode(ENGINE.compose(invoice_img, buy_img_path, pay_img_path, resample))[0]
+
+
+def merge_to_output(src_pdf_path: str, buy_img_path: str, pay_img_path: str, out_pdf_path: str,
+                    max_bytes: Optional[int] = None, resample: str = DEFAULT_RESAMPLE,
+                    on_stage: Optional[Callable[[str], None]] = None,
+                    on_layout: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[Dict[str, Any]]:
+    """渲染发票第一页为图片，与两张记录图一起合成单页 PDF 输出。
+    指定 max_bytes 时搜索满足大小限制的编码参数并返回所选参数，否则返回 None。
+    on_stage 在每个阶段（render / compose / encode / write）完成后调用，on_layout 接收选定的布局。
+    """
+    page_bytes, params = merge_in_memory(src_pdf_path, buy_img_path, pay_img_path, max_bytes=max_bytes,
+                                         resample=resample, on_stage=on_stage, on_layout=on_layout)
+    write_output(out_pdf_path, page_bytes)
+    if on_stage:
+        on_stage("write")
+    return params
+
+
+def merge_in_memory(pdf: InputSource, buy: InputSource, pay: InputSource, max_bytes: Optional[int] = None,
+                    resample: str = DEFAULT_RESAMPLE, on_stage: Optional[Callable[[str], None]] = None,
+                    on_layout: Optional[Callable[[Dict[str, Any]], None]] = None,
+                    diagnostics: Optional[Dict[str, Any]] = None, diagnostics_key: Optional[str] = None
+                    ) -> Tuple[bytes, Optional[Dict[str, Any]]]:
+    """不经过文件系统的合并：三个输入均可为路径、bytes、memoryview 或二进制文件对象。
+    返回 (PDF 数据, 压缩参数)；未指定 max_bytes 时压缩参数为 None。
+
+    diagnostics 为 DiagnosticsSampler.options()（或同样结构的 dict）时对这次合并做 cProfile / tracemalloc，
+    诊断文件以 diagnostics_key 命名（默认取发票 PDF 的路径或描述），见 merge_profiling.profile_job。
+    """
+    with profile_job(diagnostics_key or describe_source(pdf), diagnostics):
+        return ENGINE.merge(pdf, buy, pay, max_bytes=max_bytes, resample=resample, on_stage=on_stage,
+                            on_layout=on_layout)
+
+
+def merge_to_stream(pdf: InputSource, buy: InputSource, pay: InputSource, stream: BinaryIO,
+                    max_bytes: Optional[int] = None, resample: str = DEFAULT_RESAMPLE,
+                    diagnostics: Optional[Dict[str, Any]] = None,
+                    diagnostics_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """合并并把 PDF 写入二进制流（如 HTTP 响应、BytesIO、已打开的文件）。
+    流支持 tell() 且未限制大小时直接编码进流，不再生成中间的 bytes；否则先编码再写入。
+    diagnostics / diagnostics_key 同 merge_in_memory。
+    """
+    with profile_job(diagnostics_key or describe_source(pdf), diagnostics):
+        canvas_img = ENGINE.compose(ENGINE.render(pdf), buy, pay, resample)
+        return ENGINE.encode_to_stream(canvas_img, stream, max_bytes)
+
+
+def write_output(out_path: str, data: bytes) -> None:
+    """先写入临时文件并落盘，再原子替换为正式文件名，中途中断不会留下写了一半的输出"""
+    tmp_path = partial_output_path(out_path)
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, out_path)
+
+
+def parse_byte_size(text: str) -> int:
+    """解析字节数，支持 K/M 后缀（如 1M、800K、1048576）"""
+    value = text.strip().upper()
+    if value.endswith("B"):
+        value = value[:-1]
+    units = {"K": 1024, "M": 1024 * 1024}
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无法识别的大小: {text}")
+
+
+def plan_triplet(job: Dict[str, Any], dpi: int = PAGE_DPI) -> Dict[str, Any]:
+    """只读取文件头并计算布局，得到一套文件的预计布局、旋转、内存与耗时，不渲染任何像素"""
+    info = probe_triplet(job["pdf"], job["buy"], job["pay"])
+    pw, ph = info["page_size"]
+    invoice_size = (max(1, int(round(pw * dpi / 72.0))), max(1, int(round(ph * dpi / 72.0))))
+    (bw, bh, _), (yw, yh, _) = info["images"]
+
+    layout = ENGINE.layout(invoice_size, (bw, bh), (yw, yh), dpi)
+    return {
+        "base": job["key"],
+        **summarize_layout(layout),
+        "memory": estimate_triplet_memory(job["pdf"], job["buy"], job["pay"], dpi=dpi, probe=info),
+        "cost": round(estimate_triplet_cost(job["pdf"], job["buy"], job["pay"], dpi=dpi, probe=info), 3),
+    }
+
+
+def summarize_layout(layout: Dict[str, Any]) -> Dict[str, Any]:
+    """布局结果整理为 {"layout": 类型, "rotate": {invoice/buy/pay: 是否旋转}}（预演与运行报告使用）"""
+    orientations = layout["orientations"]
+    return {
+        "layout": layout["type"],
+        "rotate": {
+            "invoice": orientations["invoice_rotate"],
+            "buy": orientations["buy_rotate"],
+            "pay": orientations["pay_rotate"],
+        },
+    }
+
+
+def plan_batch(root: str, jobs: List[Dict[str, Any]], skipped: List[str],
+               incomplete: List[Dict[str, Any]], workers: int) -> Dict[str, Any]:
+    """生成批量合并的预演报告：齐全/缺失的文件组、预计布局与耗时"""
+    start = time.perf_counter()
+    triplets = []
+    for job in jobs:
+        try:
+            triplets.append(plan_triplet(job))
+        except Exception as e:
+            triplets.append({"base": job["key"], "error": str(e)})
+
+    costs = [t["cost"] for t in triplets if "cost" in t]
+    return {
+        "root": root,
+        "complete": len(jobs) + len(skipped),
+        "existing": len(skipped),
+        "to_merge": len(jobs),
+        "incomplete": incomplete,
+        "triplets": triplets,
+        "workers": workers,
+        "estimated_seconds": round(estimate_makespan(costs, workers), 1),
+        "plan_seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def print_plan(report: Dict[str, Any]) -> None:
+    """以表格形式输出预演报告"""
+    debug(f"目录: {report['root']}")
+    debug(f"齐全三件套: {report['complete']}（已合并 {report['existing']}，待合并 {report['to_merge']}）")
+
+    if report["incomplete"]:
+        debug(f"\n不齐全（{len(report['incomplete'])}）：")
+        for item in report["incomplete"]:
+            missing = "、".join(KIND_LABELS[k] for k in item["missing"])
+            debug(f"  {item['base']}  缺少 {missing}")
+
+    if report["triplets"]:
+        debug(f"\n{'文件组':<30}{'布局':<12}{'旋转(发票/购买/支付)':<22}{'内存':>10}{'耗时(秒)':>10}")
+        for t in report["triplets"]:
+            if "error" in t:
+                debug(f"{t['base']:<30}读取失败：{t['error']}")
+                continue
+            rot = "/".join("是" if t["rotate"][k] else "否" for k in ("invoice", "buy", "pay"))
+            debug(f"{t['base']:<30}{t['layout']:<12}{rot:<22}{format_bytes(t['memory']):>10}{t['cost']:>10.2f}")
+
+    debug(f"\n预计耗时: {report['estimated_seconds']} 秒（{report['workers']} 个进程）")
+    debug(f"预演用时: {report['plan_seconds']} 秒")
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    # merge_pipeline 依赖本模块，在此处导入以避免循环导入
+    from merge_pipeline import DEFAULT_QUEUE_DEPTH, DEFAULT_RENDER_THREADS, parse_queue_depths
+
+    parser = argparse.ArgumentParser(description="合并发票 PDF 与购买记录、支付记录图片")
+    parser.add_argument("root", nargs="?", help="发票所在目录（默认当前工作目录）")
+    parser.add_argument("--max-bytes", type=parse_byte_size, default=None,
+                        help="输出文件大小上限，如 1M；超出时自动降低质量/分辨率")
+    parser.add_argument("--resample", choices=RESAMPLE_STRATEGIES, default=DEFAULT_RESAMPLE,
+                        help="缩放质量档位：fast 最快，balanced 均衡，best 最高质量（默认）")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="并发进程数（默认 1，即逐个处理）")
+    parser.add_argument("--memory-budget", type=parse_byte_size, default=None,
+                        help="并发处理时的内存预算，如 2048M（默认物理内存的一半）")
+    parser.add_argument("--plan", nargs="?", const="table", choices=("table", "json"), default=None,
+                        help="只预演不合并：列出齐全/缺失的文件组、预计布局与耗时（可选输出 json）")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="递归处理子目录（如 年/月/部门），每个目录的结果输出到各自的'已合并'")
+    parser.add_argument("--include", action="append", default=None, metavar="GLOB",
+                        help="只处理匹配的文件（匹配文件名或相对路径，可多次指定）")
+    parser.add_argument("--exclude", action="append", default=None, metavar="GLOB",
+                        help="排除匹配的文件或目录（可多次指定）")
+    parser.add_argument("--stream", action="store_true",
+                        help="每扫描完一个目录立即合并该目录，不必等整棵目录树索引完成")
+    parser.add_argument("--job-timeout", type=float, default=DEFAULT_JOB_TIMEOUT, metavar="SECONDS",
+                        help=f"每套文件的处理超时（秒，默认 {DEFAULT_JOB_TIMEOUT:g}），超时的工作进程会被终止并替换")
+    parser.add_argument("--job-memory-limit", type=parse_byte_size, default=None, metavar="SIZE",
+                        help="每个工作进程的内存上限，如 1536M（仅 Unix 有效）")
+    parser.add_argument("--in-process", action="store_true",
+                        help="在当前进程中逐个处理，不使用隔离的工作进程（调试用）")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="以流水线方式处理：预读、渲染/解码、合成、编码/写出分阶段并行，结束时输出各阶段利用率")
+    parser.add_argument("--queue-depth", type=parse_queue_depths, default=(DEFAULT_QUEUE_DEPTH,) * 3,
+                        metavar="N[,N,N]", help=f"流水线各阶段之间的队列深度（默认 {DEFAULT_QUEUE_DEPTH}）")
+    parser.add_argument("--render-threads", type=int, default=DEFAULT_RENDER_THREADS,
+                        help=f"流水线渲染/解码线程数（默认 {DEFAULT_RENDER_THREADS}）")
+    parser.add_argument("--prefetch", type=parse_byte_size, default=None, metavar="SIZE",
+                        help="在后台预读即将处理的文件组到内存（适用于网络共享目录），SIZE 为预读数据上限，如 256M")
+    parser.add_argument("--prefetch-threads", type=int, default=DEFAULT_PREFETCH_THREADS,
+                        help=f"预读线程数（默认 {DEFAULT_PREFETCH_THREADS}）")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="K/N",
+                        help="只处理第 K 个分片（共 N 个，按文件组哈希分配），多台机器可共享目录分担同一批任务")
+    parser.add_argument("--merge-shards", action="store_true",
+                        help="合并各分片写出的汇总与 CSV 记录（所有分片结束后运行）")
+    parser.add_argument("--queue", nargs="?", const="", default=None, metavar="DB",
+                        help=f"用 SQLite 任务表记录进度，中断后重新运行从断点继续（默认 已合并/{DEFAULT_DB_NAME}）")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="只重试任务表中失败的任务（隐含 --queue）")
+    parser.add_argument("--report", metavar="JSON",
+                        help="运行结束时写出 JSON 报告：每套文件的状态、用时、输出大小、布局与错误，以及吞吐汇总")
+    parser.add_argument("--metrics", metavar="PROM",
+                        help="运行结束时写出 Prometheus 文本格式的指标文件（供 node_exporter textfile collector 采集）")
+    parser.add_argument("--profile", action="store_true",
+                        help="对每套文件的处理运行 cProfile，写出 .prof 与按累计耗时排序的摘要（可与 --include 配合只诊断指定文件组）")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="对每套文件的处理运行 tracemalloc，写出 Python 分配峰值与分配最多的代码行")
+    parser.add_argument("--profile-every", type=int, default=1, metavar="N",
+                        help="--profile / --trace-memory 每 N 套文件抽样 1 套（默认 1，即每套都诊断）")
+    parser.add_argument("--diagnostics-dir", default=None, metavar="DIR",
+                        help=f"诊断文件的输出目录（默认 {OUTPUT_DIR_NAME}/{DIAGNOSTICS_DIR_NAME}）")
+    args = parser.parse_args(argv)
+    if args.profile_every < 1:
+        parser.error("--profile-every 必须大于等于 1")
+    if args.pipeline and (args.profile or args.trace_memory):
+        # 流水线中一套文件的各阶段分散在多个线程中，无法按文件组单独诊断
+        parser.error("--profile / --trace-memory 不能与 --pipeline 同时使用")
+    return args
+
+
+def run_job(job: Dict[str, Any], on_stage: Optional[Callable[[str], None]] = None) -> Optional[Dict[str, Any]]:
+    """执行一个合并任务，可在工作进程中运行；返回 merge_to_output 的结果"""
+    return run_job_with_layout(job, on_stage)[0]
+
+
+def run_job_with_layout(job: Dict[str, Any], on_stage: Optional[Callable[[str], None]] = None
+                        ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """执行一个合并任务，返回 (压缩参数, 选用的布局与旋转)。布局在工作进程中随合并得到，
+    运行报告不必在主进程中再次打开 PDF。
+    job 带有 diagnostics（由 DiagnosticsSampler 标记）时对这一套的处理做性能诊断
+    """
+    chosen: List[Dict[str, Any]] = []
+    with profile_job(job["key"], job.get("diagnostics")):
+        params = merge_to_output(job["pdf"], job["buy"], job["pay"], job["out_path"],
+                                 max_bytes=job.get("max_bytes"), resample=job.get("resample", DEFAULT_RESAMPLE),
+                                 on_stage=on_stage, on_layout=chosen.append)
+    return params, summarize_layout(chosen[0]) if chosen else None
+
+
+def run_jobs_sequential(jobs: Iterable[Dict[str, Any]],
+                        on_start: Optional[Callable[[Dict[str, Any]], None]] = None,
+                        on_stage: Optional[Callable[[Dict[str, Any], str], None]] = None,
+                        ) -> Iterator[Tuple[Dict[str, Any], Any, Optional[BaseException]]]:
+    """在当前进程中依次执行任务，产出 (job, (压缩参数, 布局), 异常)；on_start 在每个任务开始前调用，
+    on_stage(job, 阶段) 在每个阶段完成后调用
+    """
+    for job in jobs:
+        if on_start:
+            on_start(job)
+        try:
+            yield job, run_job_with_layout(job, functools.partial(on_stage, job) if on_stage else None), None
+        except Exception as e:
+            yield job, None, e
+
+
+def run_jobs_scheduled(jobs: List[Dict[str, Any]], scheduler: MemoryBoundedScheduler,
+                       on_start: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       prefetcher: Optional[Prefetcher] = None,
+                       on_complete: Optional[Callable[[Dict[str, Any], Any, Optional[BaseException]], None]] = None,
+                       cancel: Optional[CancelToken] = None) -> Iterator[Tuple[Dict[str, Any], Any, Optional[BaseException]]]:
+    """在多进程中按内存预算并发执行任务，产出 (job, (压缩参数, 布局), 异常)。
+    按估算耗时从大到小提交以缩短总时长，结果仍按文件组顺序产出。
+    scheduler 可跨多批任务复用（--stream 时每个目录一批），工作进程不会重复启动。
+    指定 prefetcher 时按提交顺序预读输入文件，任务完成后立即释放预读的数据。
+    on_complete(job, 结果, 异常) 在任务完成时立即调用（不等待按文件组顺序排列），用于实时进度；
+    cancel 取消后不再提交新的任务（在准入时检查，已预取或预读但未提交的任务也不会开始）。
+    """
+    for job in jobs:
+        info = probe_triplet(job["pdf"], job["buy"], job["pay"])
+        job["estimate"] = estimate_triplet_memory(job["pdf"], job["buy"], job["pay"], dpi=300, probe=info)
+        job["cost"] = estimate_triplet_cost(job["pdf"], job["buy"], job["pay"], dpi=300, probe=info)
+
+    ordered: Iterable[Dict[str, Any]] = order_largest_first(jobs, key="key")
+    if cancel:
+        # 取消后不再预读后面的文件组
+        ordered = cancel.guard(ordered)
+    if prefetcher:
+        ordered = prefetcher.iter_jobs(ordered)
+
+    def tap(items: Iterable[Tuple[Dict[str, Any], Any]]) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        for job, future in items:
+            if prefetcher:
+                prefetcher.release(job)
+            if on_complete:
+                error = future.exception()
+                on_complete(job, None if error else future.result(), error)
+            yield job, future
+
+    completed = tap(scheduler.run(ordered, run_job_with_layout, on_submit=on_start, cancel=cancel))
+    for job, future in in_key_order(completed, [job["key"] for job in jobs], key="key"):
+        error = future.exception()
+        yield job, (None if error else future.result()), error
+
+
+def collect_jobs(root: str, dirpath: str, index: Dict[str, Dict[str, str]],
+                 args: argparse.Namespace) -> Dict[str, Any]:
+    """把一个目录的索引整理为待合并任务、已存在的输出和不齐全的文件组。
+    key 为相对 root 的 "目录/base_key"，用于排序和报告；输出写到该目录下的"已合并"。
+    """
+    rel_dir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+    out_dir = os.path.join(dirpath, OUTPUT_DIR_NAME)
+    batch: Dict[str, Any] = {"candidates": 0, "jobs": [], "skipped": [], "incomplete": []}
 
     for base, items in sorted(index.items()):
+        key = base if rel_dir == "." else f"{rel_dir}/{base}"
         pdf_path = items.get("pdf")
         buy_path = items.get("buy")
         pay_path = items.get("pay")
 
         # 必须三者齐全
         if not (pdf_path and buy_path and pay_path):
+            batch["incomplete"].append({"base": key, "missing": [k for k in KIND_LABELS if k not in items]})
             continue
 
-        total_candidates += 1
+        batch["candidates"] += 1
 
         out_name = f"{base}已合并.pdf"
         out_path = os.path.join(out_dir, out_name)
 
         if os.path.exists(out_path):
-            debug(f"跳过（已存在）：{out_name}")
+            batch["skipped"].append(key)
+            if not args.plan:
+                debug(f"跳过（已存在）：{key}已合并.pdf")
             continue
 
-        try:
-            merge_to_output(pdf_path, buy_path, pay_path, out_path)
-            total_generated += 1
-            debug(f"生成完成：{out_name}")
-        except Exception as e:
-            debug(f"失败：{base} -> {e}")
+        batch["jobs"].append({
+            "key": key,
+            "base": base,
+            "pdf": pdf_path,
+            "buy": buy_path,
+            "pay": pay_path,
+            "out_path": out_path,
+            "max_bytes": args.max_bytes,
+            "resample": args.resample,
+        })
+    return batch
+
+
+def report_merged_shards(out_dir: str) -> int:
+    """合并各分片的汇总与 CSV 记录；有分片未结束时返回 1"""
+    report = merge_shard_outputs(out_dir)
+    if not report["shards"]:
+        debug(f"未找到分片记录：{out_dir}")
+        return 1
+    counts = report["counts"]
+    debug(f"分片: {len(report['finished'])}/{report['shards']} 已结束")
+    debug(f"完成 {counts['done']}，失败 {counts['failed']}，已存在 {counts['existing']}，不齐全 {counts['incomplete']}")
+    debug(f"汇总记录: {report['csv']}（{report['records']} 条）")
+    if report["missing"]:
+        debug(f"未结束的分片: {', '.join(str(k) for k in report['missing'])}")
+        return 1
+    return 0
+
+
+def main(argv: list[str], progress: Any = None, cancel: Optional[CancelToken] = None) -> int:
+    """命令行入口，也供图形界面调用。
+    progress 为进度事件的回调函数或队列（见 merge_progress），cancel 为协作式取消标记；
+    取消后正在处理的文件组处理完即返回 EXIT_CANCELLED。
+    """
+    args = parse_args(argv)
+
+    # 支持传入工作目录参数，或使用当前工作目录
+    if args.root and os.path.exists(args.root):
+        root = os.path.abspath(args.root)
+    else:
+        # 优先使用当前工作目录，而不是脚本所在目录
+        root = os.getcwd()
+    
+    out_dir = os.path.join(root, OUTPUT_DIR_NAME)
+
+    if args.merge_shards:
+        return report_merged_shards(out_dir)
+
+    total_candidates = 0
+    total_generated = 0
+
+    scanned = scan_tree(root, recursive=args.recursive, include=args.include, exclude=args.exclude)
+    batches = (collect_jobs(root, dirpath, index, args) for dirpath, index in scanned)
+    if args.shard:
+        batches = (filter_batch(batch, *args.shard) for batch in batches)
+    if args.plan or not args.stream:
+        # 非流式：先索引完整棵目录树，再统一处理
+        merged: Dict[str, Any] = {"candidates": 0, "jobs": [], "skipped": [], "incomplete": []}
+        for batch in batches:
+            merged["candidates"] += batch["candidates"]
+            for name in ("jobs", "skipped", "incomplete"):
+                merged[name].extend(batch[name])
+        batches = iter([merged])
+
+    if args.plan:
+        report = plan_batch(root, merged["jobs"], merged["skipped"], merged["incomplete"], max(1, args.workers))
+        if args.plan == "json":
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            print_plan(report)
+        return 0
+
+    ensure_output_dir(root)
+
+    queue = None
+    if args.queue is not None or args.retry_failed:
+        # 分片运行时各分片使用自己的任务表，避免多台机器通过网络文件系统争用同一个 SQLite 文件
+        db_name = f"{shard_name(*args.shard)}.sqlite" if args.shard else DEFAULT_DB_NAME
+        queue = JobQueue(args.queue or os.path.join(out_dir, db_name))
+        recovered = queue.recover()
+        if recovered:
+            debug(f"恢复上次中断的任务: {len(recovered)} 个")
+        if args.retry_failed:
+            # 只重放任务表中失败的任务，不重新扫描目录
+            failed = queue.jobs(FAILED)
+            debug(f"重试失败的任务: {len(failed)} 个")
+            batches = iter([{"candidates": len(failed), "jobs": failed, "skipped": [], "incomplete": []}])
+
+    reporter = ProgressReporter(progress) if progress is not None else None
+    sampler = DiagnosticsSampler(args.diagnostics_dir or os.path.join(out_dir, DIAGNOSTICS_DIR_NAME),
+                                 profile=args.profile, trace_memory=args.trace_memory, every=args.profile_every)
+    run_report = RunReport(root, argv, shard=args.shard) if args.report or args.metrics else None
+
+    def on_start(job: Dict[str, Any]) -> None:
+        if queue:
+            queue.mark_running(job["key"])
+        if run_report:
+            run_report.job_started(job)
+        if reporter:
+            reporter.job_started(job)
+
+    def report_stage(job: Dict[str, Any], stage: str) -> None:
+        if run_report:
+            run_report.job_stage(job, stage)
+        if reporter:
+            reporter.job_stage(job, stage)
+
+    on_stage = report_stage if reporter or run_report else None
+
+    def on_complete(job: Dict[str, Any], result: Any, error: Optional[BaseException]) -> None:
+        if run_report:
+            run_report.job_completed(job)
+        if not reporter:
+            return
+        if error is not None:
+            reporter.job_failed(job, error)
+        else:
+            reporter.job_finished(job, output=job["out_path"])
+
+    recorder = None
+    if args.shard:
+        recorder = ShardRecorder(out_dir, *args.shard, root=root)
+        debug(f"分片 {args.shard[0]}/{args.shard[1]}：记录写入 {recorder.shard_dir}")
+
+    prefetcher = None
+    if args.prefetch:
+        prefetcher = Prefetcher(budget=args.prefetch, threads=args.prefetch_threads)
+
+    reporter_started = False
+    pipeline = None
+    scheduler = None
+    if args.pipeline:
+        # 流水线在当前进程中以线程运行，不经过隔离的工作进程
+        from merge_pipeline import MergePipeline
+
+        pipeline = MergePipeline(args.queue_depth, args.render_threads, on_start=on_start, on_stage=on_stage,
+                                 cancel=cancel)
+    elif not args.in_process:
+        # 每套文件在隔离的工作进程中处理：异常 PDF 导致的崩溃或卡死只影响该文件组
+        def make_pool(n: int) -> SandboxPool:
+            return SandboxPool(n, timeout=args.job_timeout, memory_limit=args.job_memory_limit)
+
+        scheduler = MemoryBoundedScheduler(memory_budget=args.memory_budget, max_workers=max(1, args.workers),
+                                           executor_factory=make_pool)
+        if args.workers > 1:
+            debug(f"并发处理：最多 {scheduler.max_workers} 个进程，内存预算 {format_bytes(scheduler.memory_budget)}")
+
+    try:
+        for batch in batches:
+            if cancel and cancel.cancelled:
+                break
+            jobs = batch["jobs"]
+            total_candidates += batch["candidates"]
+            if recorder:
+                for key in batch["skipped"]:
+                    recorder.record(key, "existing")
+                for item in batch["incomplete"]:
+                    recorder.record(item["base"], "incomplete")
+            if run_report:
+                for key in batch["skipped"]:
+                    run_report.record(key, "existing")
+                for item in batch["incomplete"]:
+                    run_report.record(item["base"], "incomplete", missing=item["missing"])
+            if queue and not args.retry_failed:
+                states = queue.sync(jobs)
+                for job in jobs:
+                    if states[job["key"]] == FAILED:
+                        debug(f"跳过（上次失败，可用 --retry-failed 重试）：{job['key']}")
+                        if recorder:
+                            recorder.record(job["key"], "failed")
+                        if run_report:
+                            run_report.record(job["key"], "skipped", reason="上次失败，未重试")
+                jobs = [job for job in jobs if states[job["key"]] == PENDING]
+            for job_dir in sorted({os.path.dirname(job["out_path"]) for job in jobs}):
+                os.makedirs(job_dir, exist_ok=True)
+            if run_report:
+                run_report.add_jobs(jobs)
+            for job in jobs:
+                sampler.tag(job)
+            if reporter:
+                reporter.add_total(len(jobs))
+                if not reporter_started:
+                    reporter.batch_started()
+                    reporter_started = True
+
+            if scheduler:
+                results = run_jobs_scheduled(jobs, scheduler, on_start, prefetcher, on_complete, cancel)
+            else:
+                pending: Iterable[Dict[str, Any]] = cancel.guard(jobs) if cancel else jobs
+                if prefetcher:
+                    pending = prefetcher.iter_jobs(pending)
+                    if cancel:
+                        # 预读会超前取出整个预读窗口，取消后窗口中已读入的文件组同样不再开始
+                        pending = cancel.guard(pending)
+                if pipeline:
+                    results = pipeline.run(pending)
+                else:
+                    results = run_jobs_sequential(pending, on_start, on_stage)
+
+            for job, result, error in results:
+                if prefetcher:
+                    prefetcher.release(job)
+                if isinstance(error, JobCancelled):
+                    # 流水线队列中因取消而放弃的文件组：未写出任何文件，任务表中恢复为待处理
+                    debug(f"已取消：{job['key']}")
+                    if queue:
+                        queue.mark_pending(job["key"])
+                    if run_report:
+                        run_report.record(job["key"], "cancelled")
+                    continue
+                if not scheduler:
+                    on_complete(job, result, error)
+                if error is not None:
+                    debug(f"失败：{job['key']} -> {error}")
+                    if queue:
+                        queue.mark_failed(job["key"], f"{type(error).__name__}: {error}")
+                    if recorder:
+                        recorder.record(job["key"], "failed", error=error)
+                    if run_report:
+                        run_report.record(job["key"], "failed", error=error)
+                    continue
+                params, plan = result
+                if queue:
+                    queue.mark_done(job["key"])
+                if recorder:
+                    recorder.record(job["key"], "done", output=job["out_path"], params=params)
+                if run_report:
+                    run_report.record(job["key"], "done", output=job["out_path"], params=params, plan=plan)
+                total_generated += 1
+                debug(f"生成完成：{job['key']}已合并.pdf")
+                if params:
+                    note = "" if params["fits"] else "（仍超出大小限制）"
+                    debug(f"  压缩参数：质量 {params['quality']}，分辨率 {params['dpi']} DPI，"
+                          f"大小 {params['size']} 字节{note}")
+    finally:
+        if scheduler:
+            scheduler.close()
+        if scheduler and args.workers > 1:
+            debug(f"观测到的峰值内存: {format_bytes(scheduler.peak_observed)}，最终并发数: {scheduler.concurrency}")
+        if queue:
+            counts = queue.counts()
+            debug(f"任务表: 完成 {counts['done']}，失败 {counts['failed']}，待处理 {counts['pending']}"
+                  f"（{queue.db_path}）")
+            queue.close()
+
+    cancelled = bool(cancel and cancel.cancelled)
+    if reporter:
+        reporter.batch_finished(cancelled=cancelled)
+    if cancelled:
+        debug("\n已取消：正在处理的文件组已完成，其余文件组未处理")
+
+    if prefetcher:
+        stats = prefetcher.summary()
+        debug(f"预读：{stats['files']} 个文件，共 {format_bytes(stats['bytes_read'])}，读取用时 {stats['read_seconds']} 秒，"
+              f"等待预读 {stats['wait_seconds']} 秒，峰值缓冲 {format_bytes(stats['peak_buffered_bytes'])}")
+
+    if pipeline:
+        from merge_pipeline import format_stage_summary
+
+        debug("\n流水线各阶段：")
+        for line in format_stage_summary(pipeline.summary(), pipeline.elapsed):
+            debug(line)
+
+    if sampler.enabled:
+        debug(f"性能诊断：{sampler.sampled} 套文件，结果在 {sampler.out_dir}")
+
+    if recorder:
+        # 取消的分片不写汇总，--merge-shards 会把它列为未完成
+        summary = recorder.close(write_summary=not cancelled)
+        if summary:
+            debug(f"分片汇总: {recorder.summary_path}（用时 {summary['elapsed_seconds']} 秒）")
 
     debug("\n统计：")
     debug(f"候选（齐全三件套）: {total_candidates}")
     debug(f"本次新生成: {total_generated}")
-    debug(f"输出目录: {out_dir}")
+    if args.recursive:
+        debug(f"输出目录: 各目录下的 {OUTPUT_DIR_NAME}（根目录: {out_dir}）")
+    else:
+        debug(f"输出目录: {out_dir}")
 
-    return 0
+    exit_code = EXIT_CANCELLED if cancelled else 0
+    if run_report:
+        report = run_report.finish(exit_code, cancelled)
+        if args.report:
+            write_report(args.report, report)
+            debug(f"运行报告: {args.report}")
+        if args.metrics:
+            write_metrics(args.metrics, report)
+            debug(f"指标文件: {args.metrics}")
+    return exit_code
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     sys.exit(main(sys.argv[1:]))
\ No newline at end of file
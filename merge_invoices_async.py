@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+发票合并 asyncio 接口
+
+在 asyncio 程序中直接调用 merge_simple / extract_invoice_data 会阻塞事件循环。
+AsyncInvoiceMerger 把渲染、解码、编码交给托管的进程池执行（默认 merge_sandbox.SandboxPool，
+pypdfium2 不是线程安全的，因此不使用线程池），并提供：
+
+- 有界信号量实现的背压：同时提交到进程池的任务不超过 max_pending，其余在事件循环中等待
+- 取消：等待中的任务被取消时不再提交；已提交但未开始的任务从进程池中撤回
+- async for 流式返回批量结果（merge_batch）
+
+合并逻辑与 merge_invoices.py 完全相同（merge_in_memory / run_job）。
+
+用法:
+    async with AsyncInvoiceMerger(workers=2) as merger:
+        pdf_bytes, _ = await merger.merge(pdf_bytes, buy_bytes, pay_bytes)
+        async for job, params, error in merger.merge_batch(jobs):
+            ...
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from concurrent.futures import Executor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Optional, Tuple
+
+from merge_invoices import DEFAULT_RESAMPLE, InputSource, merge_in_memory, run_job
+from merge_sandbox import DEFAULT_JOB_TIMEOUT, SandboxPool
+
+
+def _picklable(source: InputSource) -> Any:
+    """文件对象无法传给工作进程，先在当前进程读出内容；memoryview 转为 bytes"""
+    if isinstance(source, (str, os.PathLike, bytes)):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    return source.read()
+
+
+def _extract(pdf: Any) -> Dict[str, Any]:
+    from invoice_extract import InvoiceDataExtractor
+
+    return InvoiceDataExtractor.extract_invoice_data(pdf)
+
+
+class AsyncInvoiceMerger:
+    """asyncio 合并与数据提取接口，见模块说明"""
+
+    def __init__(self, workers: int = 2, max_pending: Optional[int] = None,
+                 timeout: Optional[float] = DEFAULT_JOB_TIMEOUT, memory_limit: Optional[int] = None,
+                 executor: Optional[Executor] = None):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending or self.workers * 2
+        self._own_executor = executor is None
+        self._executor = executor or SandboxPool(self.workers, timeout=timeout, memory_limit=memory_limit)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "AsyncInvoiceMerger":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """关闭自建的进程池（不阻塞事件循环）"""
+        if self._own_executor:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, lambda: self._executor.shutdown(wait=True, cancel_futures=True))
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # 在首次使用时创建，保证绑定到正在运行的事件循环
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        return self._semaphore
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """在进程池中执行 fn(*args)。超过 max_pending 时在此等待（背压）；
+        被取消时，尚未开始执行的任务会从进程池中撤回。
+        """
+        async with self.semaphore:
+            future = self._executor.submit(fn, *args)
+            try:
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+
+    async def merge(self, pdf: InputSource, buy: InputSource, pay: InputSource, max_bytes: Optional[int] = None,
+                    resample: str = DEFAULT_RESAMPLE) -> Tuple[bytes, Optional[Dict[str, Any]]]:
+        """合并三个输入（路径、bytes、memoryview 或文件对象），返回 (PDF 数据, 压缩参数)"""
+        return await self.run(merge_in_memory, _picklable(pdf), _picklable(buy), _picklable(pay),
+                              max_bytes, resample)
+
+    async def extract(self, pdf: InputSource) -> Dict[str, Any]:
+        """提取发票关键信息（见 invoice_extract.InvoiceDataExtractor）"""
+        return await self.run(_extract, _picklable(pdf))
+
+    async def merge_batch(self, jobs: Iterable[Dict[str, Any]]
+                          ) -> AsyncIterator[Tuple[Dict[str, Any], Any, Optional[BaseException]]]:
+        """按完成顺序流式产出 (job, 结果, 异常)。job 的格式与 merge_invoices.main 中的任务相同
+        （pdf / buy / pay / out_path / max_bytes / resample）。
+
+        任务按需创建，同时在途的任务不超过 max_pending；调用方停止迭代或被取消时，其余任务随之取消。
+        """
+        iterator = iter(jobs)
+        running: Dict[asyncio.Task, Dict[str, Any]] = {}
+
+        def fill() -> None:
+            while len(running) < self.max_pending:
+                job = next(iterator, None)
+                if job is None:
+                    return
+                running[asyncio.ensure_future(self.run(run_job, job))] = job
+
+        try:
+            fill()
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    job = running.pop(task)
+                    error = task.exception()
+                    yield job, (None if error else task.result()), error
+                fill()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
@@ -7,30 +7,41 @@
 """
 
 import tkinter as tk
-from tkinter import messagebox, filedialog
+from tkinter import messagebox, filedialog, ttk
 import os
 import sys
 import threading
-from pathlib import Path
 
-# 导入原有的合并逻辑
+
+def load_merge_main():
+    """导入合并逻辑（Pillow、pypdfium2 较大，第一次合并时才导入，窗口可以更快显示）"""
+    try:
+        from merge_invoices import main as merge_main
+    except ImportError:
+        # 如果打包后找不到模块，尝试从当前目录导入
+        import importlib.util
+        current_dir = os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) else os.path.dirname(__file__)
+        merge_script = os.path.join(current_dir, 'merge_invoices.py')
+        if os.path.exists(merge_script):
+            spec = importlib.util.spec_from_file_location("merge_invoices", merge_script)
+            merge_module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(merge_module)
+            merge_main = merge_module.main
+        else:
+            # 最后的备用方案：内嵌合并逻辑
+            def merge_main(args, **kwargs):
+                print("错误：无法找到合并逻辑模块")
+                return 1
+    return merge_main
+
+
+# 进度事件与取消（找不到时退回到结束后一次性显示输出）
 try:
-    from merge_invoices import main as merge_main
+    from merge_progress import (BATCH_FINISHED, STAGE_DONE, TRIPLET_FAILED, TRIPLET_FINISHED, CancelToken,
+                                format_duration, format_event)
+    PROGRESS_AVAILABLE = True
 except ImportError:
-    # 如果打包后找不到模块，尝试从当前目录导入
-    import importlib.util
-    current_dir = os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) else os.path.dirname(__file__)
-    merge_script = os.path.join(current_dir, 'merge_invoices.py')
-    if os.path.exists(merge_script):
-        spec = importlib.util.spec_from_file_location("merge_invoices", merge_script)
-        merge_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(merge_module)
-        merge_main = merge_module.main
-    else:
-        # 最后的备用方案：内嵌合并逻辑
-        def merge_main(args):
-            print("错误：无法找到合并逻辑模块")
-            return 1
+    PROGRESS_AVAILABLE = False
 
 
 class InvoiceMergerGUI:
@@ -39,6 +50,10 @@ class InvoiceMergerGUI:
         self.root.title("发票合并工具 v3.0")
         self.root.geometry("600x500")
         self.root.resizable(True, True)
+
+        # 当前批次的取消标记
+        self.cancel_token = None
+        self.running = False
         
         # 设置图标（如果有的话）
         try:
@@ -113,6 +128,24 @@ class InvoiceMergerGUI:
             command=self.use_current_directory
         )
         current_btn.pack(side="left", padx=10)
+
+        # 停止按钮：处理完当前这套文件后停止
+        self.cancel_btn = tk.Button(
+            button_frame,
+            text="⏹ 停止",
+            font=("微软雅黑", 12),
+            bg="#e74c3c",
+            fg="white",
+            padx=20,
+            pady=10,
+            state="disabled",
+            command=self.cancel_merge
+        )
+        self.cancel_btn.pack(side="left", padx=10)
+
+        # 进度条
+        self.progress_bar = ttk.Progressbar(self.root, mode="determinate")
+        self.progress_bar.pack(fill="x", padx=20)
         
         # 进度显示
         self.status_label = tk.Label(
@@ -161,8 +194,16 @@ class InvoiceMergerGUI:
             self.process_directory(current_dir)
             
     def process_directory(self, directory):
+        if self.running:
+            messagebox.showinfo("正在处理", "当前批次尚未结束，请等待完成或点击停止")
+            return
+        self.running = True
         self.status_label.config(text=f"正在处理: {directory}")
         self.result_text.delete(1.0, tk.END)
+        self.progress_bar.config(value=0, maximum=1)
+        if PROGRESS_AVAILABLE:
+            self.cancel_token = CancelToken()
+            self.cancel_btn.config(state="normal")
         
         # 在新线程中执行合并操作，避免界面卡顿
         thread = threading.Thread(
@@ -183,9 +224,14 @@ class InvoiceMergerGUI:
             
             output_buffer = io.StringIO()
             
-            # 直接传递目录参数，不切换工作目录
+            # 直接传递目录参数，不切换工作目录；进度事件实时转回界面线程
             with redirect_stdout(output_buffer), redirect_stderr(output_buffer):
-                result_code = merge_main([directory])
+                merge_main = load_merge_main()
+                if PROGRESS_AVAILABLE:
+                    result_code = merge_main([directory], cancel=self.cancel_token,
+                                             progress=lambda event: self.root.after(0, self.on_progress, event))
+                else:
+                    result_code = merge_main([directory])
             
             # 获取输出内容
             output = output_buffer.getvalue()
@@ -205,11 +251,38 @@ class InvoiceMergerGUI:
                 pass
             self.root.after(0, self.show_error, str(e))
             
+    def on_progress(self, event):
+        """显示进度事件：日志追加一行，进度条与剩余时间随每套文件完成更新"""
+        if event["event"] == STAGE_DONE:
+            return
+        self.result_text.insert(tk.END, format_event(event) + "\n")
+        self.result_text.see(tk.END)
+        processed = event["done"] + event["failed"]
+        self.progress_bar.config(maximum=max(1, event["total"]), value=processed)
+        if event["event"] in (TRIPLET_FINISHED, TRIPLET_FAILED):
+            self.status_label.config(
+                text=f"已处理 {processed}/{event['total']} 组（失败 {event['failed']}），"
+                     f"预计剩余 {format_duration(event['eta'])}")
+        elif event["event"] != BATCH_FINISHED:
+            self.status_label.config(text=f"正在处理：{event['key'] or ''}")
+
+    def cancel_merge(self):
+        """请求停止：正在处理的这套文件完成后停止，未处理的文件下次运行时仍会处理"""
+        if self.cancel_token:
+            self.cancel_token.cancel()
+            self.cancel_btn.config(state="disabled")
+            self.status_label.config(text="正在停止：等待当前这套文件处理完成……")
+
     def update_result(self, directory, output, result_code):
+        self.running = False
+        self.cancel_btn.config(state="disabled")
         self.result_text.delete(1.0, tk.END)
         self.result_text.insert(tk.END, output)
-        
-        if result_code == 0:
+
+        if self.cancel_token and self.cancel_token.cancelled:
+            self.status_label.config(text="⏹ 已停止，已完成的文件保存在'已合并'目录")
+            messagebox.showinfo("已停止", f"已停止处理，未处理的发票下次运行时会继续合并。\n\n处理目录：{directory}")
+        elif result_code == 0:
             self.status_label.config(text="✅ 处理完成！合并文件已保存到'已合并'目录")
             messagebox.showinfo(
                 "处理完成", 
@@ -220,6 +293,8 @@ class InvoiceMergerGUI:
             messagebox.showwarning("注意", "处理完成，但可能存在一些问题，请查看详细信息。")
             
     def show_error(self, error_msg):
+        self.running = False
+        self.cancel_btn.config(state="disabled")
         self.status_label.config(text="❌ 处理失败")
         messagebox.showerror("错误", f"处理过程中发生错误：\n{error_msg}")
         
@@ -240,7 +315,7 @@ def main():
     try:
         # 如果是在没有显示的环境下运行，使用命令行模式
         if len(sys.argv) > 1 and sys.argv[1] == "--cli":
-            return merge_main(sys.argv[2:])
+            return load_merge_main()(sys.argv[2:])
         
         # 尝试启动GUI
         app = InvoiceMergerGUI()
@@ -250,7 +325,7 @@ def main():
     except Exception as e:
         # GUI启动失败时回退到命令行模式
         print(f"GUI启动失败，使用命令行模式: {e}")
-        return merge_main(sys.argv[1:])
+        return load_merge_main()(sys.argv[1:])
 
 
 if __name__ == "__main__":
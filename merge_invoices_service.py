@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+发票合并 HTTP 服务 - 常驻进程，避免每次上传都重新启动解释器
+
+报销系统原先每次上传都调用一次脚本，每次都要付出启动解释器、导入 pypdfium2 与 Pillow 的开销。
+本服务只用标准库 http.server 实现，常驻若干预热好的工作进程（见 merge_sandbox.SandboxPool）：
+
+    POST /merge      multipart/form-data，字段 invoice（发票 PDF）、buy（购买记录）、pay（支付记录）
+                     可选查询参数：format=json|pdf、max_bytes=1M、resample=fast|balanced|best
+                     format=json（默认）返回 {"filename", "invoice", "size", "seconds", "pdf"(base64)}
+                     format=pdf 直接返回 PDF，发票数据放在 X-Invoice-Data 响应头（JSON）
+    GET  /health     运行状态与统计（JSON）
+    GET  /metrics    Prometheus 文本格式的统计
+
+并发由 --workers（工作进程数）和 --max-queue（排队上限）控制，超出时返回 503；
+单个请求超过 --job-timeout 秒未完成时终止对应工作进程并返回 504。
+
+用法:
+    python merge_invoices_service.py --port 8765 --workers 2 --max-queue 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlsplit
+
+from merge_invoices import DEFAULT_RESAMPLE, RESAMPLE_STRATEGIES, merge_in_memory, parse_byte_size
+from merge_sandbox import DEFAULT_JOB_TIMEOUT, JobTimeout, SandboxError, SandboxPool
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_QUEUE = 8
+DEFAULT_MAX_UPLOAD = 50 * 1024 * 1024
+DISCARD_CHUNK_SIZE = 64 * 1024
+UPLOAD_FIELDS = ("invoice", "buy", "pay")
+
+
+class RequestError(Exception):
+    """请求无效，带 HTTP 状态码"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _warm_up() -> int:
+    """在工作进程中提前导入 Pillow / pypdfium2 和合并、提取模块"""
+    import invoice_extract  # noqa: F401
+    import merge_invoices  # noqa: F401
+    return os.getpid()
+
+
+def merge_uploaded(files: Dict[str, Tuple[str, bytes]], max_bytes: Optional[int] = None,
+                   resample: str = DEFAULT_RESAMPLE) -> Dict[str, Any]:
+    """在工作进程中执行：合并上传的三个文件并提取发票数据。
+
+    files 为 字段名 -> (原文件名, 内容)。返回 {"pdf": bytes, "invoice": dict|None, "extract_error", "params"}。
+    """
+    from invoice_extract import PDF_AVAILABLE, InvoiceDataExtractor
+
+    # 上传内容直接在内存中渲染与合成，不写临时文件
+    pdf_bytes, params = merge_in_memory(files["invoice"][1], files["buy"][1], files["pay"][1],
+                                        max_bytes=max_bytes, resample=resample)
+
+    invoice, extract_error = None, None
+    if PDF_AVAILABLE:
+        try:
+            invoice = InvoiceDataExtractor.extract_invoice_data(files["invoice"][1])
+            invoice.pop("file_path", None)
+            invoice["file_name"] = files["invoice"][0]
+        except Exception as e:
+            extract_error = str(e)
+    return {"pdf": pdf_bytes, "invoice": invoice, "extract_error": extract_error, "params": params}
+
+
+def parse_multipart(content_type: str, body: bytes) -> Dict[str, Tuple[str, bytes]]:
+    """解析 multipart/form-data，返回 字段名 -> (文件名, 内容)"""
+    if not content_type.startswith("multipart/form-data"):
+        raise RequestError(415, "请求需为 multipart/form-data")
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    if not message.is_multipart():
+        raise RequestError(400, "无法解析 multipart 请求体")
+    fields: Dict[str, Tuple[str, bytes]] = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name:
+            fields[name] = (_decode_header_text(part.get_filename() or name), part.get_payload(decode=True) or b"")
+    return fields
+
+
+def _decode_header_text(text: str) -> str:
+    """浏览器直接以 UTF-8 发送中文文件名，email 解析器按 ASCII 读入（surrogateescape），这里还原"""
+    try:
+        return text.encode("utf-8", "surrogateescape").decode("utf-8")
+    except UnicodeError:
+        return text
+
+
+def encode_multipart(files: Dict[str, Tuple[str, bytes]]) -> Tuple[str, bytes]:
+    """把 字段名 -> (文件名, 内容) 编码为 multipart/form-data，返回 (Content-Type, 请求体)"""
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for name, (filename, content) in files.items():
+        chunks.append(
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; filename*=UTF-8''{quote(filename)}\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n".encode("utf-8"))
+        chunks.append(content)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode("ascii"))
+    return f"multipart/form-data; boundary={boundary}", b"".join(chunks)
+
+
+class MergeService:
+    """工作进程池、并发/排队限制与统计"""
+
+    def __init__(self, workers: int = 2, max_queue: int = DEFAULT_MAX_QUEUE,
+                 job_timeout: Optional[float] = DEFAULT_JOB_TIMEOUT, memory_limit: Optional[int] = None,
+                 max_upload: int = DEFAULT_MAX_UPLOAD):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.max_upload = max_upload
+        self.pool = SandboxPool(self.workers, timeout=job_timeout, memory_limit=memory_limit)
+        self._slots = threading.Semaphore(self.workers + self.max_queue)
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "merged": 0, "failed": 0, "rejected": 0, "timeouts": 0}
+        self.latency_sum = 0.0
+
+    def warm_up(self) -> None:
+        """启动全部工作进程并完成导入，首个请求无需等待"""
+        futures = [self.pool.submit(_warm_up) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def merge(self, files: Dict[str, Tuple[str, bytes]], max_bytes: Optional[int], resample: str) -> Dict[str, Any]:
+        """提交到工作进程并等待结果；排队已满时抛出 RequestError(503)"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["rejected"] += 1
+            raise RequestError(503, "服务繁忙，请稍后重试")
+        start = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            result = self.pool.submit(merge_uploaded, files, max_bytes, resample).result()
+            self._count("merged", start)
+            result["seconds"] = round(time.perf_counter() - start, 3)
+            return result
+        except JobTimeout as e:
+            self._count("timeouts", start)
+            raise RequestError(504, str(e))
+        except SandboxError as e:
+            self._count("failed", start)
+            raise RequestError(500, str(e))
+        except Exception as e:
+            self._count("failed", start)
+            raise RequestError(422, f"合并失败：{e}")
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def count_request(self) -> None:
+        with self._lock:
+            self.stats["requests"] += 1
+
+    def _count(self, name: str, start: float) -> None:
+        with self._lock:
+            self.stats[name] += 1
+            self.latency_sum += time.perf_counter() - start
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "status": "ok",
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "workers": self.workers,
+                "worker_pids": self.pool.worker_pids(),
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "workers_replaced": self.pool.replaced,
+                **self.stats,
+            }
+
+    def metrics(self) -> str:
+        health = self.health()
+        completed = health["merged"] + health["failed"] + health["timeouts"]
+        lines = [
+            "# TYPE invoice_merge_requests_total counter",
+            f"invoice_merge_requests_total {health['requests']}",
+            "# TYPE invoice_merge_results_total counter",
+        ]
+        for name in ("merged", "failed", "timeouts", "rejected"):
+            lines.append(f'invoice_merge_results_total{{result="{name}"}} {health[name]}')
+        lines += [
+            "# TYPE invoice_merge_in_flight gauge",
+            f"invoice_merge_in_flight {health['in_flight']}",
+            "# TYPE invoice_merge_queued gauge",
+            f"invoice_merge_queued {health['queued']}",
+            "# TYPE invoice_merge_workers gauge",
+            f"invoice_merge_workers {health['workers']}",
+            "# TYPE invoice_merge_workers_replaced_total counter",
+            f"invoice_merge_workers_replaced_total {health['workers_replaced']}",
+            "# TYPE invoice_merge_duration_seconds summary",
+            f"invoice_merge_duration_seconds_sum {self.latency_sum:.3f}",
+            f"invoice_merge_duration_seconds_count {completed}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class MergeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "InvoiceMerge/1.0"
+
+    @property
+    def service(self) -> MergeService:
+        return self.server.service  # type: ignore[attr-defined]
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if not getattr(self.server, "quiet", False):
+            super().log_message(format, *args)
+
+    def do_GET(self) -> None:
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self._send_json(200, self.service.health())
+        elif path == "/metrics":
+            self._send(200, self.service.metrics().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self._send_json(404, {"error": "未知路径"})
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        if url.path != "/merge":
+            try:
+                self._discard_body()
+            except RequestError as e:
+                self._send_json(e.status, {"error": str(e)})
+                return
+            self._send_json(404, {"error": "未知路径"})
+            return
+        self.service.count_request()
+        try:
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            fmt = query.get("format", "json")
+            resample = query.get("resample", DEFAULT_RESAMPLE)
+            if fmt not in ("json", "pdf") or resample not in RESAMPLE_STRATEGIES:
+                raise RequestError(400, "format 或 resample 参数无效")
+            try:
+                max_bytes = parse_byte_size(query["max_bytes"]) if "max_bytes" in query else None
+            except argparse.ArgumentTypeError as e:
+                raise RequestError(400, str(e))
+
+            files = parse_multipart(self.headers.get("Content-Type", ""), self._read_body())
+            missing = [name for name in UPLOAD_FIELDS if name not in files]
+            if missing:
+                raise RequestError(400, f"缺少上传字段: {', '.join(missing)}")
+
+            result = self.service.merge({name: files[name] for name in UPLOAD_FIELDS}, max_bytes, resample)
+        except RequestError as e:
+            self._send_json(e.status, {"error": str(e)},
+                            {"Retry-After": "1"} if e.status == 503 else None)
+            return
+
+        filename = self._output_name(files["invoice"][0], result["invoice"])
+        info = {
+            "filename": filename,
+            "invoice": result["invoice"],
+            "extract_error": result["extract_error"],
+            "params": result["params"],
+            "size": len(result["pdf"]),
+            "seconds": result["seconds"],
+        }
+        if fmt == "pdf":
+            headers = {
+                "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+                "X-Invoice-Data": json.dumps(info, ensure_ascii=True),
+            }
+            self._send(200, result["pdf"], "application/pdf", headers)
+        else:
+            info["pdf"] = base64.b64encode(result["pdf"]).decode("ascii")
+            self._send_json(200, info)
+
+    @staticmethod
+    def _output_name(original: str, invoice: Optional[Dict[str, Any]]) -> str:
+        from invoice_extract import SmartFileNamer
+
+        if invoice:
+            return SmartFileNamer.generate_smart_filename(invoice, original)
+        return os.path.splitext(original)[0] + "_已合并.pdf"
+
+    def _content_length(self) -> Optional[int]:
+        """请求头中的 Content-Length；格式错误或为负数时返回 400（请求体无法跳过，响应后关闭连接）"""
+        value = self.headers.get("Content-Length")
+        if value is None:
+            return None
+        try:
+            length = int(value)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            raise RequestError(400, f"Content-Length 无效: {value}")
+        return length
+
+    def _read_body(self) -> bytes:
+        length = self._content_length()
+        if length is None:
+            raise RequestError(411, "缺少 Content-Length")
+        if length > self.service.max_upload:
+            self.close_connection = True
+            raise RequestError(413, f"上传内容超过 {self.service.max_upload} 字节")
+        return self.rfile.read(length)
+
+    def _discard_body(self) -> None:
+        """分块读取并丢弃请求体；超过上传上限时不读取，响应后关闭连接"""
+        length = self._content_length() or 0
+        if length > self.service.max_upload:
+            self.close_connection = True
+            return
+        while length > 0:
+            chunk = self.rfile.read(min(length, DISCARD_CHUNK_SIZE))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def _send_json(self, status: int, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self._send(status, body, "application/json; charset=utf-8", headers)
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(service: MergeService, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+                quiet: bool = False) -> ThreadingHTTPServer:
+    """创建 HTTP 服务器（port=0 时由系统分配端口，见 server.server_address）"""
+    server = ThreadingHTTPServer((host, port), MergeRequestHandler)
+    server.daemon_threads = True
+    server.service = service  # type: ignore[attr-defined]
+    server.quiet = quiet  # type: ignore[attr-defined]
+    return server
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="发票合并 HTTP 服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认仅本机）")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"监听端口（默认 {DEFAULT_PORT}）")
+    parser.add_argument("--workers", type=int, default=2, help="常驻工作进程数（默认 2）")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help=f"工作进程全忙时最多排队的请求数，超出返回 503（默认 {DEFAULT_MAX_QUEUE}）")
+    parser.add_argument("--job-timeout", type=float, default=DEFAULT_JOB_TIMEOUT,
+                        help=f"单个请求的处理超时（秒，默认 {DEFAULT_JOB_TIMEOUT:g}）")
+    parser.add_argument("--job-memory-limit", type=parse_byte_size, default=None,
+                        help="每个工作进程的内存上限，如 1536M（仅 Unix 有效）")
+    parser.add_argument("--max-upload", type=parse_byte_size, default=DEFAULT_MAX_UPLOAD,
+                        help="单个请求的上传大小上限（默认 50M）")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+    service = MergeService(args.workers, args.max_queue, args.job_timeout, args.job_memory_limit, args.max_upload)
+    print(f"正在启动 {service.workers} 个工作进程...")
+    service.warm_up()
+    server = make_server(service, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"发票合并服务已启动: http://{host}:{port}/merge  （健康检查 /health，统计 /metrics）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止服务...")
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main(sys.argv[1:]))
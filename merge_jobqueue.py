@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+批量合并任务表 - 基于 SQLite 的断点续跑
+
+几千套文件的批量合并中途断电，或者某个异常 PDF 让 pdfium 崩溃后，
+仅靠"输出文件已存在"无法区分写了一半的文件和完整的文件。
+本模块用一张 SQLite 任务表记录每套文件的状态：
+
+    pending  等待处理
+    running  已开始处理（若进程中途退出，下次启动时恢复为 pending）
+    done     已生成输出
+    failed   处理失败，记录失败次数与错误信息
+
+重新运行时从中断处继续；失败的任务可以单独重试（--retry-failed）。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, RUNNING, DONE, FAILED)
+
+DEFAULT_DB_NAME = "合并任务.sqlite"
+PARTIAL_SUFFIX = ".part"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    job TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state);
+"""
+
+# 写入任务表的字段（只保留可序列化、可重放的部分）
+_JOB_FIELDS = ("key", "base", "pdf", "buy", "pay", "out_path", "max_bytes", "resample")
+
+
+class JobQueue:
+    """SQLite 任务表，每套文件一行，key 为相对根目录的 "目录/base_key"。
+
+    每次状态变化都在独立事务中提交，进程随时中断都不会丢失已完成的记录。
+    可在多个线程中使用（如 --pipeline 的读取线程调用 mark_running），所有操作由一把锁串行执行。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # WAL 模式下写入中断不会损坏已提交的数据，读写互不阻塞
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self.conn.commit()
+
+    def __enter__(self) -> "JobQueue":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    def recover(self) -> List[str]:
+        """把上次运行中断时仍为 running 的任务恢复为 pending，并删除其残留的临时输出"""
+        with self._lock:
+            rows = self.conn.execute("SELECT key, job FROM jobs WHERE state = ?", (RUNNING,)).fetchall()
+            for row in rows:
+                remove_partial_output(json.loads(row["job"])["out_path"])
+            with self.conn:
+                self.conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?",
+                                  (PENDING, time.time(), RUNNING))
+        return [row["key"] for row in rows]
+
+    def sync(self, jobs: Iterable[Dict[str, Any]]) -> Dict[str, str]:
+        """登记扫描到的待合并任务，返回各任务当前状态。
+
+        新任务登记为 pending；已记录为 done 但输出已被删除的任务重新置为 pending；
+        已有记录的任务更新其参数（如本次指定了不同的 --max-bytes）。
+        """
+        now = time.time()
+        states: Dict[str, str] = {}
+        with self._lock, self.conn:
+            for job in jobs:
+                payload = json.dumps({k: job.get(k) for k in _JOB_FIELDS}, ensure_ascii=False)
+                row = self.conn.execute("SELECT state FROM jobs WHERE key = ?", (job["key"],)).fetchone()
+                if row is None:
+                    self.conn.execute(
+                        "INSERT INTO jobs (key, job, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                        (job["key"], payload, PENDING, now, now))
+                    states[job["key"]] = PENDING
+                    continue
+                state = row["state"]
+                if state == DONE and not os.path.exists(job["out_path"]):
+                    state = PENDING
+                self.conn.execute("UPDATE jobs SET job = ?, state = ?, updated_at = ? WHERE key = ?",
+                                  (payload, state, now, job["key"]))
+                states[job["key"]] = state
+        return states
+
+    def mark_running(self, key: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE key = ?",
+                              (RUNNING, time.time(), key))
+
+    def mark_pending(self, key: str) -> None:
+        """已开始但因取消而未处理的任务恢复为 pending，下次运行继续"""
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE key = ?",
+                              (PENDING, time.time(), key))
+
+    def mark_done(self, key: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE jobs SET state = ?, error = NULL, updated_at = ? WHERE key = ?",
+                              (DONE, time.time(), key))
+
+    def mark_failed(self, key: str, error: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE key = ?",
+                              (FAILED, error, time.time(), key))
+
+    def jobs(self, state: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按 key 顺序列出任务；每项为登记时的任务参数加上 state/attempts/error"""
+        with self._lock:
+            if state:
+                rows = self.conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY key", (state,)).fetchall()
+            else:
+                rows = self.conn.execute("SELECT * FROM jobs ORDER BY key").fetchall()
+        result = []
+        for row in rows:
+            job = json.loads(row["job"])
+            job.update(state=row["state"], attempts=row["attempts"], error=row["error"])
+            result.append(job)
+        return result
+
+    def counts(self) -> Dict[str, int]:
+        counts = {state: 0 for state in STATES}
+        with self._lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        for row in rows:
+            counts[row["state"]] = row["n"]
+        return counts
+
+
+def partial_output_path(out_path: str) -> str:
+    """输出先写到同目录的临时文件，完成后原子替换为正式文件名"""
+    return out_path + PARTIAL_SUFFIX
+
+
+def remove_partial_output(out_path: str) -> None:
+    try:
+        os.remove(partial_output_path(out_path))
+    except OSError:
+        pass
+
+
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(), "已合并", DEFAULT_DB_NAME)
+    if not os.path.exists(path):
+        print(f"任务表不存在: {path}")
+        sys.exit(1)
+    with JobQueue(path) as queue:
+        print(f"任务表: {path}")
+        print("  ".join(f"{state}: {n}" for state, n in queue.counts().items()))
+        for job in queue.jobs(FAILED):
+            print(f"失败 {job['key']}（{job['attempts']} 次）：{job['error']}")
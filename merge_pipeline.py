@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+流水线批量合并 - 让磁盘读取、渲染解码、合成与编码写出互相重叠
+
+逐个处理时每套文件都按 读取 → 渲染 → 解码 → 布局/缩放/粘贴 → 编码 → 写出 严格串行，
+CPU 计算时磁盘空闲，读文件时 CPU 在等待。这里把处理拆成四个阶段，阶段之间用有界队列连接：
+
+    读取（1 个预读线程） → 渲染/解码（线程池） → 合成（1 个线程） → 编码/写出（1 个线程）
+
+- Pillow 的解码、缩放与 JPEG 编码会释放 GIL，可与其他阶段并行；
+  pypdfium2 不是线程安全的，渲染时持有全局锁
+- 队列深度限制在途的文件组数量，从而限制内存占用
+- 运行结束后统计各阶段的忙碌时间与等待时间，利用率最高的阶段即瓶颈
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from merge_engine import DEFAULT_RESAMPLE, ENGINE, PDFIUM_LOCK, open_image
+from merge_invoices import summarize_layout, write_output
+from merge_progress import CancelToken, JobCancelled
+
+DEFAULT_QUEUE_DEPTH = 2
+DEFAULT_RENDER_THREADS = 2
+STAGE_NAMES = ("read", "render", "compose", "encode")
+STAGE_LABELS = {"read": "读取", "render": "渲染/解码", "compose": "合成", "encode": "编码/写出"}
+
+_STOP = object()
+
+
+class _Failure:
+    """读取线程或阶段线程本身出错（任务迭代器、on_start、on_stage 抛出异常）时经结果队列转交给 run() 的调用方"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StageStats:
+    """一个阶段的统计：处理数量、忙碌时间、等待上游与等待下游的时间"""
+
+    def __init__(self, name: str, threads: int):
+        self.name = name
+        self.threads = threads
+        self.items = 0
+        self.busy = 0.0
+        self.wait_input = 0.0
+        self.wait_output = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy: float = 0.0, wait_input: float = 0.0, wait_output: float = 0.0, items: int = 0) -> None:
+        with self._lock:
+            self.busy += busy
+            self.wait_input += wait_input
+            self.wait_output += wait_output
+            self.items += items
+
+    def as_dict(self, elapsed: float) -> Dict[str, Any]:
+        capacity = max(elapsed * self.threads, 1e-9)
+        return {
+            "stage": self.name,
+            "threads": self.threads,
+            "items": self.items,
+            "busy_seconds": round(self.busy, 3),
+            "utilization": round(self.busy / capacity, 3),
+            "wait_input_seconds": round(self.wait_input, 3),
+            "wait_output_seconds": round(self.wait_output, 3),
+        }
+
+
+def parse_queue_depths(text: str) -> Tuple[int, int, int]:
+    """解析队列深度：单个数字用于全部三个队列，或用逗号分隔分别指定 读取后,渲染后,合成后"""
+    import argparse
+
+    try:
+        values = [int(part) for part in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"队列深度应为正整数，如 2 或 4,2,1: {text}")
+    if len(values) == 1:
+        values *= 3
+    if len(values) != 3 or min(values) < 1:
+        raise argparse.ArgumentTypeError(f"队列深度应为 1 个或 3 个正整数: {text}")
+    return values[0], values[1], values[2]
+
+
+def _read_bytes(path: str) -> bytes:
+    # 一次顺序读完整个文件，之后的渲染和解码都在内存中进行
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class MergePipeline:
+    """四阶段流水线。run() 按完成顺序产出 (job, 结果, 异常)，结果与 merge_invoices.run_job_with_layout 相同：
+    (压缩参数, 选用的布局与旋转)。
+    同一个对象可多次调用 run()（如 --stream 逐目录处理），各阶段统计累加。
+    单个文件组的处理失败只体现在它的结果中；任务迭代器、on_start 或 on_stage 抛出的异常
+    在已进入流水线的文件组产出后由 run() 重新抛出。
+    cancel 取消后，各阶段不再处理队列中的文件组，它们以 JobCancelled 异常产出（未写出任何文件）；
+    正在某个阶段中处理的文件组会完成该阶段，随后同样被放弃。
+    """
+
+    def __init__(self, queue_depths: Sequence[int] = (DEFAULT_QUEUE_DEPTH,) * 3,
+                 render_threads: int = DEFAULT_RENDER_THREADS,
+                 on_start: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 reader: Callable[[str], Any] = _read_bytes,
+                 on_stage: Optional[Callable[[Dict[str, Any], str], None]] = None,
+                 cancel: Optional[CancelToken] = None):
+        self.queue_depths = tuple(queue_depths)
+        self.cancel = cancel
+        self.render_threads = max(1, render_threads)
+        self.on_start = on_start
+        self.reader = reader
+        self.on_stage = on_stage
+        self.stats = {
+            "read": StageStats("read", 1),
+            "render": StageStats("render", self.render_threads),
+            "compose": StageStats("compose", 1),
+            "encode": StageStats("encode", 1),
+        }
+        self.elapsed = 0.0
+        self._cancel = threading.Event()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        return [self.stats[name].as_dict(self.elapsed) for name in STAGE_NAMES]
+
+    def _get(self, q: "queue.Queue", stats: StageStats) -> Any:
+        start = time.perf_counter()
+        item = q.get()
+        stats.add(wait_input=time.perf_counter() - start)
+        return item
+
+    def _put(self, q: "queue.Queue", item: Any, stats: StageStats) -> bool:
+        """放入下游队列；调用方已停止迭代时返回 False"""
+        start = time.perf_counter()
+        try:
+            while not self._cancel.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            stats.add(wait_output=time.perf_counter() - start)
+
+    def _stage(self, name: str, inbox: "queue.Queue", outbox: "queue.Queue",
+               work: Callable[[Dict[str, Any], Any], Any], fail: Callable[[BaseException], None],
+               upstream: int = 1) -> Callable[[], None]:
+        """生成一个阶段线程的主循环：收到全部上游的结束标记后向下游转发一次。
+        线程本身出错时交给 fail，并照常向下游转发结束标记，run() 不会一直等待
+        """
+        stats = self.stats[name]
+
+        def loop() -> None:
+            stops = 0
+            try:
+                while True:
+                    item = self._get(inbox, stats)
+                    if item is _STOP:
+                        stops += 1
+                        if stops == upstream:
+                            self._put(outbox, _STOP, stats)
+                            return
+                        continue
+                    job, payload, error = item
+                    if error is None and self.cancel is not None and self.cancel.cancelled:
+                        payload, error = None, JobCancelled("已取消，未处理")
+                    if error is None:
+                        start = time.perf_counter()
+                        try:
+                            payload = work(job, payload)
+                        except Exception as e:
+                            payload, error = None, e
+                        stats.add(busy=time.perf_counter() - start, items=1)
+                        if error is None and self.on_stage:
+                            self.on_stage(job, name)
+                    if not self._put(outbox, (job, payload, error), stats):
+                        return
+            except BaseException as e:
+                fail(e)
+                self._put(outbox, _STOP, stats)
+
+        return loop
+
+    def _read(self, job: Dict[str, Any], _: Any) -> Dict[str, Any]:
+        # 已由 merge_prefetch 预读的数据直接使用
+        return {kind: job[kind] if isinstance(job[kind], (bytes, bytearray, memoryview)) else self.reader(job[kind])
+                for kind in ("pdf", "buy", "pay")}
+
+    @staticmethod
+    def _render(job: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+        # 所有 PDF 渲染串行执行（自定义渲染器同样持有全局锁）
+        with PDFIUM_LOCK:
+            invoice = ENGINE.render(data["pdf"])
+        # convert 会触发实际解码，解码在此线程池中完成而不是在合成阶段
+        return {"invoice": invoice,
+                "buy": open_image(data["buy"]).convert("RGB"),
+                "pay": open_image(data["pay"]).convert("RGB")}
+
+    @staticmethod
+    def _compose(job: Dict[str, Any], images: Dict[str, Any]) -> Tuple[Any, Dict[str, Any]]:
+        chosen: List[Dict[str, Any]] = []
+        canvas = ENGINE.compose(images["invoice"], images["buy"], images["pay"],
+                                resample=job.get("resample", DEFAULT_RESAMPLE), on_layout=chosen.append)
+        return canvas, summarize_layout(chosen[0])
+
+    @staticmethod
+    def _encode(job: Dict[str, Any], composed: Tuple[Any, Dict[str, Any]]
+                ) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        canvas, plan = composed
+        data, params = ENGINE.encode(canvas, job.get("max_bytes"))
+        write_output(job["out_path"], data)
+        return params, plan
+
+    def run(self, jobs: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], Any, Optional[BaseException]]]:
+        read_q: "queue.Queue" = queue.Queue(self.queue_depths[0])
+        render_q: "queue.Queue" = queue.Queue(self.queue_depths[1])
+        compose_q: "queue.Queue" = queue.Queue(self.queue_depths[2])
+        done_q: "queue.Queue" = queue.Queue()
+        read_stats = self.stats["read"]
+
+        def fail(error: BaseException) -> None:
+            done_q.put(_Failure(error))
+
+        def reader() -> None:
+            try:
+                for job in jobs:
+                    if self._cancel.is_set():
+                        return
+                    if self.on_start:
+                        self.on_start(job)
+                    start = time.perf_counter()
+                    try:
+                        payload, error = self._read(job, None), None
+                    except Exception as e:
+                        payload, error = None, e
+                    read_stats.add(busy=time.perf_counter() - start, items=1)
+                    if error is None and self.on_stage:
+                        self.on_stage(job, "read")
+                    if not self._put(read_q, (job, payload, error), read_stats):
+                        return
+            except BaseException as e:
+                # 任务迭代器（扫描、预读）或 on_start 出错：已读入的文件组照常处理完
+                fail(e)
+            finally:
+                for _ in range(self.render_threads):
+                    self._put(read_q, _STOP, read_stats)
+
+        threads = [threading.Thread(target=reader, name="pipeline-read", daemon=True)]
+        for i in range(self.render_threads):
+            threads.append(threading.Thread(target=self._stage("render", read_q, render_q, self._render, fail),
+                                            name=f"pipeline-render-{i}", daemon=True))
+        threads.append(threading.Thread(
+            target=self._stage("compose", render_q, compose_q, self._compose, fail, upstream=self.render_threads),
+            name="pipeline-compose", daemon=True))
+        threads.append(threading.Thread(target=self._stage("encode", compose_q, done_q, self._encode, fail),
+                                        name="pipeline-encode", daemon=True))
+
+        self._cancel = threading.Event()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        failure: Optional[BaseException] = None
+        try:
+            while True:
+                item = done_q.get()
+                if item is _STOP:
+                    break
+                if isinstance(item, _Failure):
+                    failure = failure or item.error
+                    continue
+                yield item
+            if failure is not None:
+                raise failure
+        finally:
+            # 调用方提前停止时通知各阶段退出（正在处理的文件组会处理完）
+            self._cancel.set()
+            self.elapsed += time.perf_counter() - start
+
+
+def format_stage_summary(summary: List[Dict[str, Any]], elapsed: float) -> List[str]:
+    """把各阶段统计整理为表格行，标出利用率最高（瓶颈）的阶段"""
+    bottleneck = max(summary, key=lambda s: s["utilization"])["stage"] if summary else None
+    lines = [f"流水线总用时 {elapsed:.2f} 秒",
+             f"{'阶段':<10}{'线程':>4}{'数量':>6}{'忙碌(秒)':>10}{'利用率':>8}{'等上游(秒)':>12}{'等下游(秒)':>12}"]
+    for s in summary:
+        mark = "  ← 瓶颈" if s["stage"] == bottleneck else ""
+        lines.append(f"{STAGE_LABELS[s['stage']]:<8}{s['threads']:>4}{s['items']:>6}{s['busy_seconds']:>10.2f}"
+                     f"{s['utilization'] * 100:>7.0f}%{s['wait_input_seconds']:>12.2f}"
+                     f"{s['wait_output_seconds']:>12.2f}{mark}")
+    return lines
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+输入文件预读 - 适用于发票目录位于 SMB/NFS 等网络共享的情况
+
+pdfium 打开 PDF、Pillow 解码图片时会发出大量小块的随机读取，在网络共享上每次读取都要往返一次，
+耗时远超渲染本身。Prefetcher 在后台线程中用大块顺序读取把即将处理的文件组整个读入内存，
+渲染和解码直接从内存缓冲区打开（merge_invoices.open_pdf / open_image 均接受内存数据）。
+
+- 预读的文件组按原顺序交给调用方，读取失败的文件组保留原路径，由合并步骤报告错误
+- 已读入但尚未处理完的数据总量不超过 budget 字节（单个文件组超过预算时仍会读取，避免卡住）
+- 处理完成后调用 release(job) 归还预算，并把 job 中的数据换回原路径
+
+用法:
+    prefetcher = Prefetcher(budget=256 * 1024 * 1024)
+    for job in prefetcher.iter_jobs(jobs):
+        run_job(job)
+        prefetcher.release(job)
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterable, Iterator, Tuple
+
+DEFAULT_PREFETCH_BUDGET = 256 * 1024 * 1024
+DEFAULT_PREFETCH_THREADS = 4
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+SOURCE_KINDS = ("pdf", "buy", "pay")
+
+
+def read_file(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> bytearray:
+    """按文件大小一次分配缓冲区，再以 chunk_size 为单位顺序读满"""
+    with open(path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        buf = bytearray(size)
+        view = memoryview(buf)
+        pos = 0
+        while pos < size:
+            n = f.readinto(view[pos:pos + chunk_size])
+            if not n:
+                # 文件在读取过程中变短
+                del buf[pos:]
+                break
+            pos += n
+        view.release()
+    return buf
+
+
+class Prefetcher:
+    """在后台线程中预读文件组，见模块说明"""
+
+    def __init__(self, budget: int = DEFAULT_PREFETCH_BUDGET, threads: int = DEFAULT_PREFETCH_THREADS,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.budget = budget
+        self.threads = max(1, threads)
+        self.chunk_size = chunk_size
+        self.reserved = 0
+        self.peak_reserved = 0
+        self.files = 0
+        self.bytes_read = 0
+        self.read_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def _read(self, path: str) -> bytearray:
+        start = time.perf_counter()
+        data = read_file(path, self.chunk_size)
+        with self._lock:
+            self.files += 1
+            self.bytes_read += len(data)
+            self.read_seconds += time.perf_counter() - start
+        return data
+
+    def _reserve(self, size: int) -> None:
+        with self._lock:
+            self.reserved += size
+            self.peak_reserved = max(self.peak_reserved, self.reserved)
+
+    def iter_jobs(self, jobs: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """按原顺序产出 job 的副本，其中 pdf / buy / pay 已替换为内存数据"""
+        iterator = iter(jobs)
+        pending: Deque[Tuple[Dict[str, Any], int, Dict[str, Future]]] = deque()
+        executor = ThreadPoolExecutor(self.threads, thread_name_prefix="prefetch")
+        upcoming = None
+        try:
+            while True:
+                # 在预算内尽量多地提交读取；队列为空时至少提交一个文件组
+                while True:
+                    if upcoming is None:
+                        upcoming = next(iterator, None)
+                        if upcoming is None:
+                            break
+                    try:
+                        size = sum(os.path.getsize(upcoming[kind]) for kind in SOURCE_KINDS)
+                    except OSError:
+                        size = 0
+                    if pending and self.reserved + size > self.budget:
+                        break
+                    self._reserve(size)
+                    futures = {kind: executor.submit(self._read, upcoming[kind]) for kind in SOURCE_KINDS}
+                    pending.append((upcoming, size, futures))
+                    upcoming = None
+                if not pending:
+                    return
+
+                job, size, futures = pending.popleft()
+                start = time.perf_counter()
+                try:
+                    data = {kind: future.result() for kind, future in futures.items()}
+                except OSError:
+                    # 保留原路径，由合并步骤报告具体是哪个文件出错
+                    self.errors += 1
+                    self.release({"prefetch_size": size})
+                    yield job
+                    continue
+                finally:
+                    self.wait_seconds += time.perf_counter() - start
+                yield dict(job, **data, prefetched={kind: job[kind] for kind in SOURCE_KINDS}, prefetch_size=size)
+        finally:
+            for _, size, futures in pending:
+                for future in futures.values():
+                    future.cancel()
+                self.release({"prefetch_size": size})
+            executor.shutdown(wait=False)
+
+    def release(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """归还 job 占用的预读预算，并把内存数据换回原路径；对未预读的 job 无影响"""
+        size = job.pop("prefetch_size", 0)
+        if size:
+            with self._lock:
+                self.reserved -= size
+        job.update(job.pop("prefetched", {}))
+        return job
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "files": self.files,
+            "bytes_read": self.bytes_read,
+            "read_seconds": round(self.read_seconds, 3),
+            "wait_seconds": round(self.wait_seconds, 3),
+            "peak_buffered_bytes": self.peak_reserved,
+            "errors": self.errors,
+        }
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+合并布局预览 - 拖入文件后立即显示 get_optimal_layout 选出的布局与旋转
+
+全分辨率合并需要 300 DPI 渲染发票并解码整张截图，耗时数秒。布局只取决于三张图片的尺寸，
+因此预览时：
+- 发票按约 36 DPI 渲染，300 DPI 下的尺寸由页面大小换算，不必真正渲染
+- 图片尺寸取自文件头，像素用 JPEG draft 模式按 1/2、1/4、1/8 缩小解码
+- 缩略图按文件（路径、修改时间、大小）缓存，替换其中一个文件时另外两个无需重新解码
+- 用与合并相同的布局（merge_engine.ENGINE.layout）在 300 DPI 坐标中计算布局，再按比例缩小贴到预览画布
+
+PreviewWorker 在一个后台线程中生成预览，只处理最新的请求，界面线程不会被阻塞。
+全分辨率合并仍然只在用户确认（点击合并）后进行。
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from PIL import Image
+
+from merge_engine import ENGINE, PAGE_DPI, PDFIUM_LOCK, fit_into, open_pdf, page_geometry
+
+PREVIEW_DPI = 36
+PREVIEW_CACHE_SIZE = 64
+
+Thumbnail = Tuple[Image.Image, Tuple[int, int]]
+
+
+def load_invoice_thumbnail(pdf_path: str, dpi: int = PREVIEW_DPI) -> Thumbnail:
+    """按 dpi 渲染发票第一页，返回 (缩略图, 按 PAGE_DPI 渲染时的尺寸)。
+    预览线程与界面中的数据提取可能同时使用 pdfium，渲染时持有 PDFIUM_LOCK
+    """
+    with PDFIUM_LOCK:
+        pdf = open_pdf(pdf_path)
+        try:
+            if len(pdf) == 0:
+                raise ValueError(f"PDF文件无页面: {pdf_path}")
+            page = pdf[0]
+            try:
+                # 与 pypdfium2 渲染时的取整方式一致
+                full_scale = PAGE_DPI / 72.0
+                full_size = (math.ceil(page.get_width() * full_scale), math.ceil(page.get_height() * full_scale))
+                thumb = page.render(scale=dpi / 72.0).to_pil()
+            finally:
+                page.close()
+        finally:
+            pdf.close()
+    return thumb.convert("RGB"), full_size
+
+
+def load_image_thumbnail(path: str, dpi: int = PREVIEW_DPI) -> Thumbnail:
+    """以 draft 模式缩小解码图片，返回 (缩略图, 原始尺寸)"""
+    scale = dpi / PAGE_DPI
+    with Image.open(path) as img:
+        full_size = img.size
+        target = (max(1, int(full_size[0] * scale)), max(1, int(full_size[1] * scale)))
+        # JPEG 在解码时直接按 1/2、1/4、1/8 缩小；其他格式不支持时忽略
+        img.draft("RGB", target)
+        thumb = img.convert("RGB")
+    thumb.thumbnail(target, Image.BILINEAR)
+    return thumb, full_size
+
+
+class ThumbnailCache:
+    """按文件缓存缩略图（LRU）；文件被修改后自动失效"""
+
+    def __init__(self, max_items: int = PREVIEW_CACHE_SIZE):
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Tuple[Any, ...], Thumbnail]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, loader: Callable[[str, int], Thumbnail], dpi: int = PREVIEW_DPI) -> Thumbnail:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, dpi)
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+        value = loader(path, dpi)
+        with self._lock:
+            self.misses += 1
+            self._items[key] = value
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return value
+
+
+def render_preview(pdf_path: str, buy_path: str, pay_path: str, dpi: int = PREVIEW_DPI,
+                   cache: Optional[ThumbnailCache] = None) -> Tuple[Image.Image, Dict[str, Any]]:
+    """生成低分辨率的合并预览，返回 (预览图, 布局)。布局与全分辨率合并时完全相同"""
+    cache = cache or ThumbnailCache()
+    invoice, invoice_size = cache.get(pdf_path, load_invoice_thumbnail, dpi)
+    buy, buy_size = cache.get(buy_path, load_image_thumbnail, dpi)
+    pay, pay_size = cache.get(pay_path, load_image_thumbnail, dpi)
+
+    layout = ENGINE.layout(invoice_size, buy_size, pay_size, PAGE_DPI)
+    orientations = layout['orientations']
+
+    scale = dpi / PAGE_DPI
+    page_w, page_h, margin, _, _ = page_geometry()
+    canvas = Image.new("RGB", (int(page_w * scale), int(page_h * scale)), (255, 255, 255))
+    for img, area, rotate in ((invoice, layout['invoice_area'], orientations['invoice_rotate']),
+                              (buy, layout['buy_area'], orientations['buy_rotate']),
+                              (pay, layout['pay_area'], orientations['pay_rotate'])):
+        x, y, w, h = (int(v * scale) for v in area)
+        fitted = fit_into(img, max(1, w), max(1, h), "fast", rotate=rotate)
+        canvas.paste(fitted, (int(margin * scale) + x + (w - fitted.width) // 2,
+                              int(margin * scale) + y + (h - fitted.height) // 2))
+    return canvas, layout
+
+
+def describe_layout(layout: Dict[str, Any]) -> str:
+    """布局的文字说明，如"水平布局：发票在上，两张记录图并排在下；旋转：购买记录" """
+    if layout['type'] == 'horizontal':
+        text = "水平布局：发票在上，两张记录图并排在下"
+    else:
+        text = "垂直布局：发票在左，两张记录图纵向排列在右"
+    names = {'invoice_rotate': "发票", 'buy_rotate': "购买记录", 'pay_rotate': "支付记录"}
+    rotated = [name for key, name in names.items() if layout['orientations'].get(key)]
+    return text + (f"；旋转90度：{'、'.join(rotated)}" if rotated else "；无旋转")
+
+
+class PreviewWorker:
+    """在后台线程中生成预览。新请求会取代尚未开始的旧请求，回调只收到最新一次的结果。
+
+    callback(预览图, 布局, 异常, 耗时秒) 在后台线程中调用，界面程序需用 root.after 转回界面线程。
+    """
+
+    def __init__(self, dpi: int = PREVIEW_DPI, cache: Optional[ThumbnailCache] = None):
+        self.dpi = dpi
+        self.cache = cache or ThumbnailCache()
+        self._request: Optional[Tuple[Tuple[str, str, str], Callable[..., None]]] = None
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def request(self, pdf_path: str, buy_path: str, pay_path: str, callback: Callable[..., None]) -> None:
+        with self._condition:
+            self._request = ((pdf_path, buy_path, pay_path), callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="preview", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _loop(self) -> None:
+        while True:
+            with self._condition:
+                while self._request is None:
+                    self._condition.wait()
+                (paths, callback), self._request = self._request, None
+            start = time.perf_counter()
+            try:
+                image, layout = render_preview(*paths, dpi=self.dpi, cache=self.cache)
+                error = None
+            except Exception as e:
+                image, layout, error = None, None, e
+            with self._condition:
+                superseded = self._request is not None
+            if not superseded:
+                callback(image, layout, error, time.perf_counter() - start)
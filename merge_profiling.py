@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+按文件组开启的性能诊断 - 只对指定（或抽样的）文件组运行 cProfile 与 tracemalloc
+
+某个供应商的发票特别慢或特别占内存时，用真实数据找出热点（fit_into、渲染等）：
+
+    python merge_invoices.py D:\\报销 --include "*某供应商*" --profile --trace-memory
+    python merge_invoices.py D:\\报销 --profile --profile-every 20       # 每 20 套抽 1 套
+
+DiagnosticsSampler 在主进程中按处理顺序每 every 套标记一套（job["diagnostics"]），
+profile_job 在实际执行合并的地方（隔离的工作进程或当前进程）包住这一套的处理，结果写入诊断目录：
+
+    <文件组>.prof          cProfile 原始数据，可用 python -m pstats 或 snakeviz 查看
+    <文件组>.profile.txt   按累计耗时排序的前 PROFILE_TOP_N 个函数
+    <文件组>.memory.txt    tracemalloc 统计的峰值，以及各阶段（渲染 / 合成 / 编码）结束时占用最多的一次快照中
+                           分配最多的前 MEMORY_TOP_N 行代码
+
+tracemalloc 只统计经 Python 分配的内存（读入的文件、编码后的 PDF 等），Pillow 与 pdfium 的像素缓冲区
+由 C 代码直接分配，不在其中；各阶段的像素内存见 merge_scheduler 的估算。
+处理超时被终止的文件组不会留下诊断文件。
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import merge_engine
+
+DIAGNOSTICS_DIR_NAME = "诊断"
+PROFILE_TOP_N = 40
+MEMORY_TOP_N = 25
+TRACE_FRAMES = 1
+
+_UNSAFE_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+def diagnostics_name(key: str) -> str:
+    """文件组 key（可能含子目录）转为诊断文件名前缀"""
+    return _UNSAFE_CHARS.sub("_", key.replace("/", "__")) or "_"
+
+
+class DiagnosticsSampler:
+    """在主进程中决定哪些文件组需要诊断：按处理顺序每 every 套标记一套（第 1 套总会被标记）"""
+
+    def __init__(self, out_dir: str, profile: bool = False, trace_memory: bool = False, every: int = 1):
+        if every < 1:
+            raise ValueError("抽样间隔必须大于等于 1")
+        self.out_dir = out_dir
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.every = every
+        self.seen = 0
+        self.sampled = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.profile or self.trace_memory
+
+    def options(self) -> Dict[str, Any]:
+        return {"dir": self.out_dir, "profile": self.profile, "trace_memory": self.trace_memory}
+
+    def tag(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """被抽中的 job 加上 diagnostics 选项（随 job 传给工作进程），返回 job 本身"""
+        if not self.enabled:
+            return job
+        with self._lock:
+            chosen = self.seen % self.every == 0
+            self.seen += 1
+            if chosen:
+                self.sampled += 1
+        if chosen:
+            job["diagnostics"] = self.options()
+        return job
+
+
+def _write_text(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _profile_summary(profiler: cProfile.Profile, key: str) -> str:
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_N)
+    return f"文件组: {key}\n按累计耗时排序（前 {PROFILE_TOP_N} 个函数）\n{stream.getvalue()}"
+
+
+def _memory_summary(snapshot: tracemalloc.Snapshot, stage: str, peak: int, key: str) -> str:
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    lines = [f"文件组: {key}",
+             f"Python 分配峰值: {peak / 1024 / 1024:.1f} MB（不含 Pillow / pdfium 的像素缓冲区）",
+             f"{stage}时占用最多的前 {MEMORY_TOP_N} 行代码："]
+    for stat in snapshot.statistics("lineno")[:MEMORY_TOP_N]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:>10.1f} KB  {stat.count:>7} 块  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profile_job(key: str, options: Optional[Dict[str, Any]]) -> Iterator[None]:
+    """按 options（DiagnosticsSampler.options()）对一套文件的处理做 cProfile / tracemalloc；
+    options 为空时什么都不做。处理失败时同样写出诊断文件，异常照常抛出。
+
+    cProfile 只记录调用本函数的线程；tracemalloc 统计整个进程，同一进程中同时处理多套文件时结果会混在一起。
+    """
+    if not options or not (options.get("profile") or options.get("trace_memory")):
+        yield
+        return
+
+    out_dir = options["dir"]
+    os.makedirs(out_dir, exist_ok=True)
+    prefix = os.path.join(out_dir, diagnostics_name(key))
+    profiler = cProfile.Profile() if options.get("profile") else None
+    # 已由其他代码开启的 tracemalloc 不在这里停止
+    trace = options.get("trace_memory") and not tracemalloc.is_tracing()
+    # 中间数据在处理结束时已释放，因此在合并引擎每个阶段结束时取快照，保留占用最多的一次
+    largest: List[Any] = [-1, None, "处理结束"]
+
+    def on_stage(stage: str, seconds: float) -> None:
+        current, _ = tracemalloc.get_traced_memory()
+        if current > largest[0]:
+            largest[:] = [current, tracemalloc.take_snapshot(), f"{stage} 阶段结束"]
+
+    if trace:
+        tracemalloc.start(TRACE_FRAMES)
+        merge_engine.add_stage_hook(on_stage)
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(prefix + ".prof")
+            _write_text(prefix + ".profile.txt", _profile_summary(profiler, key))
+        if trace:
+            merge_engine.remove_stage_hook(on_stage)
+            snapshot = largest[1] or tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _write_text(prefix + ".memory.txt", _memory_summary(snapshot, largest[2], peak, key))
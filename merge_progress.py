@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+合并进度事件与协作式取消
+
+merge_invoices.main(argv, progress=..., cancel=...) 在处理过程中发出结构化的进度事件（dict）：
+
+    batch_started      开始处理（total 为已知的文件组数量，--stream 时随目录扫描增加）
+    triplet_started    一套文件开始处理
+    stage_done         一套文件完成了一个阶段（render / compose / encode / write；
+                       仅在当前进程中处理时发出，隔离的工作进程中只有开始与结束事件）
+    triplet_finished   一套文件生成完成
+    triplet_failed     一套文件失败（error 为错误说明）
+    batch_finished     全部结束或已取消（cancelled）
+
+每个事件都带有 key、done、failed、total、elapsed（秒）与 eta（预计剩余秒数，尚无完成时为 None）。
+progress 可以是回调函数，也可以是带 put() 的队列（如 queue.Queue），事件在处理线程中发出，
+界面程序需转回界面线程再更新控件。
+
+CancelToken 是协作式取消：cancel() 后不再开始新的文件组，正在处理的文件组会处理完，
+因此最多等待一套文件的处理时间；未开始的任务在任务表中仍为 pending，下次运行继续。
+流水线模式下已进入阶段队列、尚未处理的文件组以 JobCancelled 结束，不再渲染和写出。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+BATCH_STARTED = "batch_started"
+TRIPLET_STARTED = "triplet_started"
+STAGE_DONE = "stage_done"
+TRIPLET_FINISHED = "triplet_finished"
+TRIPLET_FAILED = "triplet_failed"
+BATCH_FINISHED = "batch_finished"
+
+STAGE_LABELS = {"read": "读取", "render": "渲染", "compose": "合成", "encode": "编码", "write": "写出"}
+
+
+class JobCancelled(Exception):
+    """文件组已开始（如已进入流水线队列）但因取消而未处理完，不算作失败"""
+
+
+class CancelToken:
+    """协作式取消标记，可在任意线程中调用 cancel()"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def guard(self, iterable: Iterable[Any]) -> Iterator[Any]:
+        """逐个产出任务，取消后停止；调度器按需取任务，因此取消后不会再提交新的任务"""
+        for item in iterable:
+            if self.cancelled:
+                return
+            yield item
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """把秒数格式化为 "1小时2分" / "3分05秒" / "12秒" """
+    if seconds is None:
+        return "估算中"
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}小时{seconds % 3600 // 60}分"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60:02d}秒"
+    return f"{seconds}秒"
+
+
+class ProgressReporter:
+    """统计完成数量与用时，估算剩余时间，并把事件发给 sink（回调函数或带 put() 的队列）"""
+
+    def __init__(self, sink: Any = None, clock: Callable[[], float] = time.monotonic):
+        if sink is None or callable(sink):
+            self._send = sink
+        else:
+            self._send = sink.put
+        self.clock = clock
+        self.started_at = clock()
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def add_total(self, count: int) -> None:
+        with self._lock:
+            self.total += count
+
+    def eta(self) -> Optional[float]:
+        """按已完成文件组的平均用时估算剩余时间（并发处理时平均用时已反映并发效果）"""
+        processed = self.done + self.failed
+        if not processed:
+            return None
+        return (self.clock() - self.started_at) / processed * max(0, self.total - processed)
+
+    def emit(self, event: str, job: Optional[Dict[str, Any]] = None, **fields: Any) -> Dict[str, Any]:
+        with self._lock:
+            payload = {
+                "event": event,
+                "key": job["key"] if job else None,
+                "done": self.done,
+                "failed": self.failed,
+                "total": self.total,
+                "elapsed": round(self.clock() - self.started_at, 3),
+                "eta": self.eta(),
+                **fields,
+            }
+        if self._send:
+            self._send(payload)
+        return payload
+
+    def batch_started(self) -> None:
+        self.emit(BATCH_STARTED)
+
+    def job_started(self, job: Dict[str, Any]) -> None:
+        self.emit(TRIPLET_STARTED, job)
+
+    def job_stage(self, job: Dict[str, Any], stage: str) -> None:
+        self.emit(STAGE_DONE, job, stage=stage)
+
+    def job_finished(self, job: Dict[str, Any], output: Optional[str] = None) -> None:
+        with self._lock:
+            self.done += 1
+        self.emit(TRIPLET_FINISHED, job, output=output)
+
+    def job_failed(self, job: Dict[str, Any], error: BaseException) -> None:
+        with self._lock:
+            self.failed += 1
+        self.emit(TRIPLET_FAILED, job, error=f"{type(error).__name__}: {error}")
+
+    def batch_finished(self, cancelled: bool = False) -> None:
+        self.emit(BATCH_FINISHED, cancelled=cancelled)
+
+
+def format_event(event: Dict[str, Any]) -> str:
+    """事件的一行中文说明，供界面日志与命令行显示"""
+    count = f"[{event['done'] + event['failed']}/{event['total']}]"
+    kind = event["event"]
+    if kind == BATCH_STARTED:
+        return f"开始处理，共 {event['total']} 组"
+    if kind == TRIPLET_STARTED:
+        return f"{count} 开始：{event['key']}"
+    if kind == STAGE_DONE:
+        return f"{count} {event['key']}：{STAGE_LABELS.get(event['stage'], event['stage'])}完成"
+    if kind == TRIPLET_FINISHED:
+        return f"{count} 完成：{event['key']}（预计剩余 {format_duration(event['eta'])}）"
+    if kind == TRIPLET_FAILED:
+        return f"{count} 失败：{event['key']} -> {event['error']}"
+    if kind == BATCH_FINISHED:
+        state = "已取消" if event.get("cancelled") else "全部结束"
+        return f"{state}：完成 {event['done']} 组，失败 {event['failed']} 组，用时 {format_duration(event['elapsed'])}"
+    return f"{count} {kind}"
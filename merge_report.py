@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+批量运行报告 - merge_invoices.main 的机器可读结果，供调度系统与监控使用
+
+    --report 报告.json    运行结束时写出 JSON 报告：每套文件一条记录与汇总
+    --metrics 文件.prom   Prometheus 文本格式的指标，供 node_exporter 的 textfile collector 采集
+
+每条记录：
+    key       文件组（相对根目录的 "目录/base_key"）
+    status    done / failed / existing（输出已存在）/ incomplete（文件不齐全）/
+              skipped（任务表中上次失败，未重试）/ cancelled（取消时尚未处理）
+    output、size            输出文件（相对根目录）与大小（字节）
+    seconds                 开始处理到完成的用时；stages 为各阶段完成时距开始的秒数（仅在当前进程中处理时有）
+    layout、rotate          合并时选用的布局与旋转（由处理该文件组的工作进程随结果返回）
+    params、error、missing  压缩参数（--max-bytes）、错误说明、不齐全时缺少的文件
+
+汇总包括各状态数量、总用时、吞吐（套/秒、字节/秒）、单套用时的中位数 / p95 / 最大值与返回码。
+两个文件都先写临时文件再替换，采集方不会读到写了一半的内容。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+STATUSES = ("done", "failed", "existing", "incomplete", "skipped", "cancelled")
+METRIC_PREFIX = "invoice_merge_run"
+
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class RunReport:
+    """收集一次批量运行中每套文件的结果。job_started / job_stage / job_completed 可在任意线程中调用"""
+
+    def __init__(self, root: str, argv: Optional[List[str]] = None, shard: Optional[Tuple[int, int]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.root = root
+        self.argv = list(argv or [])
+        self.shard = shard
+        self.clock = clock
+        self.started = time.time()
+        self._started_at = clock()
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[str, None] = {}
+        self._times: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add_jobs(self, jobs: Iterable[Dict[str, Any]]) -> None:
+        """登记将要处理的任务；结束时仍未记录结果的视为取消"""
+        with self._lock:
+            for job in jobs:
+                self._pending[job["key"]] = None
+
+    def job_started(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            self._times[job["key"]] = {"start": self.clock()}
+
+    def job_stage(self, job: Dict[str, Any], stage: str) -> None:
+        with self._lock:
+            times = self._times.setdefault(job["key"], {"start": self.clock()})
+            times[stage] = self.clock()
+
+    def job_completed(self, job: Dict[str, Any]) -> None:
+        """任务实际完成的时刻（并发处理时结果按文件组顺序产出，记录可能晚于完成）"""
+        with self._lock:
+            self._times.setdefault(job["key"], {"start": self.clock()}).setdefault("end", self.clock())
+
+    def record(self, key: str, status: str, output: Optional[str] = None, params: Optional[Dict[str, Any]] = None,
+               error: Optional[BaseException] = None, plan: Optional[Dict[str, Any]] = None,
+               **fields: Any) -> Dict[str, Any]:
+        if status not in STATUSES:
+            raise ValueError(f"未知的状态: {status}")
+        entry: Dict[str, Any] = {"key": key, "status": status}
+        if output:
+            entry["output"] = os.path.relpath(output, self.root).replace(os.sep, "/")
+            if status == "done" and os.path.exists(output):
+                entry["size"] = os.path.getsize(output)
+        with self._lock:
+            times = self._times.pop(key, None)
+            self._pending.pop(key, None)
+        if times:
+            start = times.pop("start")
+            end = times.pop("end", None) or self.clock()
+            entry["seconds"] = round(end - start, 4)
+            if times:
+                entry["stages"] = {stage: round(at - start, 4) for stage, at in times.items()}
+        if plan:
+            entry["layout"] = plan["layout"]
+            entry["rotate"] = plan["rotate"]
+        if params:
+            entry["params"] = params
+        if error is not None:
+            entry["error"] = f"{type(error).__name__}: {error}"
+        entry.update(fields)
+        with self._lock:
+            self.records[key] = entry
+        return entry
+
+    def finish(self, exit_code: int = 0, cancelled: bool = False) -> Dict[str, Any]:
+        """把未处理的任务记为 cancelled，返回完整报告"""
+        with self._lock:
+            leftover = list(self._pending)
+        for key in leftover:
+            self.record(key, "cancelled")
+
+        elapsed = self.clock() - self._started_at
+        records = sorted(self.records.values(), key=lambda entry: entry["key"])
+        counts = {status: 0 for status in STATUSES}
+        for entry in records:
+            counts[entry["status"]] += 1
+        done = [entry for entry in records if entry["status"] == "done"]
+        output_bytes = sum(entry.get("size", 0) for entry in done)
+        seconds = [entry["seconds"] for entry in records
+                   if entry["status"] in ("done", "failed") and "seconds" in entry]
+
+        def rate(value: float) -> Optional[float]:
+            return round(value / elapsed, 3) if elapsed > 0 else None
+
+        summary = {
+            "counts": counts,
+            "elapsed_seconds": round(elapsed, 3),
+            "output_bytes": output_bytes,
+            "triplets_per_second": rate(len(done)),
+            "bytes_per_second": rate(output_bytes),
+            "triplet_seconds": {
+                "p50": _percentile(seconds, 0.5),
+                "p95": _percentile(seconds, 0.95),
+                "max": max(seconds) if seconds else None,
+                "sum": round(sum(seconds), 4),
+                "count": len(seconds),
+            },
+        }
+        return {
+            "root": self.root,
+            "argv": self.argv,
+            "shard": f"{self.shard[0]}/{self.shard[1]}" if self.shard else None,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started_at": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "finished_timestamp": round(time.time(), 3),
+            "exit_code": exit_code,
+            "cancelled": cancelled,
+            "summary": summary,
+            "triplets": records,
+        }
+
+
+def _write_atomic(path: str, text: str) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_report(path: str, report: Dict[str, Any]) -> None:
+    _write_atomic(path, json.dumps(report, ensure_ascii=False, indent=2) + "\n")
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_metrics(report: Dict[str, Any]) -> str:
+    """Prometheus 文本格式（0.0.4）。所有指标都带 root 标签（分片运行时另有 shard），多个目录可写入不同文件"""
+    labels = f'root="{_label(report["root"])}"'
+    if report["shard"]:
+        labels += f',shard="{report["shard"]}"'
+    summary = report["summary"]
+    timing = summary["triplet_seconds"]
+
+    def gauge(name: str, value: Any) -> List[str]:
+        return [f"# TYPE {METRIC_PREFIX}_{name} gauge", f"{METRIC_PREFIX}_{name}{{{labels}}} {value}"]
+
+    lines = [f"# TYPE {METRIC_PREFIX}_triplets gauge"]
+    for status, count in summary["counts"].items():
+        lines.append(f'{METRIC_PREFIX}_triplets{{{labels},status="{status}"}} {count}')
+    lines += gauge("duration_seconds", summary["elapsed_seconds"])
+    lines += gauge("output_bytes", summary["output_bytes"])
+    lines += gauge("throughput_triplets_per_second", summary["triplets_per_second"] or 0)
+    lines += gauge("throughput_bytes_per_second", summary["bytes_per_second"] or 0)
+    lines.append(f"# TYPE {METRIC_PREFIX}_triplet_seconds summary")
+    for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("1", "max")):
+        if timing[key] is not None:
+            lines.append(f'{METRIC_PREFIX}_triplet_seconds{{{labels},quantile="{quantile}"}} {timing[key]}')
+    lines.append(f"{METRIC_PREFIX}_triplet_seconds_sum{{{labels}}} {timing['sum']}")
+    lines.append(f"{METRIC_PREFIX}_triplet_seconds_count{{{labels}}} {timing['count']}")
+    lines += gauge("exit_code", report["exit_code"])
+    lines += gauge("last_finished_timestamp_seconds", report["finished_timestamp"])
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: str, report: Dict[str, Any]) -> None:
+    """写出 .prom 文件；临时文件名以 .part 结尾，textfile collector 不会读取"""
+    _write_atomic(path, format_metrics(report))
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+合并任务沙箱 - 在独立工作进程中执行 pdfium 渲染/提取
+
+部分供应商开出的异常 PDF 会让 pdfium.PdfDocument 或 page.render 卡死甚至段错误，
+在主进程或 GUI 的工作线程中直接调用时，整个批量任务会中断，界面也会一直卡在"处理中"。
+
+SandboxPool 把每个任务交给常驻的工作进程执行：
+- 每个任务有墙钟超时，超时后终止该工作进程
+- 工作进程可设置内存上限（Unix 上为 RLIMIT_AS），超出时任务以 MemoryError 失败
+- 工作进程崩溃或超时后自动补充新进程，任务以 SandboxError 失败并带上原因
+- 实现 concurrent.futures.Executor 接口，可直接作为 MemoryBoundedScheduler 的执行器
+
+工作进程一律用 spawn 方式启动，避免在多线程的 GUI 进程中 fork。
+"""
+
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from multiprocessing.connection import wait
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# 批量合并时每个任务的默认超时（秒）；正常的一套文件在数秒内完成
+DEFAULT_JOB_TIMEOUT = 120.0
+
+
+class SandboxError(RuntimeError):
+    """工作进程异常退出或超时"""
+
+
+class JobTimeout(SandboxError):
+    """任务超过墙钟超时，工作进程已被终止"""
+
+
+class WorkerCrashed(SandboxError):
+    """工作进程在执行任务时崩溃（如 pdfium 段错误）"""
+
+
+def _apply_memory_limit(limit: Optional[int]) -> None:
+    if not limit:
+        return
+    try:
+        import resource
+    except ImportError:
+        # Windows 没有 rlimit，只依赖超时
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _worker_main(conn, memory_limit: Optional[int]) -> None:
+    """工作进程主循环：接收 (fn, args, kwargs)，回传 ("ok", 结果) 或 ("error", 异常)"""
+    _apply_memory_limit(memory_limit)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            break
+        if task is None:
+            break
+        fn, args, kwargs = task
+        try:
+            reply = ("ok", fn(*args, **kwargs))
+        except BaseException as e:
+            reply = ("error", e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # 结果或异常无法 pickle 时，至少把原因传回去
+            conn.send(("error", SandboxError(f"无法传回任务结果: {e!r}")))
+
+
+def _describe_exit(exitcode: Optional[int]) -> str:
+    if exitcode is not None and exitcode < 0:
+        try:
+            return f"信号 {signal.Signals(-exitcode).name}"
+        except ValueError:
+            return f"信号 {-exitcode}"
+    return f"退出码 {exitcode}"
+
+
+class _Worker:
+    def __init__(self, ctx, memory_limit: Optional[int]):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, memory_limit), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def stop(self, timeout: float = 1.0) -> None:
+        """先请求正常退出，超时再强制结束"""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        self.kill()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxPool(Executor):
+    """在隔离的工作进程中执行任务的进程池。
+
+    与 ProcessPoolExecutor 不同，一个工作进程崩溃只会让它正在执行的任务失败，
+    不会导致整个进程池失效；卡死的任务在 timeout 秒后被终止。
+    fn 及其参数、返回值都需要可被 pickle。
+    """
+
+    def __init__(self, max_workers: int = 1, timeout: Optional[float] = None,
+                 memory_limit: Optional[int] = None, mp_context=None):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self._ctx = mp_context or multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._pending: Deque[Tuple[Future, Callable, tuple, dict]] = deque()
+        self._idle: List[_Worker] = []
+        self._busy: Dict[_Worker, Tuple[Future, Optional[float]]] = {}
+        self._shutdown = False
+        self._wake_r, self._wake_w = self._ctx.Pipe(duplex=False)
+        self._thread: Optional[threading.Thread] = None
+        # 统计：被替换的工作进程数
+        self.replaced = 0
+
+    def submit(self, fn: Callable, /, *args: Any, **kwargs: Any) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("SandboxPool 已关闭")
+            self._pending.append((future, fn, args, kwargs))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="SandboxPool", daemon=True)
+                self._thread.start()
+        self._wake()
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while self._pending:
+                    self._pending.popleft()[0].cancel()
+            thread = self._thread
+        self._wake()
+        if thread is None:
+            self._close_pipes()
+        elif wait:
+            thread.join()
+
+    def worker_pids(self) -> List[int]:
+        with self._lock:
+            return [w.pid for w in self._idle + list(self._busy)]
+
+    def _wake(self) -> None:
+        try:
+            self._wake_w.send_bytes(b"")
+        except OSError:
+            pass
+
+    def _close_pipes(self) -> None:
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def _dispatch(self) -> None:
+        """把等待中的任务分配给空闲（或新建的）工作进程"""
+        while True:
+            with self._lock:
+                if not self._pending or (not self._idle and len(self._busy) >= self.max_workers):
+                    return
+                future, fn, args, kwargs = self._pending.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                worker = self._idle.pop() if self._idle else None
+            if worker is None:
+                worker = _Worker(self._ctx, self.memory_limit)
+            try:
+                worker.conn.send((fn, args, kwargs))
+            except (BrokenPipeError, EOFError, ConnectionError):
+                worker.kill()
+                self.replaced += 1
+                future.set_exception(WorkerCrashed(f"工作进程已退出（{_describe_exit(worker.process.exitcode)}）"))
+                continue
+            except Exception as e:
+                # 参数无法 pickle：任务失败，工作进程仍可用
+                with self._lock:
+                    self._idle.append(worker)
+                future.set_exception(e)
+                continue
+            deadline = time.monotonic() + self.timeout if self.timeout else None
+            with self._lock:
+                self._busy[worker] = (future, deadline)
+
+    def _collect(self) -> None:
+        """收取已完成任务的结果，处理崩溃和超时的工作进程"""
+        now = time.monotonic()
+        for worker, (future, deadline) in list(self._busy.items()):
+            error: Optional[BaseException] = None
+            if worker.conn.poll():
+                try:
+                    status, value = worker.conn.recv()
+                except (EOFError, OSError):
+                    worker.process.join(1.0)
+                    error = WorkerCrashed(f"工作进程崩溃（{_describe_exit(worker.process.exitcode)}）")
+                else:
+                    with self._lock:
+                        del self._busy[worker]
+                        self._idle.append(worker)
+                    if status == "ok":
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+                    continue
+            elif not worker.process.is_alive():
+                error = WorkerCrashed(f"工作进程崩溃（{_describe_exit(worker.process.exitcode)}）")
+            elif deadline is not None and now >= deadline:
+                error = JobTimeout(f"超过 {self.timeout:g} 秒未完成，已终止工作进程")
+            else:
+                continue
+
+            worker.kill()
+            with self._lock:
+                del self._busy[worker]
+                self.replaced += 1
+            future.set_exception(error)
+
+    def _loop(self) -> None:
+        try:
+            while True:
+                self._dispatch()
+                with self._lock:
+                    if self._shutdown and not self._pending and not self._busy:
+                        break
+                    busy = list(self._busy.items())
+
+                deadlines = [d for _, (_, d) in busy if d is not None]
+                timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                handles: List[Any] = [self._wake_r]
+                for worker, _ in busy:
+                    handles += [worker.conn, worker.process.sentinel]
+                wait(handles, timeout)
+                while self._wake_r.poll():
+                    self._wake_r.recv_bytes()
+                self._collect()
+        finally:
+            for worker in self._idle:
+                worker.stop()
+            for worker, (future, _) in self._busy.items():
+                worker.kill()
+                future.set_exception(SandboxError("进程池已关闭"))
+            self._idle.clear()
+            self._busy.clear()
+            self._close_pipes()
+
+
+_shared_pools: Dict[Tuple[Optional[float], Optional[int]], SandboxPool] = {}
+_shared_lock = threading.Lock()
+
+
+def run_isolated(fn: Callable, *args: Any, timeout: Optional[float] = DEFAULT_JOB_TIMEOUT,
+                 memory_limit: Optional[int] = None, **kwargs: Any) -> Any:
+    """在共享的常驻工作进程中执行 fn 并等待结果（供 GUI 工作线程使用）。
+
+    工作进程崩溃或超时时抛出 SandboxError，调用线程不会被卡死。
+    """
+    key = (timeout, memory_limit)
+    with _shared_lock:
+        pool = _shared_pools.get(key)
+        if pool is None:
+            pool = _shared_pools[key] = SandboxPool(max_workers=2, timeout=timeout, memory_limit=memory_limit)
+    return pool.submit(fn, *args, **kwargs).result()
+
+
+@atexit.register
+def _shutdown_shared_pools() -> None:
+    with _shared_lock:
+        for pool in _shared_pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+        _shared_pools.clear()
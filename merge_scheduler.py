@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+批量合并调度器 - 内存受限的并发执行
+
+300 DPI 的 A4 画布约 26MB，手机截图解码后单张可达 40MB 以上，
+直接并行处理很容易在 4GB 内存的机器上耗尽内存。
+本模块根据文件头信息估算每套文件（发票 + 购买记录 + 支付记录）的峰值内存，
+只在估算总量不超过预算时才提交新任务，并根据观测到的进程内存动态调整并发数。
+
+同时估算每套文件的处理耗时，按"最大优先"顺序提交，
+避免并发运行到最后只剩一个进程在处理超大文件。
+"""
+
+from __future__ import annotations
+
+import heapq
+import os
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+# 可选依赖：有 psutil 时用它读取进程内存（Windows 需要），否则读取 /proc
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+    psutil = None
+
+
+A4_POINTS = (595.0, 842.0)
+
+# 每个工作进程的固定开销（解释器 + Pillow + pypdfium2），按经验估计
+WORKER_BASE_BYTES = 80 * 1024 * 1024
+
+# 未指定预算且无法获取物理内存时的默认预算
+DEFAULT_MEMORY_BUDGET = 2 * 1024 * 1024 * 1024
+
+# 等待任务完成时的内存采样间隔（秒）
+SAMPLE_INTERVAL = 0.2
+
+# 耗时估算用的处理速度（单核、300 DPI，按经验测得）
+RENDER_PIXELS_PER_SEC = 45e6   # pdfium 渲染
+DECODE_PIXELS_PER_SEC = 60e6   # JPEG/PNG 解码
+RESIZE_PIXELS_PER_SEC = 50e6   # LANCZOS 缩放（按源像素计）
+ENCODE_PIXELS_PER_SEC = 100e6  # 画布 JPEG 编码
+PDF_BYTES_PER_SEC = 20e6       # PDF 解析与内嵌扫描图解码（按文件大小计）
+
+
+def probe_pdf_page_size(pdf_path: str) -> Tuple[float, float]:
+    """读取 PDF 第一页尺寸（单位：点），不渲染页面"""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        if len(pdf) == 0:
+            return A4_POINTS
+        page = pdf[0]
+        try:
+            return page.get_size()
+        finally:
+            page.close()
+    finally:
+        pdf.close()
+
+
+def probe_image_size(img_path: str) -> Tuple[int, int, int]:
+    """只读取图片文件头，返回 (宽, 高, 通道数)，不解码像素"""
+    with Image.open(img_path) as img:
+        return img.size[0], img.size[1], len(img.getbands())
+
+
+def probe_triplet(pdf_path: str, buy_path: str, pay_path: str) -> Dict[str, Any]:
+    """读取一套文件的头信息：发票页面尺寸、记录图尺寸与通道数、文件大小。
+    读不到的项按保守值填充（A4 页面、12MP 照片）。
+    """
+    try:
+        page_size = probe_pdf_page_size(pdf_path)
+    except Exception:
+        page_size = A4_POINTS
+
+    images = []
+    for path in (buy_path, pay_path):
+        try:
+            images.append(probe_image_size(path))
+        except Exception:
+            images.append((4032, 3024, 3))
+
+    file_bytes = 0
+    pdf_bytes = 0
+    for path in (pdf_path, buy_path, pay_path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        file_bytes += size
+        if path == pdf_path:
+            pdf_bytes = size
+
+    return {"page_size": page_size, "images": images, "file_bytes": file_bytes, "pdf_bytes": pdf_bytes}
+
+
+def estimate_triplet_memory(pdf_path: str, buy_path: str, pay_path: str, dpi: int = 300,
+                            probe: Optional[Dict[str, Any]] = None) -> int:
+    """估算合并一套文件时的峰值内存（字节）。
+
+    主要由以下部分组成：
+    - A4 画布（RGB）
+    - 发票渲染位图（BGRA）及其 RGB 副本
+    - 两张记录图的解码像素及其 RGB 副本
+    - 工作进程的固定开销
+    缩放后的小图和 PDF 编码缓冲区相对较小，按画布的一半计入。
+    """
+    probe = probe or probe_triplet(pdf_path, buy_path, pay_path)
+    scale = dpi / 72.0
+    canvas = int(A4_POINTS[0] * scale) * int(A4_POINTS[1] * scale) * 3
+
+    pw, ph = probe["page_size"]
+    invoice_px = int(pw * scale) * int(ph * scale)
+    invoice = invoice_px * 4 + invoice_px * 3 * 2
+
+    images = sum(w * h * bands + w * h * 3 for w, h, bands in probe["images"])
+
+    return WORKER_BASE_BYTES + canvas + canvas // 2 + invoice + images
+
+
+def estimate_triplet_cost(pdf_path: str, buy_path: str, pay_path: str, dpi: int = 300,
+                          probe: Optional[Dict[str, Any]] = None) -> float:
+    """估算合并一套文件的单核耗时（秒），用于排序和预估总时长。
+    由发票渲染像素、记录图解码与缩放像素、画布编码像素以及 PDF 文件大小折算。
+    """
+    probe = probe or probe_triplet(pdf_path, buy_path, pay_path)
+    scale = dpi / 72.0
+    canvas_px = int(A4_POINTS[0] * scale) * int(A4_POINTS[1] * scale)
+
+    pw, ph = probe["page_size"]
+    invoice_px = int(pw * scale) * int(ph * scale)
+    image_px = sum(w * h for w, h, _ in probe["images"])
+
+    return (invoice_px / RENDER_PIXELS_PER_SEC
+            + image_px / DECODE_PIXELS_PER_SEC
+            + (invoice_px + image_px) / RESIZE_PIXELS_PER_SEC
+            + canvas_px / ENCODE_PIXELS_PER_SEC
+            + probe["pdf_bytes"] / PDF_BYTES_PER_SEC)
+
+
+def order_largest_first(jobs: Iterable[Dict[str, Any]], key: str = "base") -> List[Dict[str, Any]]:
+    """按估算耗时（"cost" 字段）从大到小排序，耗时相同时按 key 排序保证结果稳定"""
+    return sorted(jobs, key=lambda job: (-job.get("cost", 0.0), job.get(key, "")))
+
+
+def estimate_makespan(costs: Iterable[float], workers: int) -> float:
+    """估算按最大优先顺序分配到 workers 个进程时的总耗时（贪心模拟）"""
+    loads = [0.0] * max(1, workers)
+    for cost in sorted(costs, reverse=True):
+        heapq.heapreplace(loads, loads[0] + cost)
+    return max(loads)
+
+
+def in_key_order(results: Iterable[Tuple[Dict[str, Any], Any]], keys: Iterable[Hashable],
+                 key: str = "base") -> Iterator[Tuple[Dict[str, Any], Any]]:
+    """把按完成顺序到达的结果重新按 keys 的顺序产出。
+    某个结果到达时，只要它之前的所有 key 都已完成就立即产出，不必等到全部结束。
+    """
+    order = list(keys)
+    buffered: Dict[Hashable, Tuple[Dict[str, Any], Any]] = {}
+    position = 0
+    for item in results:
+        buffered[item[0][key]] = item
+        while position < len(order) and order[position] in buffered:
+            yield buffered.pop(order[position])
+            position += 1
+    # 理论上不会剩余；保险起见按原顺序补齐
+    for k in order[position:]:
+        if k in buffered:
+            yield buffered.pop(k)
+
+
+def default_memory_budget() -> int:
+    """默认预算：物理内存的一半"""
+    total = None
+    if PSUTIL_AVAILABLE:
+        total = psutil.virtual_memory().total
+    else:
+        try:
+            total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        except (AttributeError, ValueError, OSError):
+            total = None
+    return total // 2 if total else DEFAULT_MEMORY_BUDGET
+
+
+def process_rss(pid: int) -> Optional[int]:
+    """读取进程当前常驻内存（字节），无法读取时返回 None"""
+    if PSUTIL_AVAILABLE:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except Exception:
+            return None
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _run_measured(fn: Callable[[Dict[str, Any]], Any], job: Dict[str, Any]
+                  ) -> Tuple[Any, Optional[BaseException], int]:
+    """在工作进程中执行任务，返回 (结果, 异常, 工作进程 pid)；任务失败时同样带回 pid，供调度器采样内存"""
+    try:
+        return fn(job), None, os.getpid()
+    except Exception as e:
+        return None, e, os.getpid()
+
+
+class MemoryBoundedScheduler:
+    """按内存预算准入任务的调度器。
+
+    每个任务是一个带 "estimate" 字段（预计峰值内存，字节）的字典。
+    只有当已准入任务的估算总量加上新任务不超过预算时才提交；
+    即使单个任务超过预算，在没有其他任务运行时也会被单独执行。
+    运行过程中采样工作进程的实际内存：超出预算时降低并发数并放大估算系数，
+    内存充裕时逐步恢复并发。
+    执行器提供 worker_pids()（如 SandboxPool）时，每次采样都读取当前的工作进程，进程一启动即被采样，
+    被替换的进程不再计入；否则只能采样已完成过任务的工作进程。
+    工作进程池在首次 run() 时创建，可跨多次 run() 复用，用完后调用 close()（或使用 with）。
+    """
+
+    def __init__(self, memory_budget: Optional[int] = None, max_workers: Optional[int] = None,
+                 executor_factory: Optional[Callable[[int], Executor]] = None,
+                 rss_reader: Callable[[int], Optional[int]] = process_rss):
+        self.memory_budget = memory_budget or default_memory_budget()
+        self.max_workers = max(1, max_workers or os.cpu_count() or 1)
+        self.executor_factory = executor_factory or (lambda n: ProcessPoolExecutor(max_workers=n))
+        self.rss_reader = rss_reader
+
+        # 当前允许的并发数，随观测内存调整
+        self.concurrency = self.max_workers
+        # 估算修正系数：实际内存 / 估算内存
+        self.estimate_scale = 1.0
+
+        self.reserved = 0
+        self.peak_observed = 0
+        self.worker_pids: set = set()
+        self._executor: Optional[Executor] = None
+
+    def __enter__(self) -> "MemoryBoundedScheduler":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """关闭工作进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _reservation(self, job: Dict[str, Any]) -> int:
+        return int(job.get("estimate", 0) * self.estimate_scale)
+
+    def _refresh_workers(self) -> None:
+        """更新工作进程列表：执行器能列出工作进程时以它为准"""
+        list_pids = getattr(self._executor, "worker_pids", None)
+        if callable(list_pids):
+            self.worker_pids = set(list_pids())
+
+    def _observe(self) -> Optional[int]:
+        """采样所有已知工作进程的内存总量；读不到内存的进程（已退出）不再采样"""
+        self._refresh_workers()
+        readings = {pid: self.rss_reader(pid) for pid in self.worker_pids}
+        self.worker_pids = {pid for pid, rss in readings.items() if rss is not None}
+        if not self.worker_pids:
+            return None
+        total = sum(rss for rss in readings.values() if rss is not None)
+        self.peak_observed = max(self.peak_observed, total)
+        return total
+
+    def _adapt(self, in_flight: int) -> None:
+        """根据观测内存调整并发数与估算系数"""
+        observed = self._observe()
+        if observed is None or in_flight == 0:
+            return
+        if observed > self.memory_budget:
+            self.concurrency = max(1, min(self.concurrency, in_flight) - 1)
+            if self.reserved:
+                self.estimate_scale = min(4.0, max(self.estimate_scale, observed / self.reserved))
+        elif observed < self.memory_budget * 0.6 and self.concurrency < self.max_workers:
+            self.concurrency += 1
+
+    def _admissible(self, job: Dict[str, Any], in_flight: int) -> bool:
+        if in_flight == 0:
+            return True
+        if in_flight >= self.concurrency:
+            return False
+        return self.reserved + self._reservation(job) <= self.memory_budget
+
+    def run(self, jobs: Iterable[Dict[str, Any]], fn: Callable[[Dict[str, Any]], Any],
+            on_submit: Optional[Callable[[Dict[str, Any]], None]] = None,
+            cancel: Any = None) -> Iterator[Tuple[Dict[str, Any], Future]]:
+        """按预算执行任务，任务完成后依次产出 (job, future)。
+        任务按传入顺序提交（需要最大优先时先用 order_largest_first 排序）；
+        fn 必须是可被 pickle 的顶层函数（进程池要求）。
+        on_submit 在每个任务提交前于调用方线程中调用（如记录任务开始）。
+        jobs 按需逐个取出（只预取队首一个），可以是生成器，如 merge_prefetch 的预读迭代器。
+        cancel（merge_progress.CancelToken）在每次准入时检查：取消后已取出但未提交的任务不再开始，
+        正在运行的任务照常完成并产出。
+        """
+        iterator = iter(jobs)
+        pending: Deque[Dict[str, Any]] = deque()
+        running: Dict[Future, Tuple[Dict[str, Any], int]] = {}
+
+        def cancelled() -> bool:
+            return cancel is not None and cancel.cancelled
+
+        def peek() -> bool:
+            if cancelled():
+                return False
+            if not pending:
+                job = next(iterator, None)
+                if job is not None:
+                    pending.append(job)
+            return bool(pending)
+
+        if self._executor is None:
+            self._executor = self.executor_factory(self.max_workers)
+        executor = self._executor
+        try:
+            while peek() or running:
+                # 按顺序准入：队首放不下时等待，避免大任务被小任务长期饿死
+                while peek() and self._admissible(pending[0], len(running)):
+                    job = pending.popleft()
+                    reservation = self._reservation(job)
+                    self.reserved += reservation
+                    if on_submit:
+                        on_submit(job)
+                    future = executor.submit(_run_measured, fn, job)
+                    running[future] = (job, reservation)
+
+                done, _ = wait(list(running), timeout=SAMPLE_INTERVAL, return_when=FIRST_COMPLETED)
+                self._adapt(len(running))
+
+                for future in done:
+                    job, reservation = running.pop(future)
+                    self.reserved -= reservation
+                    if future.exception() is None:
+                        self.worker_pids.add(future.result()[2])
+                    yield job, _unwrap(future)
+        finally:
+            # 调用方提前停止迭代时，取消尚未开始的任务
+            for future in running:
+                future.cancel()
+                self.reserved -= running[future][1]
+
+
+def _unwrap(future: Future) -> Future:
+    """把 _run_measured 的 (结果, 异常, pid) 还原为只包含任务结果的 Future"""
+    result: Future = Future()
+    error = future.exception()
+    if error is None:
+        value, error, _ = future.result()
+    if error is not None:
+        result.set_exception(error)
+    else:
+        result.set_result(value)
+    return result
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+if __name__ == "__main__":
+    # 打印指定三件套的内存与耗时估算，便于核对预算设置
+    if len(sys.argv) != 4:
+        print("用法: python merge_scheduler.py 发票.pdf 购买记录.jpg 支付记录.jpg")
+        sys.exit(1)
+    info = probe_triplet(*sys.argv[1:4])
+    print(f"预计峰值内存: {format_bytes(estimate_triplet_memory(*sys.argv[1:4], probe=info))}")
+    print(f"预计耗时: {estimate_triplet_cost(*sys.argv[1:4], probe=info):.2f} 秒")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+分片批量合并 - 多台机器共享同一目录（如 NFS）分担整批任务
+
+每套文件按其 key（相对根目录的 "目录/base_key"）的稳定哈希分配到 N 个分片之一，
+各机器分别运行 `merge_invoices.py 根目录 --shard K/N`，互不通信，也不需要协调服务。
+
+每个分片在 "已合并/分片/" 下写入自己的记录：
+    shard-K-of-N.manifest.jsonl   每套文件一行（完成/失败/已存在/不齐全）
+    shard-K-of-N.csv              同上，便于用表格软件查看
+    shard-K-of-N.summary.json     分片汇总（运行主机、耗时、各状态数量）
+
+全部分片结束后运行 `merge_invoices.py 根目录 --merge-shards`，
+合并各分片的汇总与 CSV 记录，并报告尚未完成的分片。
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+import socket
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+SHARD_DIR_NAME = "分片"
+CSV_HEADERS = ["文件组", "状态", "输出文件", "大小(字节)", "JPEG质量", "错误", "处理时间", "分片"]
+STATUSES = ("done", "failed", "existing", "incomplete")
+
+_SUMMARY_RE = re.compile(r"shard-(\d+)-of-(\d+)\.summary\.json$")
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """解析 K/N（K 从 1 开始），如 2/8"""
+    try:
+        k, n = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 K/N，如 1/4: {text}")
+    if n < 1 or not 1 <= k <= n:
+        raise argparse.ArgumentTypeError(f"分片编号应满足 1 <= K <= N: {text}")
+    return k, n
+
+
+def shard_of(key: str, count: int) -> int:
+    """按 key 的 SHA-1 分配分片（1..count）。
+    不使用内置 hash()：它在每个进程中随机加盐，不同机器的结果不一致。
+    """
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def shard_name(k: int, n: int) -> str:
+    return f"shard-{k}-of-{n}"
+
+
+def filter_batch(batch: Dict[str, Any], k: int, n: int) -> Dict[str, Any]:
+    """只保留属于第 k 个分片的任务、已存在输出和不齐全的文件组"""
+    def mine(key: str) -> bool:
+        return shard_of(key, n) == k
+
+    jobs = [job for job in batch["jobs"] if mine(job["key"])]
+    skipped = [key for key in batch["skipped"] if mine(key)]
+    incomplete = [item for item in batch["incomplete"] if mine(item["base"])]
+    return {"candidates": len(jobs) + len(skipped), "jobs": jobs, "skipped": skipped, "incomplete": incomplete}
+
+
+class ShardRecorder:
+    """记录一个分片的处理结果。每条记录立即追加并落盘，分片中途退出也能保留已完成的部分"""
+
+    def __init__(self, out_dir: str, k: int, n: int, root: str):
+        self.k, self.n = k, n
+        self.root = root
+        self.shard_dir = os.path.join(out_dir, SHARD_DIR_NAME)
+        os.makedirs(self.shard_dir, exist_ok=True)
+        prefix = os.path.join(self.shard_dir, shard_name(k, n))
+        self.manifest_path = prefix + ".manifest.jsonl"
+        self.csv_path = prefix + ".csv"
+        self.summary_path = prefix + ".summary.json"
+        self.counts = {status: 0 for status in STATUSES}
+        self.started = time.time()
+
+        # 汇总文件只在分片完整结束时写出，重新运行前先删除上一次的汇总
+        if os.path.exists(self.summary_path):
+            os.remove(self.summary_path)
+
+        # 同一分片重新运行时重写记录（已存在的输出会记为 existing）
+        self._manifest = open(self.manifest_path, "w", encoding="utf-8")
+        self._csv_file = open(self.csv_path, "w", encoding="utf-8-sig", newline="")
+        self._csv = csv.writer(self._csv_file)
+        self._csv.writerow(CSV_HEADERS)
+
+    def record(self, key: str, status: str, output: Optional[str] = None,
+               params: Optional[Dict[str, Any]] = None, error: Optional[BaseException] = None) -> None:
+        size = os.path.getsize(output) if status == "done" and output and os.path.exists(output) else None
+        entry = {
+            "key": key,
+            "status": status,
+            "output": os.path.relpath(output, self.root).replace(os.sep, "/") if output else None,
+            "size": size,
+            "quality": params.get("quality") if params else None,
+            "error": f"{type(error).__name__}: {error}" if error else None,
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self.counts[status] += 1
+        self._manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._manifest.flush()
+        self._csv.writerow([entry["key"], status, entry["output"] or "", size or "", entry["quality"] or "",
+                            entry["error"] or "", entry["time"], f"{self.k}/{self.n}"])
+        self._csv_file.flush()
+
+    def close(self, write_summary: bool = True) -> Optional[Dict[str, Any]]:
+        """关闭记录文件并写出分片汇总；write_summary=False 时（如被取消）不写汇总，分片视为未完成"""
+        self._manifest.close()
+        self._csv_file.close()
+        if not write_summary:
+            return None
+        finished = time.time()
+        summary = {
+            "shard": f"{self.k}/{self.n}",
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "root": self.root,
+            "started_at": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "finished_at": datetime.fromtimestamp(finished).isoformat(timespec="seconds"),
+            "elapsed_seconds": round(finished - self.started, 3),
+            "counts": self.counts,
+        }
+        # 先写临时文件再替换：汇总文件存在即表示该分片已完整结束
+        tmp_path = self.summary_path + ".part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.summary_path)
+        return summary
+
+
+def merge_shard_outputs(out_dir: str) -> Dict[str, Any]:
+    """合并 "已合并/分片/" 下各分片的汇总与 CSV 记录，写出 汇总.summary.json 与 汇总.csv"""
+    shard_dir = os.path.join(out_dir, SHARD_DIR_NAME)
+    loaded: List[Tuple[int, Dict[str, Any]]] = []
+    for path in sorted(glob.glob(os.path.join(shard_dir, "shard-*-of-*.summary.json"))):
+        match = _SUMMARY_RE.search(os.path.basename(path))
+        with open(path, encoding="utf-8") as f:
+            loaded.append((int(match.group(2)), json.load(f)))
+
+    # 目录中可能残留以不同分片数运行的记录，只合并分片数最大的那一轮
+    shard_count = max((n for n, _ in loaded), default=0)
+    summaries = sorted((s for n, s in loaded if n == shard_count), key=lambda s: int(s["shard"].split("/")[0]))
+    totals = {status: 0 for status in STATUSES}
+    for summary in summaries:
+        for status in STATUSES:
+            totals[status] += summary["counts"].get(status, 0)
+
+    finished = {int(s["shard"].split("/")[0]) for s in summaries}
+    missing = [k for k in range(1, shard_count + 1) if k not in finished]
+
+    # 合并各分片的 CSV 记录（含未结束分片已写出的部分），按文件组排序
+    rows: List[List[str]] = []
+    for path in sorted(glob.glob(os.path.join(shard_dir, "shard-*-of-*.csv"))):
+        if not path.endswith(f"-of-{shard_count}.csv"):
+            continue
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            rows.extend(reader)
+    rows.sort(key=lambda row: row[0])
+
+    csv_path = os.path.join(shard_dir, "汇总.csv")
+    with open(csv_path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADERS)
+        writer.writerows(rows)
+
+    report = {
+        "shards": shard_count,
+        "finished": sorted(finished),
+        "missing": missing,
+        "counts": totals,
+        "records": len(rows),
+        "elapsed_seconds": max((s["elapsed_seconds"] for s in summaries), default=0),
+        "per_shard": summaries,
+        "csv": csv_path,
+    }
+    with open(os.path.join(shard_dir, "汇总.summary.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+启动时间探针 - 供 check_startup.py 测量（打包后）程序的启动时间
+
+设置环境变量 INVOICE_STARTUP_PROBE=结果文件 后启动图形界面：窗口第一次显示后，程序把各阶段时间
+写入该 JSON 文件并立即退出，不弹出任何提示框。INVOICE_STARTUP_T0 为父进程启动程序时的 time.time()，
+各阶段时间都从该时刻算起，因此包含 onefile 模式的解压时间；未设置时从本模块被导入时算起。
+
+阶段：import（主模块导入完成）、window（窗口第一次显示）；启动失败时 error 为错误说明。
+只使用标准库，未设置环境变量时不做任何事。
+"""
+
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Optional
+
+PROBE_ENV = "INVOICE_STARTUP_PROBE"
+T0_ENV = "INVOICE_STARTUP_T0"
+
+_t0 = float(os.environ.get(T0_ENV) or time.time())
+_marks: Dict[str, Any] = {}
+
+
+def enabled() -> bool:
+    return bool(os.environ.get(PROBE_ENV))
+
+
+def mark(stage: str) -> None:
+    """记录某个阶段完成的时间（秒，同一阶段只记第一次）"""
+    if enabled():
+        _marks.setdefault(stage, round(time.time() - _t0, 4))
+
+
+def finish(error: Optional[BaseException] = None) -> None:
+    """写出结果文件（先写临时文件再替换，测量脚本不会读到一半的内容）"""
+    path = os.environ.get(PROBE_ENV)
+    if not path:
+        return
+    result = dict(_marks, frozen=bool(getattr(sys, "frozen", False)),
+                  error=f"{type(error).__name__}: {error}" if error else None)
+    with open(path + ".part", "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(path + ".part", path)
@@ -0,0 +1,625 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+批量合并流程测试脚本
+验证内存估算、调度器准入规则、递归索引，以及 merge_invoices.main 的并发处理
+"""
+
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import merge_invoices
+import merge_scheduler
+from test_merge_core import make_sample_triplet
+
+
+def make_sample_folder(folder: str, count: int = 4) -> None:
+    for i in range(count):
+        make_sample_triplet(folder, f"{i}测试发票")
+
+
+def test_estimate_grows_with_dpi():
+    """内存估算随 DPI 增大，且覆盖 A4 画布"""
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder)
+        low = merge_scheduler.estimate_triplet_memory(files["pdf"], files["buy"], files["pay"], dpi=150)
+        high = merge_scheduler.estimate_triplet_memory(files["pdf"], files["buy"], files["pay"], dpi=300)
+        print(f"150 DPI: {merge_scheduler.format_bytes(low)}，300 DPI: {merge_scheduler.format_bytes(high)}")
+        assert high > low > 2480 * 3508 * 3 // 4
+
+
+class _Tracker:
+    """记录同时运行的任务所占估算内存的最大值"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def __call__(self, job):
+        with self.lock:
+            self.current += job["estimate"]
+            self.peak = max(self.peak, self.current)
+        time.sleep(0.05)
+        with self.lock:
+            self.current -= job["estimate"]
+        return job["name"]
+
+
+def test_scheduler_respects_budget():
+    """同时运行的任务估算总量不超过预算；超预算的单个任务单独运行"""
+    tracker = _Tracker()
+    jobs = [{"name": f"job{i}", "estimate": size} for i, size in enumerate([300, 300, 300, 900, 200, 200, 200])]
+    scheduler = merge_scheduler.MemoryBoundedScheduler(
+        memory_budget=700, max_workers=4,
+        executor_factory=lambda n: ThreadPoolExecutor(max_workers=n),
+        rss_reader=lambda pid: None,
+    )
+    with scheduler:
+        names = [future.result() for _, future in scheduler.run(jobs, tracker)]
+    print(f"完成顺序: {names}，峰值估算占用: {tracker.peak}")
+    assert sorted(names) == sorted(job["name"] for job in jobs)
+    assert tracker.peak <= 900
+
+
+def test_scheduler_reduces_concurrency_when_over_budget():
+    """观测内存超出预算时降低并发数"""
+    jobs = [{"name": f"job{i}", "estimate": 100} for i in range(8)]
+    scheduler = merge_scheduler.MemoryBoundedScheduler(
+        memory_budget=1000, max_workers=4,
+        executor_factory=lambda n: ThreadPoolExecutor(max_workers=n),
+        rss_reader=lambda pid: 5000,
+    )
+    with scheduler:
+        list(scheduler.run(jobs, _Tracker()))
+    print(f"最终并发数: {scheduler.concurrency}，估算系数: {scheduler.estimate_scale:.1f}")
+    assert scheduler.concurrency < 4
+
+
+def test_largest_first_and_key_order():
+    """按耗时从大到小提交，结果仍按 base_key 顺序产出"""
+    jobs = [{"base": name, "cost": cost} for name, cost in [("a", 1.0), ("b", 9.0), ("c", 3.0), ("d", 9.0)]]
+    ordered = merge_scheduler.order_largest_first(jobs)
+    assert [job["base"] for job in ordered] == ["b", "d", "c", "a"]
+
+    completed = [(job, job["base"].upper()) for job in ordered]
+    reported = [job["base"] for job, _ in merge_scheduler.in_key_order(completed, ["a", "b", "c", "d"])]
+    assert reported == ["a", "b", "c", "d"]
+
+
+def test_cost_grows_with_pixels():
+    """大照片的耗时估算高于小截图"""
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder)
+        small = merge_scheduler.estimate_triplet_cost(files["pdf"], files["buy"], files["pay"])
+        big_path = os.path.join(folder, "big.jpg")
+        Image.new("RGB", (4032, 3024), (200, 200, 200)).save(big_path)
+        big = merge_scheduler.estimate_triplet_cost(files["pdf"], big_path, files["pay"])
+        print(f"小图 {small:.2f}s，大图 {big:.2f}s")
+        assert big > small
+
+
+def test_main_with_workers():
+    """--workers 并发处理生成全部输出"""
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder)
+        assert merge_invoices.main([folder, "--workers", "2", "--memory-budget", "1024M"]) == 0
+        outputs = sorted(os.listdir(os.path.join(folder, "已合并")))
+        print(f"输出: {outputs}")
+        assert len(outputs) == 4
+
+
+def test_plan_mode():
+    """--plan json：只预演，列出缺失文件与预计布局，不生成输出目录"""
+    from contextlib import redirect_stdout
+
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder, count=2)
+        os.remove(os.path.join(folder, "1测试发票支付记录.png"))
+
+        buf = io.StringIO()
+        with redirect_stdout(buf):
+            assert merge_invoices.main([folder, "--plan", "json"]) == 0
+        report = json.loads(buf.getvalue())
+
+        print(f"预演报告: {report['triplets']}")
+        assert report["to_merge"] == 1
+        assert report["incomplete"] == [{"base": "1测试发票", "missing": ["pay"]}]
+        assert report["triplets"][0]["layout"] in ("horizontal", "vertical")
+        assert report["estimated_seconds"] > 0
+        assert not os.path.exists(os.path.join(folder, "已合并"))
+
+
+def test_recursive_index():
+    """--recursive：逐目录索引，跳过"已合并"和 --exclude 匹配的目录，输出写到各自目录"""
+    with tempfile.TemporaryDirectory() as folder:
+        for sub in ("2024/01", "2024/02", "2024/02/已合并", "草稿"):
+            os.makedirs(os.path.join(folder, sub))
+        make_sample_triplet(folder, "根目录")
+        make_sample_triplet(os.path.join(folder, "2024", "01"), "一月")
+        make_sample_triplet(os.path.join(folder, "2024", "02"), "二月")
+        make_sample_triplet(os.path.join(folder, "2024", "02", "已合并"), "旧输出")
+        make_sample_triplet(os.path.join(folder, "草稿"), "草稿")
+
+        scanned = list(merge_invoices.scan_tree(folder, exclude=["草稿"]))
+        dirs = [os.path.relpath(d, folder).replace(os.sep, "/") for d, _ in scanned]
+        print(f"扫描目录: {dirs}")
+        assert dirs == [".", "2024/01", "2024/02"]
+        assert list(scanned[1][1]) == ["一月"]
+
+        only_pdf = list(merge_invoices.scan_tree(folder, include=["*.pdf"]))
+        assert all(set(items) == {"pdf"} for _, index in only_pdf for items in index.values())
+
+        assert merge_invoices.main([folder, "--recursive", "--stream", "--exclude", "草稿"]) == 0
+        assert os.listdir(os.path.join(folder, "2024", "01", "已合并")) == ["一月已合并.pdf"]
+        assert "二月已合并.pdf" in os.listdir(os.path.join(folder, "2024", "02", "已合并"))
+        assert os.listdir(os.path.join(folder, "已合并")) == ["根目录已合并.pdf"]
+        assert not os.path.exists(os.path.join(folder, "草稿", "已合并"))
+
+
+def test_job_queue_resume():
+    """--queue：失败任务记录错误，中断的任务下次恢复，--retry-failed 只重试失败的任务"""
+    from merge_jobqueue import JobQueue
+
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder, count=3)
+        bad_pdf = os.path.join(folder, "1测试发票.pdf")
+        with open(bad_pdf, "wb") as f:
+            f.write(b"%PDF-1.4 broken")
+        out_dir = os.path.join(folder, "已合并")
+        db_path = os.path.join(out_dir, "合并任务.sqlite")
+
+        assert merge_invoices.main([folder, "--queue"]) == 0
+        with JobQueue(db_path) as queue:
+            assert queue.counts()["done"] == 2
+            failed = queue.jobs("failed")
+            assert [job["key"] for job in failed] == ["1测试发票"] and failed[0]["error"]
+            # 模拟上次运行在写入 2测试发票 时断电：状态停在 running，只留下临时文件
+            queue.mark_running("2测试发票")
+        os.replace(os.path.join(out_dir, "2测试发票已合并.pdf"), os.path.join(out_dir, "2测试发票已合并.pdf.part"))
+
+        assert merge_invoices.main([folder, "--queue"]) == 0
+        assert sorted(os.listdir(out_dir)) == ["0测试发票已合并.pdf", "2测试发票已合并.pdf", "合并任务.sqlite"]
+
+        make_sample_triplet(folder, "1测试发票")
+        assert merge_invoices.main([folder, "--retry-failed"]) == 0
+        with JobQueue(db_path) as queue:
+            counts = queue.counts()
+            print(f"任务表状态: {counts}")
+            assert counts["done"] == 3 and counts["failed"] == 0
+            assert queue.jobs()[1]["attempts"] == 2
+
+
+def test_pipeline_with_job_queue():
+    """--pipeline 与 --queue 同用：读取线程记录任务开始，结果在主线程中记录"""
+    from merge_jobqueue import JobQueue
+
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder, count=3)
+        with open(os.path.join(folder, "1测试发票.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4 broken")
+        out_dir = os.path.join(folder, "已合并")
+
+        assert merge_invoices.main([folder, "--pipeline", "--queue"]) == 0
+        assert sorted(os.listdir(out_dir)) == ["0测试发票已合并.pdf", "2测试发票已合并.pdf", "合并任务.sqlite"]
+        with JobQueue(os.path.join(out_dir, "合并任务.sqlite")) as queue:
+            counts = queue.counts()
+            print(f"任务表状态: {counts}")
+            assert counts == {"pending": 0, "running": 0, "done": 2, "failed": 1}
+
+
+def _square(x):
+    return x * x
+
+
+def _hang(seconds):
+    time.sleep(seconds)
+
+
+def _crash():
+    os._exit(3)
+
+
+def _allocate(size):
+    return len(bytearray(size))
+
+
+def test_sandbox_isolates_crash_and_timeout():
+    """工作进程崩溃或超时只影响当前任务，进程被替换后后续任务照常完成"""
+    from merge_sandbox import JobTimeout, SandboxPool, WorkerCrashed
+
+    with SandboxPool(max_workers=2, timeout=2) as pool:
+        crashed = pool.submit(_crash)
+        hung = pool.submit(_hang, 60)
+        normal = [pool.submit(_square, i) for i in range(4)]
+
+        start = time.perf_counter()
+        assert [f.result() for f in normal] == [0, 1, 4, 9]
+        errors = [crashed.exception(), hung.exception()]
+        elapsed = time.perf_counter() - start
+        print(f"崩溃: {errors[0]}，超时: {errors[1]}，用时 {elapsed:.1f}s，替换进程 {pool.replaced} 个")
+        assert isinstance(errors[0], WorkerCrashed) and isinstance(errors[1], JobTimeout)
+        assert elapsed < 30
+        assert pool.submit(_square, 5).result() == 25
+
+
+def _fail_slowly(job):
+    time.sleep(0.6)
+    raise ValueError(job["name"])
+
+
+def test_scheduler_samples_workers_from_start():
+    """SandboxPool 的工作进程一启动就被采样（第一批任务尚未完成、任务失败时也一样），被替换的进程不再计入"""
+    from merge_sandbox import SandboxPool
+
+    sampled = set()
+
+    def rss_reader(pid):
+        sampled.add(pid)
+        return 100
+
+    jobs = [{"name": f"job{i}", "estimate": 100} for i in range(2)]
+    with merge_scheduler.MemoryBoundedScheduler(memory_budget=1000, max_workers=2,
+                                                executor_factory=lambda n: SandboxPool(n, timeout=30),
+                                                rss_reader=rss_reader) as scheduler:
+        errors = [future.exception() for _, future in scheduler.run(jobs, _fail_slowly)]
+        workers = set(scheduler._executor.worker_pids())
+        print(f"采样的进程: {sampled}，工作进程: {workers}")
+        assert all(isinstance(error, ValueError) for error in errors)
+        assert len(workers) == 2 and workers <= sampled and scheduler.worker_pids == workers
+
+
+def test_sandbox_memory_limit():
+    """设置内存上限后，超出的任务以 MemoryError 失败，工作进程继续可用"""
+    try:
+        import resource  # noqa: F401
+    except ImportError:
+        print("当前平台不支持 rlimit，跳过")
+        return
+    if sys.platform != "linux":
+        print("RLIMIT_AS 仅在 Linux 上可靠生效，跳过")
+        return
+
+    from merge_sandbox import SandboxPool
+
+    with SandboxPool(max_workers=1, timeout=30, memory_limit=1024 * 1024 * 1024) as pool:
+        error = pool.submit(_allocate, 4 * 1024 * 1024 * 1024).exception()
+        print(f"超出内存上限: {error!r}")
+        assert isinstance(error, MemoryError)
+        assert pool.submit(_allocate, 1024).result() == 1024
+
+
+def test_main_survives_bad_pdf():
+    """批量合并中一个异常 PDF 只让该文件组失败，其余照常生成"""
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder, count=3)
+        with open(os.path.join(folder, "1测试发票.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4 broken")
+        assert merge_invoices.main([folder, "--job-timeout", "60"]) == 0
+        outputs = sorted(os.listdir(os.path.join(folder, "已合并")))
+        print(f"输出: {outputs}")
+        assert outputs == ["0测试发票已合并.pdf", "2测试发票已合并.pdf"]
+
+
+def test_pipeline_stage_summary():
+    """流水线模式生成全部输出，每个阶段都处理了每套文件，异常文件组只让自身失败"""
+    from merge_pipeline import MergePipeline, format_stage_summary
+
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder, count=3)
+        assert merge_invoices.main([folder, "--pipeline", "--queue-depth", "1"]) == 0
+        assert len(os.listdir(os.path.join(folder, "已合并"))) == 3
+
+        jobs = []
+        for i in range(4):
+            files = make_sample_triplet(folder, f"流水线{i}")
+            jobs.append({"key": f"流水线{i}", **files, "out_path": os.path.join(folder, f"流水线{i}已合并.pdf")})
+        jobs[2]["buy"] = os.path.join(folder, "不存在.jpg")
+        pipeline = MergePipeline(queue_depths=(1, 1, 1), render_threads=2)
+        results = {job["key"]: error for job, _, error in pipeline.run(jobs)}
+        print("\n".join(format_stage_summary(pipeline.summary(), pipeline.elapsed)))
+        assert [key for key, error in results.items() if error] == ["流水线2"]
+        assert len(results) == 4
+        items = {s["stage"]: s["items"] for s in pipeline.summary()}
+        assert items == {"read": 4, "render": 3, "compose": 3, "encode": 3}
+        assert all(0 <= s["utilization"] <= 1 for s in pipeline.summary())
+
+
+def test_pipeline_reraises_thread_errors():
+    """任务迭代器或 on_stage 抛出异常时 run() 不会卡住：已进入流水线的文件组照常产出，之后重新抛出异常"""
+    import threading
+
+    from merge_pipeline import MergePipeline
+
+    with tempfile.TemporaryDirectory() as folder:
+        jobs = []
+        for i in range(2):
+            files = make_sample_triplet(folder, f"出错{i}")
+            jobs.append({"key": f"出错{i}", **files, "out_path": os.path.join(folder, f"出错{i}已合并.pdf")})
+
+        def broken_scan():
+            yield jobs[0]
+            raise OSError("共享目录断开")
+
+        def broken_stage(job, stage):
+            if stage == "compose":
+                raise RuntimeError("记录失败")
+
+        for source, on_stage, expected in ((broken_scan(), None, OSError), (jobs, broken_stage, RuntimeError)):
+            outcome = {}
+
+            def consume():
+                try:
+                    outcome["keys"] = [job["key"] for job, _, _ in MergePipeline(on_stage=on_stage).run(source)]
+                except Exception as e:
+                    outcome["error"] = e
+
+            thread = threading.Thread(target=consume, daemon=True)
+            thread.start()
+            thread.join(60)
+            print(f"结果: {outcome}")
+            assert not thread.is_alive(), "run() 没有返回"
+            assert isinstance(outcome.get("error"), expected)
+        assert os.path.exists(jobs[0]["out_path"])
+
+
+def test_prefetch_budget_and_order():
+    """预读按原顺序交付完整数据，缓冲不超过预算（加一个文件组），读取失败时保留原路径"""
+    from merge_prefetch import Prefetcher
+
+    with tempfile.TemporaryDirectory() as folder:
+        jobs = []
+        for i in range(5):
+            files = make_sample_triplet(folder, f"预读{i}")
+            jobs.append({"key": f"预读{i}", **files})
+        jobs[3]["pay"] = os.path.join(folder, "不存在.png")
+        largest = max(sum(os.path.getsize(job[k]) for k in ("pdf", "buy", "pay")) for job in jobs if job["key"] != "预读3")
+
+        prefetcher = Prefetcher(budget=largest, threads=2, chunk_size=4096)
+        seen = []
+        for job in prefetcher.iter_jobs(jobs):
+            seen.append(job["key"])
+            if job["key"] == "预读3":
+                assert isinstance(job["pdf"], str)
+                continue
+            with open(job["prefetched"]["buy"], "rb") as f:
+                assert job["buy"] == f.read()
+            prefetcher.release(job)
+            assert os.path.isfile(job["buy"])
+        stats = prefetcher.summary()
+        print(f"预读统计: {stats}")
+        assert seen == [job["key"] for job in jobs]
+        assert stats["errors"] == 1 and prefetcher.reserved == 0
+        assert stats["peak_buffered_bytes"] <= 2 * largest
+
+        make_sample_folder(folder, count=2)
+        assert merge_invoices.main([folder, "--prefetch", "1M"]) == 0
+        assert {"0测试发票已合并.pdf", "1测试发票已合并.pdf"} <= set(os.listdir(os.path.join(folder, "已合并")))
+
+
+def test_progress_events_and_cancel():
+    """进度事件带预计剩余时间；取消后不再开始新的文件组，返回 EXIT_CANCELLED"""
+    from merge_progress import CancelToken
+
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder)
+        events = []
+        assert merge_invoices.main([folder, "--in-process"], progress=events.append) == 0
+        kinds = [e["event"] for e in events]
+        print(f"事件: {kinds}")
+        assert kinds[0] == "batch_started" and kinds[-1] == "batch_finished"
+        finished = [e for e in events if e["event"] == "triplet_finished"]
+        assert len(finished) == 4 and all(e["eta"] is not None for e in finished)
+        assert {e["stage"] for e in events if e["event"] == "stage_done"} >= {"render", "compose", "encode", "write"}
+        assert finished[-1]["done"] == 4 and finished[-1]["eta"] == 0
+
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder)
+        token = CancelToken()
+        events = []
+
+        def on_progress(event):
+            events.append(event)
+            if event["event"] == "triplet_finished":
+                token.cancel()
+
+        code = merge_invoices.main([folder, "--in-process"], progress=on_progress, cancel=token)
+        outputs = os.listdir(os.path.join(folder, "已合并"))
+        print(f"取消后输出: {outputs}")
+        assert code == merge_invoices.EXIT_CANCELLED
+        assert len([name for name in outputs if name.endswith(".pdf")]) == 1
+        assert events[-1]["event"] == "batch_finished" and events[-1]["cancelled"]
+
+
+def test_cancel_from_other_thread():
+    """在其他线程中取消（如界面的停止按钮）：隔离进程模式下已预取的下一套不再开始；
+    开启预读时，预读窗口中已读入的文件组同样不再开始"""
+    from merge_progress import CancelToken
+
+    for extra in ([], ["--prefetch", "256M"], ["--in-process", "--prefetch", "256M"]):
+        with tempfile.TemporaryDirectory() as folder:
+            make_sample_folder(folder)
+            token = CancelToken()
+            timers = []
+
+            def on_progress(event):
+                # 第一套开始处理后由另一个线程取消，此时该套仍在处理中
+                if event["event"] == "triplet_started" and not timers:
+                    timers.append(threading.Timer(0.05, token.cancel))
+                    timers[0].start()
+
+            code = merge_invoices.main([folder] + extra, progress=on_progress, cancel=token)
+            outputs = [name for name in os.listdir(os.path.join(folder, "已合并")) if name.endswith(".pdf")]
+            print(f"{extra}: 取消后输出 {outputs}")
+            assert code == merge_invoices.EXIT_CANCELLED
+            assert len(outputs) == 1
+
+
+def test_pipeline_cancel_drops_queued_jobs():
+    """流水线模式取消后，已读入、排在阶段队列中的文件组不再合成和写出，记为取消，任务表中恢复为待处理"""
+    from merge_jobqueue import JobQueue
+    from merge_progress import CancelToken
+
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder)
+        token = CancelToken()
+        started = []
+
+        def on_progress(event):
+            if event["event"] == "triplet_started":
+                started.append(event["key"])
+            # 第一套渲染完成时（在渲染线程中）取消，此时后面的文件组已在队列中
+            if event["event"] == "stage_done" and event["stage"] == "render":
+                token.cancel()
+
+        report_path = os.path.join(folder, "run.json")
+        code = merge_invoices.main([folder, "--pipeline", "--queue", "--report", report_path],
+                                   progress=on_progress, cancel=token)
+        out_dir = os.path.join(folder, "已合并")
+        outputs = [name for name in os.listdir(out_dir) if name.endswith(".pdf")]
+        with open(report_path, encoding="utf-8") as f:
+            counts = json.load(f)["summary"]["counts"]
+        with JobQueue(os.path.join(out_dir, "合并任务.sqlite")) as queue:
+            states = queue.counts()
+        print(f"已开始 {started}，输出 {outputs}，报告 {counts}，任务表 {states}")
+        assert code == merge_invoices.EXIT_CANCELLED
+        assert len(started) >= 2 and outputs == []
+        assert counts["cancelled"] == 4 and counts["done"] == 0 and counts["failed"] == 0
+        assert states["pending"] == 4
+
+
+def test_shards_cover_batch_once():
+    """本地多进程模拟多台机器：各分片互不重叠地覆盖全部文件组，合并步骤汇总各分片记录"""
+    import csv
+    import subprocess
+
+    from merge_shards import shard_of
+
+    keys = [f"{i}测试发票" for i in range(200)]
+    assert [shard_of(k, 4) for k in keys] == [shard_of(k, 4) for k in keys]
+    assert set(shard_of(k, 4) for k in keys) == {1, 2, 3, 4}
+
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder, count=6)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "merge_invoices.py")
+        procs = [subprocess.Popen([sys.executable, script, folder, "--shard", f"{k}/3"],
+                                  stdout=subprocess.DEVNULL) for k in (1, 2, 3)]
+        assert [p.wait() for p in procs] == [0, 0, 0]
+
+        out_dir = os.path.join(folder, "已合并")
+        assert len([name for name in os.listdir(out_dir) if name.endswith(".pdf")]) == 6
+        assert merge_invoices.main([folder, "--merge-shards"]) == 0
+
+        shard_dir = os.path.join(out_dir, "分片")
+        with open(os.path.join(shard_dir, "汇总.summary.json"), encoding="utf-8") as f:
+            report = json.load(f)
+        with open(os.path.join(shard_dir, "汇总.csv"), encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+        print(f"分片汇总: {report['counts']}，记录 {len(rows)} 条")
+        assert report["missing"] == [] and report["counts"]["done"] == 6
+        assert sorted(row["文件组"] for row in rows) == sorted(f"{i}测试发票" for i in range(6))
+
+
+def test_run_report_and_metrics():
+    """--report / --metrics：每套文件的状态、用时、大小、布局与错误，汇总吞吐；指标为 Prometheus 文本格式"""
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder, count=3)
+        with open(os.path.join(folder, "1测试发票.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4 broken")
+        with open(os.path.join(folder, "9不齐全.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4")
+        report_path = os.path.join(folder, "报告", "run.json")
+        metrics_path = os.path.join(folder, "invoice_merge.prom")
+
+        def no_parse_in_main_process(job, dpi=None):
+            raise AssertionError("布局应由工作进程随结果返回，主进程不应再次解析 PDF")
+
+        original, merge_invoices.plan_triplet = merge_invoices.plan_triplet, no_parse_in_main_process
+        try:
+            assert merge_invoices.main([folder, "--workers", "2", "--report", report_path,
+                                        "--metrics", metrics_path]) == 0
+        finally:
+            merge_invoices.plan_triplet = original
+
+        with open(report_path, encoding="utf-8") as f:
+            report = json.load(f)
+        triplets = {entry["key"]: entry for entry in report["triplets"]}
+        print(f"汇总: {report['summary']}")
+        assert report["summary"]["counts"]["done"] == 2 and report["summary"]["counts"]["failed"] == 1
+        assert triplets["9不齐全"]["status"] == "incomplete" and triplets["9不齐全"]["missing"] == ["buy", "pay"]
+        assert triplets["1测试发票"]["error"] and triplets["1测试发票"]["seconds"] >= 0
+        done = triplets["0测试发票"]
+        assert done["size"] == os.path.getsize(os.path.join(folder, "已合并", "0测试发票已合并.pdf"))
+        assert done["layout"] in ("horizontal", "vertical") and set(done["rotate"]) == {"invoice", "buy", "pay"}
+        assert report["summary"]["triplets_per_second"] > 0 and report["exit_code"] == 0
+
+        with open(metrics_path, encoding="utf-8") as f:
+            metrics = f.read()
+        assert 'invoice_merge_run_triplets{root="%s",status="done"} 2' % folder in metrics
+        assert "# TYPE invoice_merge_run_triplet_seconds summary" in metrics
+        assert not os.path.exists(metrics_path + ".part")
+
+
+def test_profile_sampled_jobs():
+    """--profile / --trace-memory：每 N 套抽样 1 套，在工作进程中写出 .prof、耗时摘要与内存摘要"""
+    with tempfile.TemporaryDirectory() as folder:
+        make_sample_folder(folder, count=4)
+        diagnostics = os.path.join(folder, "诊断")
+        assert merge_invoices.main([folder, "--profile", "--trace-memory", "--profile-every", "2",
+                                    "--diagnostics-dir", diagnostics]) == 0
+
+        names = sorted(os.listdir(diagnostics))
+        print(f"诊断文件: {names}")
+        assert names == [f"{key}测试发票{ext}" for key in (0, 2) for ext in (".memory.txt", ".prof", ".profile.txt")]
+        with open(os.path.join(diagnostics, "0测试发票.profile.txt"), encoding="utf-8") as f:
+            profile = f.read()
+        assert "fit_into" in profile and "render_first_page" in profile
+        with open(os.path.join(diagnostics, "0测试发票.memory.txt"), encoding="utf-8") as f:
+            memory = f.read()
+        assert "Python 分配峰值" in memory and "阶段结束" in memory
+        assert len(os.listdir(os.path.join(folder, "已合并"))) >= 4
+
+        try:
+            merge_invoices.parse_args([folder, "--pipeline", "--profile"])
+        except SystemExit:
+            pass
+        else:
+            raise AssertionError("--profile 与 --pipeline 应当不能同时使用")
+
+
+if __name__ == "__main__":
+    test_estimate_grows_with_dpi()
+    test_scheduler_respects_budget()
+    test_scheduler_reduces_concurrency_when_over_budget()
+    test_largest_first_and_key_order()
+    test_cost_grows_with_pixels()
+    test_main_with_workers()
+    test_plan_mode()
+    test_recursive_index()
+    test_job_queue_resume()
+    test_pipeline_with_job_queue()
+    test_sandbox_isolates_crash_and_timeout()
+    test_scheduler_samples_workers_from_start()
+    test_sandbox_memory_limit()
+    test_main_survives_bad_pdf()
+    test_pipeline_stage_summary()
+    test_pipeline_reraises_thread_errors()
+    test_prefetch_budget_and_order()
+    test_progress_events_and_cancel()
+    test_cancel_from_other_thread()
+    test_pipeline_cancel_drops_queued_jobs()
+    test_shards_cover_batch_once()
+    test_run_report_and_metrics()
+    test_profile_sampled_jobs()
+    print("✅ 测试完成")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+图形界面响应测试脚本
+合并过程中界面事件循环每 10 毫秒运行一次心跳，验证两次心跳之间的间隔始终很短（界面不会“未响应”）。
+需要图形显示环境，没有显示器时跳过；启动探针测试在没有显示器时只检查导入阶段。
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_merge_core import make_sample_triplet
+
+HEARTBEAT_MS = 10
+MAX_BLOCK_SECONDS = 0.25
+
+
+def _skip(reason: str) -> None:
+    print(f"跳过: {reason}")
+    if "pytest" in sys.modules:
+        import pytest
+        pytest.skip(reason)
+
+
+def test_stable_merge_keeps_ui_responsive():
+    """稳定版合并在后台线程中进行，事件循环阻塞不超过 MAX_BLOCK_SECONDS"""
+    import tkinter as tk
+    from tkinter import filedialog, messagebox
+
+    try:
+        tk.Tk().destroy()
+    except tk.TclError as e:
+        _skip(f"没有图形显示环境（{e}）")
+        return
+
+    import invoice_merger_v5_stable as stable
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder, "响应测试")
+        output_path = os.path.join(folder, "合并.pdf")
+
+        patched = [(filedialog, "asksaveasfilename", lambda **kw: output_path),
+                   (messagebox, "askyesno", lambda *a, **kw: False),
+                   (messagebox, "showerror", lambda *a, **kw: None),
+                   (stable.SimpleInvoiceMergerV5, "get_csv_path",
+                    lambda self: os.path.join(folder, "发票汇总记录.csv"))]
+        originals = [(obj, name, getattr(obj, name)) for obj, name, _ in patched]
+        for obj, name, value in patched:
+            setattr(obj, name, value)
+        try:
+            app = stable.SimpleInvoiceMergerV5()
+            app.pdf_file = files["pdf"]
+            app.image_files = [files["buy"], files["pay"]]
+
+            gaps = []
+            finished = []
+            last = [time.perf_counter()]
+
+            def heartbeat():
+                now = time.perf_counter()
+                gaps.append(now - last[0])
+                last[0] = now
+                if app.merging or not gaps[1:]:
+                    app.root.after(HEARTBEAT_MS, heartbeat)
+                else:
+                    finished.append(app.status_label.cget("text"))
+                    app.root.quit()
+
+            def start():
+                last[0] = time.perf_counter()
+                app.merge_files()
+                app.root.after(HEARTBEAT_MS, heartbeat)
+
+            app.root.after(0, start)
+            app.root.after(120 * 1000, app.root.quit)
+            app.root.mainloop()
+            app.root.destroy()
+        finally:
+            for obj, name, value in originals:
+                setattr(obj, name, value)
+
+        worst = max(gaps)
+        print(f"心跳 {len(gaps)} 次，最长间隔 {worst * 1000:.0f} ms，结果：{finished}")
+        assert finished == ["✅ 合并成功！"] and os.path.getsize(output_path) > 0
+        assert worst < MAX_BLOCK_SECONDS
+
+
+def test_startup_probe():
+    """启动探针：无人值守启动稳定版并记录各阶段时间；没有图形显示时也能测到导入时间"""
+    import check_startup
+
+    report = check_startup.measure(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                "invoice_merger_v5_stable.py"), repeat=1)
+    run = report["runs"][0]
+    print(f"启动: {run}")
+    assert not run.get("error") and 0 < run["import"] <= run["exit"]
+    assert run.get("window") or run.get("window_error")
+    assert check_startup.compare({"import": 0.30}, {"import": 0.20}, 0.25)
+    assert not check_startup.compare({"import": 0.22}, {"import": 0.20}, 0.25)
+
+
+if __name__ == "__main__":
+    test_stable_merge_keeps_ui_responsive()
+    test_startup_probe()
+    print("✅ 测试完成")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+批量队列测试脚本
+验证文件夹与多选文件的自动分组（命名规则、修改时间就近），以及后台批量合并与输出命名
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import invoice_batch
+from test_merge_core import make_sample_triplet
+
+
+def make_unnamed_triplet(folder: str, name: str, mtime: float) -> dict:
+    """生成不符合命名规则的一套文件，并把三个文件的修改时间设为 mtime 附近"""
+    files = make_sample_triplet(folder, f"tmp{name}")
+    renamed = {}
+    for offset, (kind, ext) in enumerate((("pdf", ".pdf"), ("buy", "a.jpg"), ("pay", "b.png"))):
+        path = os.path.join(folder, f"{name}{ext}")
+        os.replace(files[kind], path)
+        os.utime(path, (mtime + offset * 10, mtime + offset * 10))
+        renamed[kind] = path
+    return renamed
+
+
+def test_group_triplets():
+    """命名规则优先；其余文件按修改时间就近组合，相差过大的文件留作未分组"""
+    with tempfile.TemporaryDirectory() as folder:
+        sub = os.path.join(folder, "子目录")
+        os.makedirs(os.path.join(folder, "已合并"))
+        os.makedirs(sub)
+        named = make_sample_triplet(folder, "1开发板19.9")
+        nested = make_sample_triplet(sub, "2键盘99")
+        make_sample_triplet(os.path.join(folder, "已合并"), "不应出现")
+
+        now = time.time()
+        first = make_unnamed_triplet(folder, "发票A", now - 7200)
+        second = make_unnamed_triplet(folder, "发票B", now - 3600)
+        stray = os.path.join(folder, "孤立截图.jpg")
+        os.replace(make_sample_triplet(folder, "tmp孤立")["buy"], stray)
+        os.utime(stray, (now, now))
+        for path in os.listdir(folder):
+            if path.startswith("tmp"):
+                os.remove(os.path.join(folder, path))
+
+        groups, leftovers = invoice_batch.group_triplets([folder])
+        print(f"分组: {[(g['key'], g['method']) for g in groups]}，未分组: {[os.path.basename(p) for p in leftovers]}")
+        by_key = {g["key"]: g for g in groups}
+        assert sorted(by_key) == ["1开发板19.9", "2键盘99", "发票A", "发票B"]
+        assert by_key["1开发板19.9"]["method"] == "命名" and by_key["1开发板19.9"]["pay"] == named["pay"]
+        assert by_key["2键盘99"]["buy"] == nested["buy"]
+        assert (by_key["发票A"]["buy"], by_key["发票A"]["pay"]) == (first["buy"], first["pay"])
+        assert by_key["发票B"]["method"] == "时间" and by_key["发票B"]["pay"] == second["pay"]
+        assert leftovers == [stray]
+
+
+def test_batch_runner_outputs():
+    """后台批量合并：输出不重名、异常 PDF 只让该组失败、汇总回调只在主进程中调用"""
+    with tempfile.TemporaryDirectory() as folder:
+        groups = []
+        for name in ("甲", "乙", "丙"):
+            files = make_sample_triplet(folder, name)
+            groups.append({"key": name, **files, "method": "命名"})
+        with open(groups[1]["pdf"], "wb") as f:
+            f.write(b"%PDF-1.4 broken")
+        groups.append(dict(groups[0], key="甲-重复"))
+
+        out_dir = os.path.join(folder, "输出")
+        updates = []
+        runner = invoice_batch.BatchMergeRunner(groups, out_dir, workers=2,
+                                                on_update=lambda i, status, info: updates.append((i, status)))
+        results = runner.start()
+        results.join(timeout=120)
+        statuses = {i: r["status"] for i, r in runner.results.items()}
+        print(f"状态: {statuses}，输出: {sorted(os.listdir(out_dir))}")
+        assert statuses == {0: "完成", 1: "失败", 2: "完成", 3: "完成"}
+        assert sorted(os.listdir(out_dir)) == ["丙_已合并.pdf", "甲_已合并.pdf", "甲_已合并_2.pdf"]
+        assert all((i, "处理中") in updates for i in range(4))
+
+
+if __name__ == "__main__":
+    test_group_triplets()
+    test_batch_runner_outputs()
+    print("✅ 测试完成")
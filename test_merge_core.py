@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+合并核心功能测试脚本
+使用临时生成的发票/记录图片，验证合成与编码流程
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+
+import merge_invoices
+
+
+def make_sample_triplet(folder: str, base: str = "1开发板19.9") -> dict:
+    """生成一套测试用的 发票PDF + 购买记录 + 支付记录"""
+    invoice = Image.effect_noise((1240, 800), 40).convert("RGB")
+    pdf_path = os.path.join(folder, f"{base}.pdf")
+    invoice.save(pdf_path, format="PDF", resolution=150)
+
+    buy_path = os.path.join(folder, f"{base}购买记录.jpg")
+    Image.effect_noise((1080, 2340), 50).convert("RGB").save(buy_path, quality=90)
+
+    pay_path = os.path.join(folder, f"{base}支付记录.png")
+    Image.new("RGB", (1080, 1920), (40, 160, 90)).save(pay_path)
+
+    return {"pdf": pdf_path, "buy": buy_path, "pay": pay_path}
+
+
+def test_max_bytes_search():
+    """--max-bytes：输出不超过预算，并记录所选参数"""
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder)
+        out_path = os.path.join(folder, "out.pdf")
+
+        budget = 400 * 1024
+        params = merge_invoices.merge_to_output(files["pdf"], files["buy"], files["pay"], out_path, max_bytes=budget)
+
+        size = os.path.getsize(out_path)
+        print(f"预算 {budget}，实际 {size}，参数 {params}")
+        assert params["fits"]
+        assert size == params["size"] <= budget
+        assert merge_invoices.MIN_JPEG_QUALITY <= params["quality"] <= merge_invoices.MAX_JPEG_QUALITY
+
+
+def test_max_bytes_reuses_canvas():
+    """放宽预算时选用更高的质量/分辨率"""
+    canvas = Image.effect_noise((1240, 1754), 60).convert("RGB")
+    _, tight = merge_invoices.encode_pdf_within_budget(canvas, 150 * 1024, dpi=150)
+    _, loose = merge_invoices.encode_pdf_within_budget(canvas, 2 * 1024 * 1024, dpi=150)
+    print(f"紧预算 {tight}\n宽预算 {loose}")
+    assert (loose["scale"], loose["quality"]) >= (tight["scale"], tight["quality"])
+    assert loose["scale"] == 1.0
+
+
+def test_resample_strategies():
+    """各缩放档位输出尺寸一致，且与 best 的差异在可接受范围内"""
+    from PIL import ImageChops, ImageStat
+
+    source = Image.linear_gradient("L").resize((1080, 2340)).convert("RGB")
+    target = (270, 585)
+    reference = merge_invoices.resize_image(source, target, "best")
+    for strategy in merge_invoices.RESAMPLE_STRATEGIES:
+        result = merge_invoices.resize_image(source, target, strategy)
+        assert result.size == target
+        mean = sum(ImageStat.Stat(ImageChops.difference(result, reference)).mean) / 3
+        print(f"{strategy}: 平均误差 {mean:.2f}")
+        assert mean < 3
+
+
+def test_rotate_after_downscale():
+    """先缩放后转置，与先 rotate(90) 再缩放的结果在容差内一致"""
+    from PIL import ImageChops, ImageStat
+
+    source = Image.linear_gradient("L").resize((3000, 1200)).convert("RGB")
+    expected = merge_invoices.fit_into(source.rotate(90, expand=True), 600, 900)
+    result = merge_invoices.fit_into(source, 600, 900, rotate=True)
+    assert result.size == expected.size
+    mean = sum(ImageStat.Stat(ImageChops.difference(result, expected)).mean) / 3
+    print(f"旋转结果尺寸 {result.size}，平均误差 {mean:.3f}")
+    assert mean < 1
+
+
+def test_parse_byte_size():
+    assert merge_invoices.parse_byte_size("1M") == 1024 * 1024
+    assert merge_invoices.parse_byte_size("800KB") == 800 * 1024
+    assert merge_invoices.parse_byte_size("12345") == 12345
+
+
+def test_in_memory_sources():
+    """bytes、memoryview、文件对象作为输入与路径输入的结果一致；可直接写入流"""
+    import io
+
+    from PIL import ImageChops
+
+    from merge_invoices_simple import merge_simple
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder)
+        expected, _ = merge_invoices.merge_in_memory(files["pdf"], files["buy"], files["pay"])
+
+        with open(files["pdf"], "rb") as f:
+            pdf_bytes = f.read()
+        with open(files["buy"], "rb") as f:
+            buy_view = memoryview(f.read())
+        with open(files["pay"], "rb") as pay_file:
+            data, _ = merge_invoices.merge_in_memory(pdf_bytes, buy_view, pay_file)
+        # PDF 中含生成时间，比较渲染结果而不是字节
+        rendered = [merge_invoices.render_invoice_first_page_as_image(pdf, dpi=36) for pdf in (data, expected)]
+        assert ImageChops.difference(*rendered).getbbox() is None
+
+        stream = io.BytesIO()
+        with open(files["pdf"], "rb") as pdf_file:
+            params = merge_invoices.merge_to_stream(pdf_file, bytearray(buy_view), files["pay"], stream,
+                                                    max_bytes=300 * 1024)
+        print(f"内存合并 {len(data)} 字节，限制大小后写入流 {stream.tell()} 字节")
+        assert stream.getvalue().startswith(b"%PDF") and stream.tell() == params["size"] <= 300 * 1024
+
+        out = io.BytesIO()
+        merge_simple(pdf_bytes, buy_view, files["pay"], out)
+        assert out.getvalue().startswith(b"%PDF")
+
+
+def test_preview_matches_full_layout():
+    """低分辨率预览选出的布局与全分辨率合并相同；缩略图按文件缓存；后台预览只回调最新请求；渲染时持有 pdfium 锁"""
+    import threading
+    import time
+
+    from merge_engine import get_optimal_layout, render_first_page
+    from merge_preview import PreviewWorker, ThumbnailCache, render_preview
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder)
+        # 横向截图，使布局选择需要旋转
+        Image.effect_noise((2340, 1080), 50).convert("RGB").save(files["buy"], quality=90)
+
+        cache = ThumbnailCache()
+        start = time.perf_counter()
+        preview, layout = render_preview(files["pdf"], files["buy"], files["pay"], cache=cache)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        render_preview(files["pdf"], files["buy"], files["pay"], cache=cache)
+        warm = time.perf_counter() - start
+        print(f"预览 {preview.size}：首次 {cold * 1000:.0f} ms，缓存后 {warm * 1000:.0f} ms，布局 {layout['orientations']}")
+
+        invoice = render_first_page(files["pdf"], dpi=300)
+        with Image.open(files["buy"]) as buy, Image.open(files["pay"]) as pay:
+            expected = get_optimal_layout(invoice.size, buy.size, pay.size)
+        assert layout == expected
+        assert preview.size == (297, 420)
+        assert cache.misses == 3 and cache.hits == 3
+
+        results = []
+        done = threading.Event()
+        worker = PreviewWorker(cache=cache)
+
+        def callback(image, layout, error, seconds):
+            results.append((image.size, error))
+            done.set()
+
+        worker.request(files["pdf"], files["buy"], files["pay"], callback)
+        worker.request(files["pdf"], files["pay"], files["buy"], callback)
+        assert done.wait(10)
+        time.sleep(0.2)
+        assert results[-1] == ((297, 420), None) and len(results) <= 2
+
+        # 其他线程（如界面中的数据提取）持有 pdfium 锁时，预览渲染等待而不是同时使用 pdfium
+        from merge_engine import PDFIUM_LOCK
+        from merge_preview import load_invoice_thumbnail
+
+        rendered = threading.Event()
+
+        def render_thumbnail():
+            load_invoice_thumbnail(files["pdf"])
+            rendered.set()
+
+        with PDFIUM_LOCK:
+            threading.Thread(target=render_thumbnail, daemon=True).start()
+            assert not rendered.wait(0.3)
+        assert rendered.wait(10)
+
+
+def test_extraction_worker_supersedes():
+    """连续请求只提取最后一个；进行中的旧结果被丢弃；同一时刻只有一个提取在进行"""
+    import threading
+    import time
+
+    from invoice_extract import ExtractionWorker
+
+    calls = []
+    active = [0, 0]
+    lock = threading.Lock()
+
+    def slow_extract(path):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        calls.append(path)
+        time.sleep(0.2)
+        with lock:
+            active[0] -= 1
+        if path == "坏.pdf":
+            raise ValueError("无法解析")
+        return {"file_path": path}
+
+    results = []
+    delivered = threading.Event()
+
+    def callback(generation, data, error):
+        results.append((generation, data, error))
+        delivered.set()
+
+    worker = ExtractionWorker(slow_extract, delay=0.05)
+    for name in ("一.pdf", "二.pdf", "三.pdf"):
+        last = worker.request(name, callback)
+    assert delivered.wait(5)
+    print(f"去抖: 提取 {calls}，回调 {results}")
+    assert calls == ["三.pdf"] and results == [(last, {"file_path": "三.pdf"}, None)]
+
+    calls.clear()
+    results.clear()
+    delivered.clear()
+    worker.request("旧.pdf", callback, delay=0)
+    time.sleep(0.1)
+    last = worker.request("坏.pdf", callback, delay=0)
+    assert delivered.wait(5)
+    time.sleep(0.3)
+    print(f"取代: 提取 {calls}，回调 {[(g, d, str(e)) for g, d, e in results]}，最大并发 {active[1]}")
+    assert calls == ["旧.pdf", "坏.pdf"] and len(results) == 1
+    assert results[0][0] == last and isinstance(results[0][2], ValueError)
+    assert active[1] == 1
+
+    calls.clear()
+    results.clear()
+    worker.request("取消.pdf", callback)
+    worker.cancel()
+    time.sleep(0.3)
+    assert calls == [] and results == []
+
+
+def test_single_engine():
+    """命令行与简化版（图形界面）使用同一引擎：结果一致；阶段钩子覆盖两者；可替换布局；分发包中的副本与源码一致"""
+    import io
+
+    from PIL import ImageChops
+
+    import merge_engine
+    from merge_invoices_simple import merge_simple
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    stages = []
+
+    def hook(stage, seconds):
+        stages.append(stage)
+
+    merge_engine.add_stage_hook(hook)
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            files = make_sample_triplet(folder)
+            cli, _ = merge_invoices.merge_in_memory(files["pdf"], files["buy"], files["pay"])
+            gui = io.BytesIO()
+            merge_simple(files["pdf"], files["buy"], files["pay"], gui)
+            rendered = [merge_engine.render_first_page(pdf, dpi=36) for pdf in (cli, gui.getvalue())]
+            assert ImageChops.difference(*rendered).getbbox() is None
+            assert stages == list(merge_engine.STAGE_NAMES) * 2
+
+            def stacked(invoice_size, buy_size, pay_size, dpi):
+                _, _, _, w, h = merge_engine.page_geometry(dpi)
+                third = h // 3
+                return {"type": "stacked", "invoice_area": (0, 0, w, third), "buy_area": (0, third, w, third),
+                        "pay_area": (0, third * 2, w, third),
+                        "orientations": {"invoice_rotate": False, "buy_rotate": False, "pay_rotate": False}}
+
+            merge_engine.register_backend("layout", "stacked", stacked)
+            data, _ = merge_engine.MergeEngine(layout="stacked").merge(files["pdf"], files["buy"], files["pay"])
+            assert data.startswith(b"%PDF")
+    finally:
+        merge_engine.remove_stage_hook(hook)
+
+    for name in ("merge_engine.py", "merge_invoices_simple.py"):
+        with open(os.path.join(root, name), "rb") as a, \
+                open(os.path.join(root, "发票合并工具v5稳定版_完整分发包", name), "rb") as b:
+            assert a.read() == b.read(), f"分发包中的 {name} 与源码不一致，请重新复制"
+
+
+def test_engine_dpi_keeps_a4_page():
+    """非默认 dpi 的引擎：渲染、合成与编码使用同一 dpi，输出页面仍为 A4（595×842 pt）"""
+    import pypdfium2 as pdfium
+
+    import merge_engine
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder)
+        for dpi in (150, merge_engine.PAGE_DPI):
+            data, _ = merge_engine.MergeEngine(dpi=dpi).merge(files["pdf"], files["buy"], files["pay"])
+            width, height = pdfium.PdfDocument(data)[0].get_size()
+            print(f"{dpi} DPI: {width:.1f} × {height:.1f} pt")
+            assert (round(width), round(height)) == (595, 842)
+
+
+def test_library_diagnostics():
+    """库调用方可对单次 merge_in_memory / merge_to_stream 开启诊断，诊断文件按 diagnostics_key 命名"""
+    import io
+
+    from merge_profiling import DiagnosticsSampler
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_sample_triplet(folder)
+        out_dir = os.path.join(folder, "诊断")
+        options = DiagnosticsSampler(out_dir, profile=True, trace_memory=True).options()
+        with open(files["pdf"], "rb") as f:
+            pdf_bytes = f.read()
+        merge_invoices.merge_in_memory(pdf_bytes, files["buy"], files["pay"], diagnostics=options,
+                                       diagnostics_key="上传/发票")
+        merge_invoices.merge_to_stream(files["pdf"], files["buy"], files["pay"], io.BytesIO(),
+                                       diagnostics=options, diagnostics_key="流")
+        names = sorted(os.listdir(out_dir))
+        print(f"诊断文件: {names}")
+        for prefix in ("上传__发票", "流"):
+            for suffix in (".prof", ".profile.txt", ".memory.txt"):
+                assert prefix + suffix in names
+
+
+if __name__ == "__main__":
+    test_max_bytes_search()
+    test_max_bytes_reuses_canvas()
+    test_resample_strategies()
+    test_rotate_after_downscale()
+    test_parse_byte_size()
+    test_in_memory_sources()
+    test_preview_matches_full_layout()
+    test_extraction_worker_supersedes()
+    test_single_engine()
+    test_engine_dpi_keeps_a4_page()
+    test_library_diagnostics()
+    print("✅ 测试完成")
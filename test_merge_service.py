@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+HTTP 合并服务与 asyncio 接口测试脚本
+在本机随机端口启动服务，验证上传合并、参数校验、排队上限与统计接口；
+验证 asyncio 接口的合并、批量流式结果与取消
+"""
+
+import base64
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import merge_invoices_service as service_mod
+from test_merge_core import make_sample_triplet
+
+
+def start_service(**kwargs):
+    service = service_mod.MergeService(**kwargs)
+    service.warm_up()
+    server = service_mod.make_server(service, port=0, quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return service, server, f"http://{host}:{port}"
+
+
+def stop_service(service, server):
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def read_triplet(folder):
+    files = make_sample_triplet(folder, "服务测试")
+    fields = {}
+    for field, key in (("invoice", "pdf"), ("buy", "buy"), ("pay", "pay")):
+        with open(files[key], "rb") as f:
+            fields[field] = (os.path.basename(files[key]), f.read())
+    return fields
+
+
+def post(url, fields):
+    content_type, body = service_mod.encode_multipart(fields)
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, dict(response.headers), response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read()
+
+
+def test_service_merge_and_metrics():
+    """上传三件套得到合并 PDF 与发票数据；缺字段返回 400；排队已满返回 503"""
+    service, server, base = start_service(workers=1, max_queue=0)
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            fields = read_triplet(folder)
+
+            status, _, body = post(f"{base}/merge", fields)
+            result = json.loads(body)
+            print(f"JSON 响应: 文件名 {result['filename']}，大小 {result['size']}，耗时 {result['seconds']}s")
+            assert status == 200
+            assert base64.b64decode(result["pdf"]).startswith(b"%PDF")
+            assert result["filename"].endswith(".pdf")
+
+            status, headers, body = post(f"{base}/merge?format=pdf&max_bytes=300K", fields)
+            info = json.loads(headers["X-Invoice-Data"])
+            assert status == 200 and body.startswith(b"%PDF")
+            assert len(body) == info["size"] <= 300 * 1024
+
+            status, _, body = post(f"{base}/merge", {"invoice": fields["invoice"]})
+            assert status == 400 and "buy" in json.loads(body)["error"]
+
+            # 占满唯一的工作槽位，新请求应立即被拒绝
+            service._slots.acquire()
+            status, headers, _ = post(f"{base}/merge", fields)
+            service._slots.release()
+            assert status == 503 and headers.get("Retry-After") == "1"
+
+        with urllib.request.urlopen(f"{base}/health", timeout=10) as response:
+            health = json.loads(response.read())
+        with urllib.request.urlopen(f"{base}/metrics", timeout=10) as response:
+            metrics = response.read().decode("utf-8")
+        print(f"健康检查: {health}")
+        assert health["merged"] == 2 and health["rejected"] == 1 and len(health["worker_pids"]) == 1
+        assert 'invoice_merge_results_total{result="merged"} 2' in metrics
+    finally:
+        stop_service(service, server)
+
+
+def raw_request(base, path, content_length):
+    """发送带有任意 Content-Length 的 POST（不发送请求体），返回状态码"""
+    host, port = base.rsplit("/", 1)[-1].split(":")
+    with socket.create_connection((host, int(port)), timeout=10) as sock:
+        sock.sendall(f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {content_length}\r\n\r\n"
+                     .encode("ascii"))
+        status_line = sock.makefile("rb").readline().decode("ascii")
+    return int(status_line.split()[1])
+
+
+def test_service_rejects_bad_content_length():
+    """Content-Length 无效或为负数时返回 400；未知路径上超过上限的请求体不读入内存，直接返回 404 并关闭连接"""
+    service, server, base = start_service(workers=1, max_upload=1024)
+    try:
+        statuses = {value: raw_request(base, "/merge", value) for value in ("abc", "-1", "4096")}
+        statuses["未知路径"] = raw_request(base, "/other", 10 ** 12)
+        statuses["未知路径 -1"] = raw_request(base, "/other", "-1")
+        print(f"状态码: {statuses}")
+        assert statuses == {"abc": 400, "-1": 400, "4096": 413, "未知路径": 404, "未知路径 -1": 400}
+    finally:
+        stop_service(service, server)
+
+
+def test_async_merge_batch_and_cancel():
+    """asyncio 接口：内存合并、async for 批量结果、等待中的任务可取消"""
+    import asyncio
+
+    from merge_invoices_async import AsyncInvoiceMerger
+
+    async def scenario(folder):
+        fields = read_triplet(folder)
+        async with AsyncInvoiceMerger(workers=1, max_pending=1) as merger:
+            with open(os.path.join(folder, fields["pay"][0]), "rb") as pay_file:
+                data, _ = await merger.merge(fields["invoice"][1], memoryview(fields["buy"][1]), pay_file)
+            assert data.startswith(b"%PDF")
+
+            # max_pending=1：第二个任务在信号量处等待，取消后不会再提交
+            first = asyncio.ensure_future(merger.merge(*(content for _, content in fields.values())))
+            second = asyncio.ensure_future(merger.merge(*(content for _, content in fields.values())))
+            await asyncio.sleep(0.1)
+            second.cancel()
+            assert (await first)[0].startswith(b"%PDF")
+            try:
+                await second
+                raise AssertionError("任务未被取消")
+            except asyncio.CancelledError:
+                pass
+
+            jobs = []
+            for i in range(3):
+                files = make_sample_triplet(folder, f"异步{i}")
+                jobs.append({"key": f"异步{i}", **files, "out_path": os.path.join(folder, f"异步{i}已合并.pdf")})
+            jobs[1]["pdf"] = os.path.join(folder, "不存在.pdf")
+            results = [(job["key"], error) async for job, _, error in merger.merge_batch(jobs)]
+        return results
+
+    with tempfile.TemporaryDirectory() as folder:
+        results = asyncio.run(scenario(folder))
+        print(f"批量结果: {[(key, type(error).__name__ if error else None) for key, error in results]}")
+        assert sorted(key for key, _ in results) == ["异步0", "异步1", "异步2"]
+        assert [key for key, error in results if error] == ["异步1"]
+        assert os.path.exists(os.path.join(folder, "异步2已合并.pdf"))
+
+
+if __name__ == "__main__":
+    test_service_merge_and_metrics()
+    test_service_rejects_bad_content_length()
+    test_async_merge_batch_and_cancel()
+    print("✅ 测试完成")
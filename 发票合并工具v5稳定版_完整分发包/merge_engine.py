@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+合并引擎 - 渲染、布局、合成与编码的唯一实现
+
+命令行（merge_invoices）、简化版（merge_invoices_simple，图形界面与批量队列使用）、流水线、
+HTTP 服务与布局预览都调用本模块，性能优化与布局参数只需修改一处。
+
+三个环节可替换，按名称注册在 RENDERERS / LAYOUTS / ENCODERS 中：
+
+    渲染 renderer(源PDF, dpi) -> Image                       默认 pdfium
+    布局 layout(发票尺寸, 购买记录尺寸, 支付记录尺寸, dpi) -> 布局   默认 adaptive
+    编码 encoder(画布, dpi, quality, scale) -> bytes           默认 pillow
+
+MergeEngine 组合三者；ENGINE 为各入口共用的默认实例。每个环节完成后调用 add_stage_hook
+注册的钩子 hook(阶段, 耗时秒)，基准脚本借此一次统计所有入口的各阶段耗时
+（钩子只在当前进程内生效，隔离工作进程中的合并不会回调）。
+
+只依赖 Pillow；pypdfium2 在第一次渲染时才导入。
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from PIL import Image
+
+# 输入可以是文件路径、内存数据（bytes / bytearray / memoryview）或以二进制方式打开的文件对象
+InputSource = Union[str, "os.PathLike[str]", bytes, bytearray, memoryview, BinaryIO]
+
+# 页面：A4 纵向，15mm 边距，图片间距 5mm，300 DPI
+A4_W_MM, A4_H_MM = 210.0, 297.0
+MARGIN_MM = 15.0
+GAP_MM = 5.0
+PAGE_DPI = 300
+
+# 发票最多占内容区高度的 70%（水平布局）或宽度的 65%（垂直布局）
+INVOICE_MAX_HEIGHT_RATIO = 0.7
+INVOICE_MAX_WIDTH_RATIO = 0.65
+
+# 目标大小模式（max_bytes）的搜索范围
+MIN_JPEG_QUALITY = 35
+MAX_JPEG_QUALITY = 95
+MIN_OUTPUT_SCALE = 0.3
+
+# 缩放质量档位：fast = reduce() 整数预缩小 + BILINEAR；balanced = reduce() + LANCZOS；best = 全分辨率 LANCZOS
+RESAMPLE_STRATEGIES = ("fast", "balanced", "best")
+DEFAULT_RESAMPLE = "best"
+
+STAGE_NAMES = ("render", "compose", "encode")
+
+# pypdfium2 的全局状态不是线程安全的：同一进程中各线程（合并、流水线渲染、布局预览、数据提取）使用 pdfium 时都持有此锁
+PDFIUM_LOCK = threading.RLock()
+
+
+def debug(msg: str) -> None:
+    print(msg)
+
+
+def _resample_filter(name: str) -> int:
+    """按名称取 Pillow 重采样滤镜，兼容旧版 Pillow"""
+    try:
+        Resampling = getattr(Image, "Resampling")
+        return getattr(Resampling, name)
+    except Exception:
+        bicubic = getattr(Image, "BICUBIC", 3)
+        if name == "LANCZOS":
+            return getattr(Image, "LANCZOS", getattr(Image, "ANTIALIAS", bicubic))
+        return getattr(Image, name, bicubic)
+
+
+def resize_image(img: Image.Image, size: Tuple[int, int], strategy: str = DEFAULT_RESAMPLE) -> Image.Image:
+    """按缩放质量档位把图片缩放到 size。
+    fast / balanced 在大倍数缩小时先用 reduce() 做整数倍预缩小（盒式平均，
+    预缩小后尺寸仍不小于目标），再做最后一步插值，大幅减少 LANCZOS 的计算量。
+    balanced 预缩小后保留至少 2 倍余量交给 LANCZOS，画质更接近 best。
+    """
+    if strategy not in RESAMPLE_STRATEGIES:
+        raise ValueError(f"未知的缩放档位: {strategy}")
+
+    new_w, new_h = size
+    if strategy != "best":
+        iw, ih = img.size
+        factor = min(iw // new_w, ih // new_h)
+        if strategy == "balanced":
+            factor //= 2
+        if factor >= 2:
+            img = img.reduce(factor)
+
+    resample = _resample_filter("BILINEAR" if strategy == "fast" else "LANCZOS")
+    return img.resize((new_w, new_h), resample)
+
+
+def fit_into(img: Image.Image, max_w: int, max_h: int, resample: str = DEFAULT_RESAMPLE,
+             rotate: bool = False) -> Image.Image:
+    """等比缩放图片以适应指定区域。
+    rotate=True 时结果为逆时针旋转 90 度后的图片（与 rotate(90, expand=True) 一致），
+    但先在原方向上缩放、再对小图做无损转置，避免在全分辨率大图上旋转。
+    """
+    iw, ih = img.size
+    if rotate:
+        # 旋转后宽高互换，按互换后的尺寸计算缩放系数
+        scale = min(max_w / ih, max_h / iw)
+    else:
+        scale = min(max_w / iw, max_h / ih)
+    new_w = max(1, int(round(iw * scale)))
+    new_h = max(1, int(round(ih * scale)))
+    fitted = resize_image(img, (new_w, new_h), resample)
+    if rotate:
+        fitted = fitted.transpose(_rotate_90())
+    return fitted
+
+
+def _rotate_90() -> int:
+    """逆时针旋转 90 度的转置方式，兼容旧版 Pillow"""
+    Transpose = getattr(Image, "Transpose", None)
+    if Transpose is not None:
+        return Transpose.ROTATE_90
+    return getattr(Image, "ROTATE_90", 2)
+
+
+def describe_source(source: InputSource) -> str:
+    """用于日志与错误信息：路径原样返回，内存数据显示大小"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return f"<内存数据 {memoryview(source).nbytes} 字节>"
+    return f"<文件对象 {getattr(source, 'name', type(source).__name__)}>"
+
+
+def open_pdf(source: InputSource) -> "pdfium.PdfDocument":
+    """打开 PDF：pypdfium2 可直接读取路径、bytes 和二进制文件对象，无需落盘"""
+    # 首次打开 PDF 时才导入 pypdfium2（约占启动时间的三分之一），--help、--merge-shards 等命令启动更快
+    import pypdfium2 as pdfium
+
+    if isinstance(source, (bytearray, memoryview)):
+        source = bytes(source)
+    elif isinstance(source, os.PathLike):
+        source = os.fspath(source)
+    return pdfium.PdfDocument(source)
+
+
+def open_image(source: InputSource) -> Image.Image:
+    """打开图片：Pillow 可读取路径和文件对象，内存数据包装为 BytesIO；已解码的 Image 原样返回"""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    return Image.open(source)
+
+
+def render_first_page(pdf: InputSource, dpi: int = PAGE_DPI) -> Image.Image:
+    """用 pypdfium2 将源 PDF 的第一页渲染为 PIL Image（RGB）。pdf 也可以是内存数据或文件对象。"""
+    scale = dpi / 72.0
+    with PDFIUM_LOCK:
+        document = open_pdf(pdf)
+        try:
+            if len(document) == 0:
+                raise ValueError(f"源 PDF 无页面: {describe_source(pdf)}")
+            page = document[0]
+            try:
+                bitmap = page.render(scale=scale)
+                img = bitmap.to_pil()
+            finally:
+                page.close()
+        finally:
+            document.close()
+    return img.convert("RGB")
+
+
+def mm_to_pixels(mm: float, dpi: int = PAGE_DPI) -> int:
+    return int(round(mm / 25.4 * dpi))
+
+
+def page_geometry(dpi: int = PAGE_DPI) -> Tuple[int, int, int, int, int]:
+    """返回 (页宽, 页高, 边距, 内容区宽, 内容区高)，单位为像素"""
+    page_w = mm_to_pixels(A4_W_MM, dpi)
+    page_h = mm_to_pixels(A4_H_MM, dpi)
+    margin = mm_to_pixels(MARGIN_MM, dpi)
+    return page_w, page_h, margin, page_w - margin * 2, page_h - margin * 2
+
+
+def get_optimal_layout(invoice_size: Tuple[int, int], buy_size: Tuple[int, int], pay_size: Tuple[int, int],
+                       dpi: int = PAGE_DPI) -> Dict[str, Any]:
+    """根据三张图片的尺寸计算最优布局，考虑旋转可能性。
+    只依赖尺寸，不需要像素数据（预览时无需解码全分辨率图片）；返回的区域坐标相对于内容区左上角。
+    """
+    _, _, _, content_w, content_h = page_geometry(dpi)
+    gap = mm_to_pixels(GAP_MM, dpi)
+
+    # 测试所有图片的最佳方向组合
+    best_layout = None
+    best_score = 0
+    best_orientations = {}
+
+    # 遍历所有可能的旋转组合（2^3 = 8种组合）
+    for inv_rot in [False, True]:  # 发票是否旋转
+        for buy_rot in [False, True]:  # 购买记录是否旋转
+            for pay_rot in [False, True]:  # 支付记录是否旋转
+
+                # 计算旋转后的尺寸
+                inv_w, inv_h = invoice_size if not inv_rot else (invoice_size[1], invoice_size[0])
+                buy_w, buy_h = buy_size if not buy_rot else (buy_size[1], buy_size[0])
+                pay_w, pay_h = pay_size if not pay_rot else (pay_size[1], pay_size[0])
+
+                # 计算各图片的宽高比
+                inv_ratio = inv_w / inv_h
+                buy_ratio = buy_w / buy_h
+                pay_ratio = pay_w / pay_h
+
+                # 测试方案1: 发票占上部，两图片并排占下部
+                max_inv_h_1 = min(content_h * INVOICE_MAX_HEIGHT_RATIO, content_w / inv_ratio)
+                inv_scale_1 = min(content_w / inv_w, max_inv_h_1 / inv_h)
+                actual_inv_h_1 = int(inv_h * inv_scale_1)
+
+                remaining_h_1 = content_h - actual_inv_h_1 - gap
+                if remaining_h_1 > 0:
+                    total_width_ratio = buy_ratio + pay_ratio
+                    buy_area_w_1 = int(content_w * (buy_ratio / total_width_ratio))
+                    pay_area_w_1 = content_w - buy_area_w_1
+
+                    buy_scale_1 = min(buy_area_w_1 / buy_w, remaining_h_1 / buy_h)
+                    pay_scale_1 = min(pay_area_w_1 / pay_w, remaining_h_1 / pay_h)
+                else:
+                    buy_scale_1 = pay_scale_1 = 0
+
+                layout_1_score = inv_scale_1 + buy_scale_1 + pay_scale_1
+
+                # 测试方案2: 发票占左侧，两图片纵向排列占右侧
+                max_inv_w_2 = min(content_w * INVOICE_MAX_WIDTH_RATIO, content_h * inv_ratio)
+                inv_scale_2 = min(max_inv_w_2 / inv_w, content_h / inv_h)
+                actual_inv_w_2 = int(inv_w * inv_scale_2)
+
+                remaining_w_2 = content_w - actual_inv_w_2 - gap
+                if remaining_w_2 > 0:
+                    each_h_2 = content_h // 2
+                    buy_scale_2 = min(remaining_w_2 / buy_w, each_h_2 / buy_h)
+                    pay_scale_2 = min(remaining_w_2 / pay_w, each_h_2 / pay_h)
+                else:
+                    buy_scale_2 = pay_scale_2 = 0
+
+                layout_2_score = inv_scale_2 + buy_scale_2 + pay_scale_2
+
+                # 选择当前组合下的最佳布局
+                if layout_1_score >= layout_2_score:
+                    current_score = layout_1_score
+                    current_layout = {
+                        'type': 'horizontal',
+                        'invoice_area': (0, 0, content_w, actual_inv_h_1),
+                        'buy_area': (0, actual_inv_h_1 + gap, buy_area_w_1, remaining_h_1),
+                        'pay_area': (buy_area_w_1, actual_inv_h_1 + gap, pay_area_w_1, remaining_h_1)
+                    }
+                else:
+                    current_score = layout_2_score
+                    current_layout = {
+                        'type': 'vertical',
+                        'invoice_area': (0, 0, actual_inv_w_2, content_h),
+                        'buy_area': (actual_inv_w_2 + gap, 0, remaining_w_2, each_h_2),
+                        'pay_area': (actual_inv_w_2 + gap, each_h_2, remaining_w_2, each_h_2)
+                    }
+
+                # 更新全局最佳方案
+                if current_score > best_score:
+                    best_score = current_score
+                    best_layout = current_layout
+                    best_orientations = {
+                        'invoice_rotate': inv_rot,
+                        'buy_rotate': buy_rot,
+                        'pay_rotate': pay_rot
+                    }
+
+    # 添加旋转信息到布局结果中
+    best_layout['orientations'] = best_orientations
+    return best_layout
+
+
+def compose_page(invoice_img: Image.Image, buy_img_path: InputSource, pay_img_path: InputSource,
+                 resample: str = DEFAULT_RESAMPLE,
+                 layout_func: Callable[..., Dict[str, Any]] = get_optimal_layout,
+                 dpi: int = PAGE_DPI,
+                 on_layout: Optional[Callable[[Dict[str, Any]], None]] = None) -> Image.Image:
+    """使用 Pillow 合成最终单页画布（A4 纵向、白底，默认 300 DPI），智能自适应布局。
+    根据三张图片的实际尺寸和比例，动态调整布局以最大化利用空间。
+    resample 为缩放质量档位，见 RESAMPLE_STRATEGIES；两张记录图可以是路径、内存数据、文件对象或已解码的图片。
+    dpi 须与编码时的 dpi 一致，输出页面才是 A4 大小。on_layout 接收选定的布局（如写入运行报告）。
+    """
+    page_w, page_h, margin, _, _ = page_geometry(dpi)
+
+    # 画布
+    canvas_img = Image.new("RGB", (page_w, page_h), color=(255, 255, 255))
+
+    # 准备三张图片
+    invoice_rgb = invoice_img.convert("RGB")
+    buy_rgb = open_image(buy_img_path).convert("RGB")
+    pay_rgb = open_image(pay_img_path).convert("RGB")
+
+    # 计算最优布局（包含旋转信息）
+    layout = layout_func(invoice_rgb.size, buy_rgb.size, pay_rgb.size, dpi)
+    orientations = layout['orientations']
+    if on_layout:
+        on_layout(layout)
+
+    # 根据最优方案旋转图片（旋转在缩放之后、对缩小后的图片进行）
+    if orientations['invoice_rotate']:
+        debug("发票图片旋转90度以优化布局")
+
+    if orientations['buy_rotate']:
+        debug("购买记录图片旋转90度以优化布局")
+
+    if orientations['pay_rotate']:
+        debug("支付记录图片旋转90度以优化布局")
+
+    def paste_in_area(img: Image.Image, area: Tuple[int, int, int, int], rotate: bool) -> None:
+        """在指定区域内居中粘贴图片"""
+        area_x, area_y, area_w, area_h = area
+        fitted_img = fit_into(img, area_w, area_h, resample, rotate=rotate)
+
+        # 计算居中位置
+        img_w, img_h = fitted_img.size
+        x = margin + area_x + (area_w - img_w) // 2
+        y = margin + area_y + (area_h - img_h) // 2
+
+        canvas_img.paste(fitted_img, (x, y))
+
+    # 按布局粘贴三张图片（缩放后旋转）
+    paste_in_area(invoice_rgb, layout['invoice_area'], orientations['invoice_rotate'])
+    paste_in_area(buy_rgb, layout['buy_area'], orientations['buy_rotate'])
+    paste_in_area(pay_rgb, layout['pay_area'], orientations['pay_rotate'])
+
+    return canvas_img
+
+
+def write_pdf(img: Image.Image, stream: BinaryIO, resolution: float, quality: Optional[int] = None) -> None:
+    """把图片作为单页 PDF 直接写入可 tell() 的二进制流（文件、BytesIO）"""
+    options: Dict[str, Any] = {"resolution": resolution}
+    if quality is not None:
+        options["quality"] = quality
+    img.save(stream, format="PDF", **options)
+
+
+def encode_pdf(canvas_img: Image.Image, dpi: int = PAGE_DPI, quality: Optional[int] = None,
+               scale: float = 1.0) -> bytes:
+    """将合成好的画布编码为单页 PDF。
+    scale < 1 时先缩小画布并按比例降低 resolution，页面物理尺寸保持 A4 不变；
+    quality 为 None 时沿用 Pillow 默认的 JPEG 质量。
+    """
+    img = canvas_img
+    if scale < 1.0:
+        w, h = canvas_img.size
+        new_size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        img = canvas_img.resize(new_size, _resample_filter("LANCZOS"))
+
+    buf = BytesIO()
+    write_pdf(img, buf, dpi * scale, quality)
+    data = buf.getvalue()
+    buf.close()
+    return data
+
+
+def encode_pdf_within_budget(canvas_img: Image.Image, max_bytes: int, dpi: int = PAGE_DPI,
+                             encoder: Callable[..., bytes] = encode_pdf) -> Tuple[bytes, Dict[str, Any]]:
+    """在 max_bytes 限制内寻找质量最好的 PDF 编码。
+    先在原始分辨率下二分搜索 JPEG 质量；若最低质量仍超限，再二分搜索缩放比例，
+    找到能放下的最大分辨率后重新搜索该分辨率下的最高质量。
+    全程复用同一张已合成的画布，不重新渲染。
+    返回 (PDF 数据, 选用的参数)。
+    """
+    attempts: Dict[Tuple[int, int], bytes] = {}
+
+    def encode(quality: int, scale_pct: int) -> bytes:
+        key = (quality, scale_pct)
+        if key not in attempts:
+            attempts[key] = encoder(canvas_img, dpi=dpi, quality=quality, scale=scale_pct / 100.0)
+        return attempts[key]
+
+    def best_quality(scale_pct: int) -> Optional[int]:
+        """返回该缩放比例下能放进预算的最高质量，放不下时返回 None"""
+        lo, hi = MIN_JPEG_QUALITY, MAX_JPEG_QUALITY
+        if len(encode(lo, scale_pct)) > max_bytes:
+            return None
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if len(encode(mid, scale_pct)) <= max_bytes:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    scale_pct = 100
+    quality = best_quality(scale_pct)
+
+    if quality is None:
+        # 最低质量也放不下：在 [MIN_OUTPUT_SCALE, 1) 内二分搜索能放下的最大缩放比例
+        lo, hi = int(MIN_OUTPUT_SCALE * 100), 99
+        fitting: Optional[int] = None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if len(encode(MIN_JPEG_QUALITY, mid)) <= max_bytes:
+                fitting = mid
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        if fitting is not None:
+            scale_pct = fitting
+            quality = best_quality(scale_pct)
+        else:
+            scale_pct = int(MIN_OUTPUT_SCALE * 100)
+
+    fits = quality is not None
+    if quality is None:
+        quality = MIN_JPEG_QUALITY
+    data = encode(quality, scale_pct)
+
+    params = {
+        "max_bytes": max_bytes,
+        "quality": quality,
+        "scale": scale_pct / 100.0,
+        "dpi": round(dpi * scale_pct / 100.0, 1),
+        "size": len(data),
+        "fits": fits,
+        "attempts": len(attempts),
+    }
+    return data, params
+
+
+RENDERERS: Dict[str, Callable[..., Image.Image]] = {"pdfium": render_first_page}
+LAYOUTS: Dict[str, Callable[..., Dict[str, Any]]] = {"adaptive": get_optimal_layout}
+ENCODERS: Dict[str, Callable[..., bytes]] = {"pillow": encode_pdf}
+_BACKENDS = {"renderer": RENDERERS, "layout": LAYOUTS, "encoder": ENCODERS}
+
+_stage_hooks: List[Callable[[str, float], None]] = []
+
+
+def register_backend(kind: str, name: str, func: Callable[..., Any]) -> None:
+    """注册一个渲染（renderer）、布局（layout）或编码（encoder）实现，之后可按名称选用"""
+    if kind not in _BACKENDS:
+        raise ValueError(f"未知的环节: {kind}，可选: {', '.join(_BACKENDS)}")
+    _BACKENDS[kind][name] = func
+
+
+def _backend(kind: str, choice: Union[str, Callable[..., Any]]) -> Callable[..., Any]:
+    if callable(choice):
+        return choice
+    try:
+        return _BACKENDS[kind][choice]
+    except KeyError:
+        raise ValueError(f"未知的{kind}: {choice}，可选: {', '.join(_BACKENDS[kind])}") from None
+
+
+def add_stage_hook(hook: Callable[[str, float], None]) -> None:
+    """注册阶段钩子：任一入口的每个阶段（render / compose / encode）完成后调用 hook(阶段, 耗时秒)"""
+    _stage_hooks.append(hook)
+
+
+def remove_stage_hook(hook: Callable[[str, float], None]) -> None:
+    if hook in _stage_hooks:
+        _stage_hooks.remove(hook)
+
+
+@contextmanager
+def _timed(stage: str, on_stage: Optional[Callable[[str], None]] = None) -> Iterator[None]:
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    for hook in list(_stage_hooks):
+        hook(stage, seconds)
+    if on_stage:
+        on_stage(stage)
+
+
+class MergeEngine:
+    """渲染 → 布局/合成 → 编码。三个环节可用已注册的名称或函数替换；实例无状态，可在多个线程中共用"""
+
+    def __init__(self, renderer: Union[str, Callable[..., Image.Image]] = "pdfium",
+                 layout: Union[str, Callable[..., Dict[str, Any]]] = "adaptive",
+                 encoder: Union[str, Callable[..., bytes]] = "pillow", dpi: int = PAGE_DPI):
+        self.renderer = _backend("renderer", renderer)
+        self.layout = _backend("layout", layout)
+        self.encoder = _backend("encoder", encoder)
+        self.dpi = dpi
+
+    def render(self, pdf: InputSource, on_stage: Optional[Callable[[str], None]] = None) -> Image.Image:
+        with _timed("render", on_stage):
+            return self.renderer(pdf, self.dpi)
+
+    def compose(self, invoice_img: Image.Image, buy: InputSource, pay: InputSource,
+                resample: str = DEFAULT_RESAMPLE, on_stage: Optional[Callable[[str], None]] = None,
+                on_layout: Optional[Callable[[Dict[str, Any]], None]] = None) -> Image.Image:
+        with _timed("compose", on_stage):
+            return compose_page(invoice_img, buy, pay, resample=resample, layout_func=self.layout, dpi=self.dpi,
+                                on_layout=on_layout)
+
+    def encode(self, canvas_img: Image.Image, max_bytes: Optional[int] = None,
+               on_stage: Optional[Callable[[str], None]] = None) -> Tuple[bytes, Optional[Dict[str, Any]]]:
+        """返回 (PDF 数据, 压缩参数)；未指定 max_bytes 时压缩参数为 None"""
+        with _timed("encode", on_stage):
+            if max_bytes:
+                return encode_pdf_within_budget(canvas_img, max_bytes, dpi=self.dpi, encoder=self.encoder)
+            return self.encoder(canvas_img, dpi=self.dpi), None
+
+    def encode_to_stream(self, canvas_img: Image.Image, stream: BinaryIO,
+                         max_bytes: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """编码并写入二进制流。默认编码器、未限制大小且流支持 tell() 时直接编码进流，不生成中间的 bytes"""
+        if not max_bytes and self.encoder is encode_pdf:
+            try:
+                stream.tell()
+            except (AttributeError, OSError):
+                pass
+            else:
+                with _timed("encode"):
+                    write_pdf(canvas_img, stream, self.dpi)
+                return None
+        data, params = self.encode(canvas_img, max_bytes)
+        stream.write(data)
+        return params
+
+    def merge(self, pdf: InputSource, buy: InputSource, pay: InputSource, max_bytes: Optional[int] = None,
+              resample: str = DEFAULT_RESAMPLE, on_stage: Optional[Callable[[str], None]] = None,
+              on_layout: Optional[Callable[[Dict[str, Any]], None]] = None) -> Tuple[bytes, Optional[Dict[str, Any]]]:
+        """完整合并，返回 (PDF 数据, 压缩参数)。on_stage 在每个阶段完成后调用，on_layout 接收选定的布局"""
+        invoice_img = self.render(pdf, on_stage)
+        canvas_img = self.compose(invoice_img, buy, pay, resample, on_stage, on_layout)
+        return self.encode(canvas_img, max_bytes, on_stage)
+
+
+# 各入口共用的默认引擎
+ENGINE = MergeEngine()